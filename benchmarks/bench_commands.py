@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+
+Cost of the bamcli commands against zones of 10 to 100k records
+
+For each zone size a mock BAM (bluecat_am.mockbam) is filled with one zone,
+zone1.bigcorp.ca, of that many records and these commands are run, each as
+a fresh bamcli invocation would (the session token and the zone and
+network indexes are on disk, the in-process caches start empty):
+
+    view host    bamcli view host7.zone1.bigcorp.ca
+    view zone    bamcli view zone1.bigcorp.ca
+    add          bamcli add bench.zone1.bigcorp.ca A <ip>
+    update       bamcli update host7.zone1.bigcorp.ca A <ip>
+    renumber     bamcli update host7.zone1.bigcorp.ca A <ip>,<ip>,... (50 addresses)
+    delete       bamcli delete bench.zone1.bigcorp.ca A <ip>
+    view rights  bamcli view rights
+
+and for each one the wall time, the memory allocated (the peak traced by
+tracemalloc, in a second run) and the number of HTTP calls the mock BAM
+answered are reported.
+
+The BAM throttles us long before our CPU matters, so the call counts have
+budgets, in budgets.json next to this file. A scenario costing more calls
+than its budget fails the run (exit status 1). After a change that
+lowers (or knowingly raises) the counts, record them with --update.
+
+E.g.
+    $ python benchmarks/bench_commands.py
+    $ python benchmarks/bench_commands.py --sizes 10,1000 --latency 0.005
+    $ python benchmarks/bench_commands.py --update
+
+"""
+
+import argparse
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from click.testing import CliRunner
+
+from bluecat_am import cache, config, mockbam, netindex
+from bluecat_am.cli import run
+
+BudgetFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'budgets.json')
+Sizes = (10, 100, 1000, 10000, 100000)
+Zone = 'zone1.bigcorp.ca'
+
+
+def scenarios(ip, new_ip, many):
+    return (
+        ('view host', 'view host7.{}'.format(Zone)),
+        ('view zone', 'view {}'.format(Zone)),
+        ('add', 'add bench.{} A {}'.format(Zone, ip)),
+        ('update', 'update host7.{} A {}'.format(Zone, new_ip)),
+        ('renumber', 'update host7.{} A {}'.format(Zone, ','.join(many))),
+        ('delete', 'delete bench.{} A {}'.format(Zone, ip)),
+        ('view rights', 'view rights'),
+    )
+
+
+def bamcli(bam, cmd):
+    """Run cmd as a new bamcli invocation would, return the calls it cost"""
+    config.Session = None
+    config.ZoneTree = None
+    config.NetTree = None
+    cache.Resolve.clear()
+    cache.Entities.clear()
+    before = sum(bam.calls.values())
+    args = ['-U', bam.url, '-p', 'secret', '--no-daemon'] + shlex.split(cmd)
+    result = CliRunner().invoke(run, args)
+    if result.exception is not None and not isinstance(result.exception, SystemExit):
+        raise RuntimeError('bamcli {} failed: {!r}'.format(cmd, result.exception))
+    return sum(bam.calls.values()) - before
+
+
+def measure(size, latency):
+    """{scenario: (seconds, peak bytes, calls)} for a zone of size records"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, mockbam.MockBam(latency=latency) as bam:
+        config.TokenCacheFile = os.path.join(tmp, 'session.json')
+        config.ZoneIndexFile = os.path.join(tmp, 'zones.json')
+        config.NetIndexFile = os.path.join(tmp, 'networks.json')
+        tree = mockbam.generate(bam.store, records=size, zones=1)
+        ip, new_ip = tree['addresses'].take(), tree['addresses'].take()
+        many = [tree['addresses'].take() for _ in range(50)]
+        # log in and build the indexes once, as earlier invocations would have
+        bamcli(bam, 'view {}'.format(Zone))
+        netindex.get_index()
+
+        for name, cmd in scenarios(ip, new_ip, many):
+            start = time.perf_counter()
+            calls = bamcli(bam, cmd)
+            results[name] = [time.perf_counter() - start, 0, calls]
+        # the same again with allocations traced, which slows everything down
+        for name, cmd in scenarios(ip, new_ip, many):
+            tracemalloc.start()
+            bamcli(bam, cmd)
+            results[name][1] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        config.Session.close()
+    return results
+
+
+def load_budgets():
+    try:
+        with open(BudgetFile) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the bamcli commands against a mock BAM')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in Sizes),
+                        help='comma separated zone sizes, default %(default)s')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--update', action='store_true', help='record the call counts as the budgets')
+    args = parser.parse_args()
+
+    budgets = load_budgets()
+    over = []
+    fmt = '{:>7} {:<12} {:>9} {:>10} {:>7} {:>7}'
+    print(fmt.format('records', 'command', 'seconds', 'peak KiB', 'calls', 'budget'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for name, (seconds, peak, calls) in measure(size, args.latency).items():
+            budget = budgets.get(name, {}).get(str(size))
+            if args.update:
+                budgets.setdefault(name, {})[str(size)] = calls
+            elif budget is not None and calls > budget:
+                over.append('{} at {} records: {} calls, budget {}'.format(name, size, calls, budget))
+            print(fmt.format(size, name, '{:.3f}'.format(seconds), '{:.0f}'.format(peak / 1024), calls,
+                             '-' if budget is None else budget))
+
+    if args.update:
+        with open(BudgetFile, 'w') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('budgets written to {}'.format(BudgetFile))
+    if over:
+        print('\nover budget:')
+        for line in over:
+            print('    ' + line)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
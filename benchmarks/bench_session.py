@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+
+Per-call overhead of a fresh connection vs the pooled keep-alive Session
+
+Starts a small HTTP/1.1 stand-in for the BAM REST getEntityById call on a
+local port, then times the same number of calls made
+
+    a. with module-level requests.get(), a new connection per call
+    b. with api.bam_request(), the shared pooled Session
+
+E.g.
+    $ python benchmarks/bench_session.py 500
+
+"""
+
+import json
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bluecat_am import api, config
+
+ENTITY = {
+    'id': 2217650,
+    'name': 'utoronto',
+    'properties': 'deployable=true|absoluteName=utoronto.ca|',
+    'type': 'Zone',
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = json.dumps(ENTITY).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(label, calls, func):
+    start = time.perf_counter()
+    for i in range(calls):
+        func()
+    elapsed = time.perf_counter() - start
+    print('{:<24} {:>6} calls {:>8.3f} s {:>9.1f} us/call'.format(
+        label, calls, elapsed, elapsed / calls * 1e6))
+    return elapsed
+
+
+def main(calls=200):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.Baseurl = 'http://127.0.0.1:{}/Services/REST/v1/'.format(server.server_port)
+    url = config.Baseurl + 'getEntityById'
+    params = {'id': '2217650'}
+
+    def fresh():
+        requests.get(url, params=params).json()
+
+    def pooled():
+        # bam_request rather than get_entity_by_id, which would answer from the entity cache
+        api.bam_request('GET', url, params=params).json()
+
+    before = timed('new connection per call', calls, fresh)
+    after = timed('pooled keep-alive', calls, pooled)
+    print('speedup: {:.1f}x'.format(before / after))
+
+    api.close_session()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
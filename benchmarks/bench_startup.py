@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+
+How long bamcli takes to start, before it talks to any BAM
+
+Each scenario is run --runs times in a new Python process:
+
+    python       python -c pass, the interpreter alone
+    import cli   import bluecat_am.cli
+    --help       bamcli --help
+    find usage   bamcli find, which stops at the missing argument
+
+and the best wall time is reported (the others measure what else the
+machine was busy with), with what it costs over the bare interpreter.
+Automation runs bamcli thousands of times a day, so that cost has a
+budget in startup_budgets.json next to this file, in milliseconds.
+None of these needs the network, so none may load requests or
+pkg_resources either. A scenario over its budget, or loading one of them,
+fails the run (exit status 1). --update records the times measured, plus
+half again for slower machines, as the budgets.
+
+E.g.
+    $ python benchmarks/bench_startup.py
+    $ python benchmarks/bench_startup.py --runs 50
+    $ python benchmarks/bench_startup.py --update
+
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+BudgetFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budgets.json')
+Heavy = ('requests', 'pkg_resources', 'bluecat_am.api')
+Margin = 1.5
+
+Scenarios = (
+    ('python', 'pass'),
+    ('import cli', 'import bluecat_am.cli'),
+    ('--help', 'from bluecat_am.cli import run; run(["--help"])'),
+    ('find usage', 'from bluecat_am.cli import run; run(["find"])'),
+)
+
+Wrapper = '''
+import json, sys
+try:
+    {}
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write(json.dumps([m for m in {!r} if m in sys.modules]) + '\\n')
+'''
+
+
+def start(code):
+    """(seconds, heavy modules loaded) of one python -c code"""
+    before = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', Wrapper.format(code, Heavy)],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    seconds = time.perf_counter() - before
+    # the last line written before any traceback
+    line = [line for line in proc.stderr.splitlines() if line.startswith('[')][-1]
+    return seconds, json.loads(line)
+
+
+def measure(runs):
+    """{scenario: (best seconds, heavy modules loaded)}"""
+    results = {}
+    for name, code in Scenarios:
+        times = []
+        for _ in range(runs):
+            seconds, loaded = start(code)
+            times.append(seconds)
+        results[name] = (min(times), loaded)
+    return results
+
+
+def load_budgets():
+    try:
+        with open(BudgetFile) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time how long bamcli takes to start')
+    parser.add_argument('--runs', type=int, default=20, help='processes started per scenario, default %(default)s')
+    parser.add_argument('--update', action='store_true', help='record the times measured as the budgets')
+    args = parser.parse_args()
+
+    budgets = load_budgets()
+    results = measure(max(1, args.runs))
+    bare = results['python'][0]
+    over = []
+    fmt = '{:<12} {:>9} {:>12} {:>7}  {}'
+    print(fmt.format('scenario', 'best', 'over python', 'budget', 'loaded'))
+    for name, (seconds, loaded) in results.items():
+        cost = (seconds - bare) * 1000
+        budget = budgets.get(name)
+        if name == 'python':
+            budget = None
+        elif args.update:
+            budget = budgets[name] = max(5, math.ceil(cost * Margin))
+        elif budget is not None and cost > budget:
+            over.append('{}: {:.0f}ms over python, budget {}ms'.format(name, cost, budget))
+        if loaded:
+            over.append('{}: loaded {}'.format(name, ', '.join(loaded)))
+        print(fmt.format(name, '{:.0f}ms'.format(seconds * 1000), '{:.0f}ms'.format(cost),
+                         '-' if budget is None else '{}ms'.format(budget), ', '.join(loaded) or '-'))
+
+    if args.update:
+        with open(BudgetFile, 'w') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('budgets written to {}'.format(BudgetFile))
+    if over:
+        print('\nover budget:')
+        for line in over:
+            print('    ' + line)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
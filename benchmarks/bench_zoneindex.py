@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+
+Cost of building and refreshing the zone index, with 10 to 1000 zones
+
+bench_commands.py builds the zone index before it times anything, as the
+runs before it would have. This times the runs that pay for it, against
+a mock BAM of that many zones (zone1.bigcorp.ca ... with 10 records each):
+
+    cold find    bamcli find host1.zone1.bigcorp.ca A, with no zone index on disk
+    stale find   the same with the index on disk older than config.ZoneIndexTTL
+
+and reports the wall time and the HTTP calls of each. A stale index is
+listed again in full, so both cost about one call per 10 zones. The
+calls have budgets in budgets.json next to this file, under these names;
+a run over budget exits with status 1, --update records the counts as
+the budgets.
+
+E.g.
+    $ python benchmarks/bench_zoneindex.py
+    $ python benchmarks/bench_zoneindex.py --zones 10,1000 --latency 0.005
+
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from bluecat_am import config, mockbam, zoneindex
+
+from bench_commands import BudgetFile, bamcli, load_budgets
+
+Zones = (10, 100, 1000)
+
+
+def measure(zones, latency):
+    """{scenario: (seconds, calls)} for a BAM of that many zones"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, mockbam.MockBam(latency=latency) as bam:
+        config.TokenCacheFile = os.path.join(tmp, 'session.json')
+        config.ZoneIndexFile = os.path.join(tmp, 'zones.json')
+        config.NetIndexFile = os.path.join(tmp, 'networks.json')
+        mockbam.generate(bam.store, records=zones * 10, zones=zones)
+        cmd = 'find host1.zone1.bigcorp.ca A'
+        # log in once, so that only the zone index is missing
+        bamcli(bam, 'zones')
+        os.unlink(config.ZoneIndexFile)
+
+        start = time.perf_counter()
+        calls = bamcli(bam, cmd)
+        results['cold find'] = (time.perf_counter() - start, calls)
+
+        with open(config.ZoneIndexFile) as f:
+            index = json.load(f)
+        index['listed'] -= config.ZoneIndexTTL + 1
+        for info in index['zones'].values():
+            info['listed'] -= config.ZoneIndexTTL + 1
+        with open(config.ZoneIndexFile, 'w') as f:
+            json.dump(index, f)
+        start = time.perf_counter()
+        calls = bamcli(bam, cmd)
+        results['stale find'] = (time.perf_counter() - start, calls)
+        assert len(zoneindex.load()) >= zones
+        config.Session.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time building the zone index against a mock BAM')
+    parser.add_argument('--zones', default=','.join(str(z) for z in Zones),
+                        help='comma separated zone counts, default %(default)s')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--update', action='store_true', help='record the call counts as the budgets')
+    args = parser.parse_args()
+
+    budgets = load_budgets()
+    over = []
+    fmt = '{:>6} {:<12} {:>9} {:>7} {:>7}'
+    print(fmt.format('zones', 'command', 'seconds', 'calls', 'budget'))
+    for zones in [int(z) for z in args.zones.split(',')]:
+        for name, (seconds, calls) in measure(zones, args.latency).items():
+            budget = budgets.get(name, {}).get(str(zones))
+            if args.update:
+                budgets.setdefault(name, {})[str(zones)] = calls
+            elif budget is not None and calls > budget:
+                over.append('{} with {} zones: {} calls, budget {}'.format(name, zones, calls, budget))
+            print(fmt.format(zones, name, '{:.3f}'.format(seconds), calls, '-' if budget is None else budget))
+
+    if args.update:
+        with open(BudgetFile, 'w') as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('budgets written to {}'.format(BudgetFile))
+    if over:
+        print('\nover budget:')
+        for line in over:
+            print('    ' + line)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
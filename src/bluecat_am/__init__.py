@@ -1,11 +1,22 @@
 # -*- coding: utf-8 -*-
-from pkg_resources import get_distribution, DistributionNotFound
 
-try:
-    # Change here if project is renamed and does not equal the package name
-    dist_name = 'bamcli'
-    __version__ = get_distribution(dist_name).version
-except DistributionNotFound:
-    __version__ = 'unknown'
-finally:
-    del get_distribution, DistributionNotFound
+# Change here if project is renamed and does not equal the package name
+dist_names = ('BlueCat-Address-Manager', 'bamcli')
+
+
+def __getattr__(name):
+    # looked up on first use: reading the installed metadata costs more
+    # than the rest of a bamcli --help
+    if name != '__version__':
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    from importlib.metadata import version, PackageNotFoundError
+    for dist_name in dist_names:
+        try:
+            value = version(dist_name)
+            break
+        except PackageNotFoundError:
+            pass
+    else:
+        value = 'unknown'
+    globals()['__version__'] = value
+    return value
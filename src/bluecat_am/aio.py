@@ -0,0 +1,268 @@
+"""
+
+asyncio BAM client
+
+The functions in bluecat_am.api block, so a service that talks to the BAM
+from an event loop would have to park one thread per call. AsyncBam speaks
+the same REST calls with aiohttp instead:
+
+    * one aiohttp connection pool per client, with keep-alive,
+      config.PoolMaxsize connections per host
+    * an asyncio.Semaphore capping the calls in flight (config.MaxWorkers)
+    * plain asyncio cancellation: cancelling a task aborts its HTTP call,
+      and gather() cancels the rest of a batch when one call fails
+    * a 401 on an authenticated call logs in again once, when the
+      client was given credentials
+
+By default it reuses the session token, Configuration and View of the
+synchronous side (config.AuthHeader, config.ViewId ...), so it can be used
+straight after util.bam_init(). E.g.
+
+    async with AsyncBam() as bam:
+        zone = await bam.get_entity_by_name(view_id, 'utoronto', 'Zone')
+        ents = await bam.gather(bam.get_entity_by_id(i) for i in ids)
+        async for rr in bam.iter_entities(zone['id'], 'HostRecord'):
+            ...
+
+aiohttp is an optional dependency: pip install BlueCat-Address-Manager[async]
+
+"""
+
+import asyncio
+
+from bluecat_am import config
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def to_params(d):
+    """aiohttp wants str query values and repeated keys as a list of pairs"""
+    pairs = []
+    for k, v in d.items():
+        for item in (v if isinstance(v, (list, tuple)) else [v]):
+            pairs.append((k, item if isinstance(item, str) else str(item)))
+    return pairs
+
+
+class AsyncBam:
+    """asyncio counterpart of the generic calls in bluecat_am.api"""
+
+    def __init__(self, baseurl=None, auth_header=None, view_id=None, creds=None,
+                 limit=None, pool_size=None, timeout=None):
+        if aiohttp is None:
+            raise ImportError('AsyncBam needs aiohttp: pip install BlueCat-Address-Manager[async]')
+        self.baseurl = baseurl or config.Baseurl
+        self.auth_header = dict(auth_header or config.AuthHeader)
+        self.view_id = view_id or config.ViewId
+        self.creds = creds or config.Credentials
+        self.limit = asyncio.Semaphore(limit or config.MaxWorkers)
+        self.pool_size = pool_size or config.PoolMaxsize
+        self.timeout = timeout
+        self.session = None
+        self.relogin_lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            timeout = aiohttp.ClientTimeout(total=self.timeout)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def call(self, method, endpoint, params=None, json=None, auth=True):
+        """Send one REST call and return (status, decoded JSON or text)"""
+        await self.open()
+        url = self.baseurl + endpoint
+        qs = to_params(params or {})
+        for attempt in (1, 2):
+            sent = self.auth_header
+            async with self.limit:
+                async with self.session.request(method, url, params=qs, json=json,
+                                                headers=sent if auth else None) as resp:
+                    status = resp.status
+                    try:
+                        body = await resp.json(content_type=None)
+                    except ValueError:
+                        body = await resp.text()
+            if status == 401 and auth and self.creds and attempt == 1:
+                if await self.relogin(sent):
+                    continue
+            break
+        return status, body
+
+    async def relogin(self, stale):
+        async with self.relogin_lock:
+            if self.auth_header != stale:
+                return True
+            return bool(await self.login(self.creds['username'], self.creds['password']))
+
+    async def json(self, method, endpoint, params=None, json=None):
+        status, body = await self.call(method, endpoint, params, json)
+        return body
+
+    async def gather(self, aws):
+        """Run awaitables concurrently, results in order; if one fails cancel the others"""
+        tasks = [asyncio.ensure_future(aw) for aw in aws]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    '''
+
+    Session
+
+    '''
+
+    async def login(self, user, pw):
+        status, body = await self.call('GET', 'login', {'username': user, 'password': pw}, auth=False)
+        if status != 200:
+            return False
+        token = body.split()[3]
+        self.creds = {'username': user, 'password': pw}
+        self.auth_header = {
+            'Authorization': 'BAMAuthToken: ' + token,
+            'Content-Type': 'application/json'
+        }
+        return token
+
+    async def logout(self):
+        await self.call('GET', 'logout')
+
+    '''
+
+    Getting objects
+
+    '''
+
+    async def get_entity_by_name(self, eid, name, typ):
+        return await self.json('GET', 'getEntityByName', {'parentId': eid, 'name': name, 'type': typ})
+
+    async def get_entity_by_id(self, entityid):
+        return await self.json('GET', 'getEntityById', {'id': entityid})
+
+    async def get_entities(self, parentid, typ, start=0, count=10):
+        return await self.json('GET', 'getEntities',
+                               {'parentId': parentid, 'type': typ, 'start': start, 'count': count})
+
+    async def get_entities_by_name(self, parentid, name, obj_type, start=0, count=10):
+        params = {'parentId': parentid, 'name': name, 'type': obj_type, 'start': start, 'count': count}
+        return await self.json('GET', 'getEntitiesByName', params)
+
+    async def get_parent(self, childid):
+        return await self.json('GET', 'getParent', {'entityId': childid})
+
+    async def iter_pages(self, fetch, first=None, largest=None):
+        """async version of api.iter_pages, the next page is requested before
+        the current one is handed out"""
+        count = first or config.FirstPageSize
+        largest = largest or config.MaxPageSize
+        start = 0
+        page = await fetch(start, count)
+        ahead = None
+        try:
+            while isinstance(page, list):
+                full = len(page) >= count
+                if full:
+                    start += len(page)
+                    count = min(count * 2, largest)
+                    ahead = asyncio.ensure_future(fetch(start, count))
+                for item in page:
+                    yield item
+                if not full:
+                    break
+                page = await ahead
+                ahead = None
+        finally:
+            if ahead is not None:
+                ahead.cancel()
+
+    def iter_entities(self, parentid, typ, first=None):
+        return self.iter_pages(lambda start, count: self.get_entities(parentid, typ, start, count), first)
+
+    def iter_search(self, key, types, first=None):
+        return self.iter_pages(lambda start, count: self.search_by_object_types(key, types, start, count), first)
+
+    '''
+
+    Searching
+
+    '''
+
+    async def custom_search(self, filters, typ, start=0, count=10):
+        params = {'filters': filters, 'type': typ, 'options': '', 'start': start, 'count': count}
+        return await self.json('GET', 'customSearch', params)
+
+    async def search_by_category(self, key, category, start=0, count=10):
+        params = {'keyword': key, 'category': category, 'start': start, 'count': count}
+        return await self.json('GET', 'searchByCategory', params)
+
+    async def search_by_object_types(self, key, types, start=0, count=10):
+        params = {'keyword': key, 'types': types, 'start': start, 'count': count}
+        status, body = await self.call('GET', 'searchByObjectTypes', params)
+        return body if status == 200 else None
+
+    '''
+
+    Updating and deleting
+
+    '''
+
+    async def update(self, entity):
+        status, body = await self.call('PUT', 'update', json=entity)
+        return status
+
+    async def delete(self, obj_id):
+        status, body = await self.call('DELETE', 'delete', {'objectId': obj_id})
+        return status
+
+    async def delete_with_options(self, obj_id, options):
+        status, body = await self.call('DELETE', 'deleteWithOptions', {'objectId': obj_id, 'options': options})
+        return status
+
+    '''
+
+    Adding resource records
+
+    '''
+
+    async def add_host_record(self, fqdn, ips, ttl=86400, properties='comments=EmTee|'):
+        params = {'viewId': self.view_id, 'absoluteName': fqdn, 'addresses': ips,
+                  'ttl': ttl, 'properties': properties}
+        status, body = await self.call('POST', 'addHostRecord', params)
+        return body if status == 200 else False
+
+    async def add_txt_record(self, absname, txt, ttl=86400, props='comments=EmTee|'):
+        params = {'viewId': self.view_id, 'absoluteName': absname, 'txt': txt, 'ttl': ttl, 'properties': props}
+        return await self.json('POST', 'addTXTRecord', params)
+
+    async def add_mx_record(self, absname, priority, mx_host, ttl=86400, props='comments=EmTee|'):
+        params = {'viewId': self.view_id, 'absoluteName': absname, 'priority': priority,
+                  'linkedRecordName': mx_host, 'ttl': ttl, 'properties': props}
+        return await self.json('POST', 'addMXRecord', params)
+
+    async def add_alias_record(self, absname, link, ttl=86400, props='comments=EmTee|'):
+        params = {'viewId': self.view_id, 'absoluteName': absname, 'linkedRecordName': link,
+                  'ttl': ttl, 'properties': props}
+        return await self.json('POST', 'addAliasRecord', params)
+
+    async def add_generic_record(self, absname, rr_type, rr_data, ttl=86400, props='comments=EmTee|'):
+        params = {'viewId': self.view_id, 'absoluteName': absname, 'type': rr_type,
+                  'rdata': rr_data, 'ttl': ttl, 'properties': props}
+        return await self.json('POST', 'addGenericRecord', params)
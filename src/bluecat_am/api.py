@@ -28,9 +28,127 @@ User Group Webinar - Making APIs Work for You - Episode 1
 
 """
 
+import threading
+import time
+
 import requests
 
-from bluecat_am import config, util
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+from bluecat_am import cache, config, netindex, singleflight, util, zoneindex
+
+'''
+
+HTTP Session
+
+Every call below goes through bam_request() and so through one shared
+requests.Session. The Session keeps its TCP/TLS connections alive between
+calls, so only the first call to the BAM server pays for the handshake.
+
+The pool is sized from config:
+
+    PoolConnections: the number of per-host connection pools to keep
+    PoolMaxsize:     the maximum number of connections kept alive per host
+    PoolBlock:       if True, never open more than PoolMaxsize connections
+                     to a host; callers wait for a free one instead
+
+config.RequestCounts counts the requests sent, by HTTP method. While
+config.Profiler is set each one is also timed and recorded, see
+profiler.py. While config.Cassette is set the Session records its calls
+to a file, or answers them from one, see cassette.py.
+
+Identical GETs in flight at the same time (same URL, parameters and
+token) are sent once: the first caller makes the call and the others
+wait for its Response (Flights, a singleflight.Group, counts the calls
+saved). Each caller still decodes the body itself, as callers change the
+entities they get. Every other request starts a new generation of keys,
+(when it starts and when it ends), so a GET sent after a write never
+shares the answer of one sent before it. config.Coalesce turns this off.
+
+'''
+
+CountLock = threading.Lock()
+Flights = singleflight.Group()
+Generation = [0]
+
+
+def get_session():
+    """Return the shared keep-alive Session, creating it on first use"""
+    if config.Session is None:
+        adapter = HTTPAdapter(
+            pool_connections=config.PoolConnections,
+            pool_maxsize=config.PoolMaxsize,
+            pool_block=config.PoolBlock,
+        )
+        if config.Cassette is not None:
+            adapter = config.Cassette.wrap(adapter)
+        sess = requests.Session()
+        sess.mount('https://', adapter)
+        sess.mount('http://', adapter)
+        config.Session = sess
+    return config.Session
+
+
+def close_session():
+    """Close all pooled connections, the next call opens a fresh Session"""
+    if config.Session is not None:
+        config.Session.close()
+        config.Session = None
+
+
+def bam_request(method, url, **kwargs):
+    """Send one HTTP request to the BAM over the shared Session
+
+    A 401 on an authenticated call means the session token has expired,
+    log in again once and resend the request with the new token
+    """
+    if method == 'GET' and config.Coalesce:
+        return Flights.do(flight_key(url, kwargs), fetch, method, url, **kwargs)
+    with CountLock:
+        Generation[0] += 1
+    try:
+        return fetch(method, url, **kwargs)
+    finally:
+        with CountLock:
+            Generation[0] += 1
+
+
+def flight_key(url, kwargs):
+    """Hashable key of a GET: the generation, URL, parameters, token and other options"""
+    params = kwargs.get('params') or {}
+    items = tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple)) else str(v)) for k, v in params.items()))
+    auth = (kwargs.get('headers') or {}).get('Authorization')
+    rest = tuple(sorted((k, repr(v)) for k, v in kwargs.items() if k not in ('params', 'headers')))
+    return Generation[0], url, items, auth, rest
+
+
+def fetch(method, url, **kwargs):
+    req = send(method, url, **kwargs)
+    headers = kwargs.get('headers') or {}
+    if req.status_code == 401 and 'Authorization' in headers and config.Credentials:
+        if util.bam_relogin():
+            kwargs['headers'] = dict(headers, Authorization=config.AuthHeader['Authorization'])
+            req = send(method, url, **kwargs)
+    # read the body now, the Response may be handed to several callers
+    req.content
+    return req
+
+
+def send(method, url, **kwargs):
+    with CountLock:
+        config.RequestCounts[method] += 1
+    profiler = config.Profiler
+    if profiler is None:
+        return get_session().request(method, url, **kwargs)
+    start = time.perf_counter()
+    req = None
+    try:
+        req = get_session().request(method, url, **kwargs)
+        return req
+    finally:
+        profiler.record(method, url, kwargs, req, start)
+
 
 '''
 
@@ -73,7 +191,7 @@ Parameter Description
 def get_entity_by_name(eid, name, typ):
     url = config.Baseurl + 'getEntityByName'
     params = {'parentId': eid, 'name': name, 'type': typ}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -102,10 +220,16 @@ Returns E.g.
 
 
 def get_entity_by_id(entityid):
+    ent = cache.get_entity(entityid)
+    if ent is not None:
+        return ent
     url = config.Baseurl + 'getEntityById'
     params = {'id': str(entityid)}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
-    return req.json()
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
+    ent = req.json()
+    if isinstance(ent, dict):
+        cache.remember([ent])
+    return ent
 
 
 '''
@@ -147,10 +271,73 @@ Returns a list of branch items given the root one level up
 def get_entities(parentid, typ, start=0, count=10):
     url = config.Baseurl + 'getEntities'
     params = {'parentId': parentid, 'type': typ, 'start': start, 'count': count}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
+'''
+
+Paging through long lists
+
+getEntities and the other list calls take a start and a count. Rather
+than guess a count, iter_pages() streams every page lazily:
+
+    * the first page asks for config.FirstPageSize objects; each full
+      page doubles the next request, up to config.MaxPageSize, so small
+      zones cost one small call and large ones few calls
+    * once a full page arrives the next one is requested in a background
+      thread while the caller works through the current one
+    * a short (or non list, i.e. error) page ends the iteration
+
+E.g.
+    for ent in iter_entities(zone_id, 'HostRecord'):
+        ...
+
+'''
+
+
+def iter_pages(fetch, first=None, largest=None):
+    """Yield the objects of every page of fetch(start, count)"""
+    count = first or config.FirstPageSize
+    largest = largest or config.MaxPageSize
+    start = 0
+    pool = ThreadPoolExecutor(max_workers=1)
+    ahead = None
+    try:
+        page = fetch(start, count)
+        while isinstance(page, list):
+            full = len(page) >= count
+            if full:
+                start += len(page)
+                count = min(count * 2, largest)
+                ahead = pool.submit(config.carry(fetch), start, count)
+            yield from page
+            if not full:
+                break
+            page = ahead.result()
+            ahead = None
+    finally:
+        if ahead is not None:
+            ahead.cancel()
+        pool.shutdown(wait=False)
+
+
+def iter_entities(parentid, typ, first=None):
+    return iter_pages(lambda start, count: get_entities(parentid, typ, start, count), first)
+
+
+def iter_entities_by_name(parentid, name, typ, first=None):
+    return iter_pages(lambda start, count: get_entities_by_name(parentid, name, typ, start, count), first)
+
+
+def iter_search(key, types, first=None):
+    return iter_pages(lambda start, count: search_by_object_types(key, types, start, count), first)
+
+
+def iter_access_rights_for_user(user_id, first=None):
+    return iter_pages(lambda start, count: get_access_rights_for_user(user_id, start, count), first)
+
+
 '''
 
 Get Parent
@@ -176,7 +363,7 @@ E.g. parent object:
 def get_parent(childid):
     url = config.Baseurl + 'getParent'
     params = {'entityId': str(childid)}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -325,7 +512,7 @@ def custom_search(filters, typ, start=0, count=10):
         'start': start,
         'count': count,
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -369,7 +556,7 @@ def search_by_category(key, category, start=0, count=10):
         'count': count
     }
 
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -411,7 +598,7 @@ def search_by_object_types(key, types, start=0, count=10):
         'start': start,
         'count': count
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     if req.status_code == requests.codes.ok:
         return req.json()
     else:
@@ -454,7 +641,7 @@ def get_entities_by_name(parentid, name, obj_type, start=0, count=10):
         'start': start,
         'count': count,
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -503,7 +690,7 @@ def get_entities_by_name_using_options(parentid, name, typ, options='false', sta
         'count': count,
         'options': options,
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -537,7 +724,7 @@ def get_mac_address(confid, macaddr):
         'configurationId': confid,
         'macAddress': macaddr,
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -567,7 +754,11 @@ entity: The actual API entity passed as an entire object that has its mutable
 def update(entity):
     """ no useful return value """
     url = config.Baseurl + 'update'
-    req = requests.put(url, headers=config.AuthHeader, json=entity)
+    req = bam_request('PUT', url, headers=config.AuthHeader, json=entity)
+    if req.status_code == 200:
+        cache.note_updated(entity)
+    else:
+        cache.forget_entity(entity.get('id'))
     return req
 
 
@@ -604,7 +795,8 @@ Parameter Description
 
 def update_with_options(ent):
     url = config.Baseurl + 'updateWithOptions'
-    req = requests.put(url, headers=config.AuthHeader, json=ent)
+    req = bam_request('PUT', url, headers=config.AuthHeader, json=ent)
+    cache.forget_entity(ent.get('id'))
     return req.json()
 
 
@@ -640,7 +832,10 @@ def delete(obj_id):
     """ does not return a useful value """
     url = config.Baseurl + 'delete'
     param = {'objectId': obj_id}
-    req = requests.delete(url, headers=config.AuthHeader, params=param)
+    req = bam_request('DELETE', url, headers=config.AuthHeader, params=param)
+    cache.forget_entity(obj_id)
+    zoneindex.note_deleted(obj_id)
+    netindex.note_deleted(obj_id)
     return req
 
 
@@ -664,7 +859,10 @@ def delete_with_options(obj_id, options):
         'objectId': obj_id,
         'options': options
     }
-    requests.delete(url, headers=config.AuthHeader, params=params)
+    bam_request('DELETE', url, headers=config.AuthHeader, params=params)
+    cache.forget_entity(obj_id)
+    zoneindex.note_deleted(obj_id)
+    netindex.note_deleted(obj_id)
 
 
 '''
@@ -726,7 +924,7 @@ def get_linked_entities(entityid, obj_type, start=0, count=10):
         'count': count,
     }
 
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -759,7 +957,7 @@ def link_entities(entity1id, entity2id, properties):
         'properties': properties
     }
 
-    req = requests.put(url, headers=config.AuthHeader, params=params)
+    req = bam_request('PUT', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -792,7 +990,7 @@ def unlink_entities(entity1id, entity2id, properties):
         'properties': properties
     }
 
-    req = requests.put(url, headers=config.AuthHeader, params=params)
+    req = bam_request('PUT', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -916,7 +1114,7 @@ def assign_ip4_address(configid, ipaddr, macaddr, hostinfo, action, props):
         'properties': props
     }
 
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -929,14 +1127,16 @@ def add_ip4_block_by_cidr(parentid, cidr, properties):
         'properties': properties
     }
 
-    req = requests.post(url, headers=config.AuthHeader, params=params)
-    return req.json()
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    val = req.json()
+    netindex.note_added('IP4Block', cidr, val)
+    return val
 
 
 def get_ip4_address(ip):
     url = config.Baseurl + 'getIP4Address'
     params = {'containerId': config.ConfigId, 'address': ip}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -947,7 +1147,7 @@ def get_ipranged_by_ip(ip):
         'type': 'IP4Network',
         'address': ip
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -961,7 +1161,7 @@ def assign_ip4address(config_id, ip_addr, mac_addr, host_info, action, props):
         'action': action,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -981,8 +1181,10 @@ def add_ip4_network(bid, cidr, props):
         'properties': props
     }
 
-    req = requests.post(url, headers=config.AuthHeader, params=params)
-    return req.json()
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    val = req.json()
+    netindex.note_added('IP4Network', cidr, val)
+    return val
 
 
 '''
@@ -1024,8 +1226,14 @@ def add_entity(parent_id, entity):
     url = config.Baseurl + 'addEntity'
     params = {'parentId': parent_id}
 
-    req = requests.post(url, headers=config.AuthHeader, params=params, json=entity)
-    return req.json()
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params, json=entity)
+    cache.forget_children(parent_id)
+    val = req.json()
+    if entity.get('type') == 'Zone':
+        props = util.props2dict(entity.get('properties') or '')
+        if 'absoluteName' in props:
+            zoneindex.note_added(props['absoluteName'], val)
+    return val
 
 
 '''
@@ -1071,8 +1279,11 @@ def add_zone(parent_id, fqdn):
         'properties': 'deployable=true',
     }
 
-    req = requests.post(url, headers=config.AuthHeader, params=params)
-    return req.json()
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
+    val = req.json()
+    zoneindex.note_added(fqdn, val)
+    return val
 
 
 '''
@@ -1123,7 +1334,7 @@ def get_zones_by_hint(containerid, start=0, count=1, options='accessRight=VIEW')
         'count': count,
         'options': options
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -1159,7 +1370,7 @@ def add_zone_template(parent_id, name, properties):
         'properties': properties,
     }
 
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -1193,7 +1404,8 @@ def add_resource_record(fqdn, typ, rrdata, ttl=86400, props='comments=EmTee|'):
         'ttl': str(ttl),
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
@@ -1256,7 +1468,8 @@ def add_host_record(fqdn, ips, ttl=86400, properties='comments=EmTee|'):
     }
     if config.Debug:
         config.Logger.debug('{}: fqdn: {} ips: {}'.format(fn, fqdn, ips))
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     if req.status_code == requests.codes.ok:
         return req.json()
     else:
@@ -1346,7 +1559,7 @@ def get_host_records_by_hint(options, start=0, count=10):
         'start': start,
         'count': count,
     }
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -1392,7 +1605,8 @@ def add_txt_record(absname, txt, ttl=86400, props='comments=EmTee|'):
         'ttl': ttl,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
@@ -1427,7 +1641,8 @@ def add_generic_record(viewid, absname, rr_type, rr_data, ttl, props):
         'ttl': ttl,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
@@ -1441,7 +1656,8 @@ def add_mx_record(absname, priority, mx_host, ttl=86400, props='comments=EmTee|'
         'ttl': ttl,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
@@ -1452,7 +1668,8 @@ def add_externalhost_record(viewid, ex_host, props):
         'name': ex_host,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
@@ -1494,13 +1711,14 @@ def add_alias_record(absname, link, ttl=86400, props='comments=EmTee|'):
         'ttl': ttl,
         'properties': props
     }
-    req = requests.post(url, headers=config.AuthHeader, params=params)
+    req = bam_request('POST', url, headers=config.AuthHeader, params=params)
+    cache.forget_misses()
     return req.json()
 
 
 def get_system_info():
     url = config.Baseurl + 'getSystemInfo'
-    req = requests.get(url, headers=config.AuthHeader)
+    req = bam_request('GET', url, headers=config.AuthHeader)
     if req.status_code == 200:
         return req.json()
     else:
@@ -1510,7 +1728,7 @@ def get_system_info():
 def get_configuration_setting(conf_id, name):
     url = config.Baseurl + 'getConfigurationSetting'
     params = {'configurationId': conf_id, 'settingName': name}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     return req.json()
 
 
@@ -1518,7 +1736,7 @@ def login(creds):
     """Login to the Address Manager and return a session token"""
     fn = 'login'
     url = config.Baseurl + 'login'
-    req = requests.get(url, params=creds)
+    req = bam_request('GET', url, params=creds)
     if req.status_code == requests.codes.ok:
         return req.json().split()[3]
     else:
@@ -1557,7 +1775,7 @@ Parameter Description
 def get_access_right(entity_id, user_id):
     url = config.Baseurl + 'getAccessRight'
     params = {'entityId': entity_id, 'userId': user_id}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     if req.status_code == requests.codes.ok:
         return req.json()
     else:
@@ -1589,7 +1807,7 @@ def get_access_rights_for_entity(entity_id, start=0, count=10):
     fn = 'get_access_rights_for_entity'
     url = config.Baseurl + 'getAccessRightsForEntity'
     params = {'entityId': entity_id, 'start': start, 'count': count}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     if req.status_code == requests.codes.ok:
         return req.json()
     else:
@@ -1621,7 +1839,7 @@ def get_access_rights_for_user(user_id, start=0, count=10):
     fn = 'get_access_rights_for_user'
     url = config.Baseurl + 'getAccessRightsForUser'
     params = {'userId': user_id, 'start': start, 'count': count}
-    req = requests.get(url, headers=config.AuthHeader, params=params)
+    req = bam_request('GET', url, headers=config.AuthHeader, params=params)
     if req.status_code == requests.codes.ok:
         return req.json()
     else:
@@ -1652,7 +1870,7 @@ on a correct url:
 def url_ok(url):
     url = url
     # `  req = requests.get(url, timeout=2.5)
-    req = requests.get(url)
+    req = bam_request('GET', url)
     if req.status_code == 401 and req.text == "UNAUTHORIZED USER":
         return True
     else:
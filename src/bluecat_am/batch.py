@@ -0,0 +1,199 @@
+"""
+
+Batch mode: run many add/update/delete operations in one process
+
+Each operation uses the same verbs and arguments as the bamcli commands,
+one per line, e.g.
+
+    # comments and blank lines are ignored
+    add red.zip.bigcorp.ca A 10.10.0.100,10.10.0.101 3600
+    add note.zip.bigcorp.ca TXT 'Superman and Batman'
+    update zip.bigcorp.ca MX 10,smtp.zip.bigcorp.ca
+    delete rouge.zip.bigcorp.ca CNAME
+
+or as NDJSON, one object per line:
+
+    {"op": "add", "fqdn": "red.zip.bigcorp.ca", "type": "A", "value": "10.10.0.100", "ttl": "3600"}
+
+All operations share the login, the pooled Session and the caches.
+Operations on the same FQDN run one after another, in input order;
+different FQDNs run in parallel on up to config.MaxWorkers threads.
+Whatever an operation prints is collected and written out as a block
+when it finishes, so concurrent operations do not interleave.
+
+"""
+
+import io
+import json
+import shlex
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bluecat_am import config, util
+
+Verbs = {
+    'add': 'add',
+    'update': 'update',
+    'replace': 'update',
+    'delete': 'delete',
+    'remove': 'delete',
+}
+
+
+class ThreadOutput(io.TextIOBase):
+    """Stand-in for sys.stdout that sends each capturing thread's output to its own buffer"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buf', None)
+        if buf is None:
+            return self.stream.write(text)
+        return buf.write(text)
+
+    def flush(self):
+        if getattr(self.local, 'buf', None) is None:
+            self.stream.flush()
+
+    def capture(self, func, *args):
+        """Run func(*args) in this thread, return (result, exception, printed text)"""
+        self.local.buf = io.StringIO()
+        try:
+            return func(*args), None, self.local.buf.getvalue()
+        except Exception as err:
+            return None, err, self.local.buf.getvalue()
+        finally:
+            self.local.buf = None
+
+
+def parse_line(line):
+    """Turn one input line into an operation dict, or None for blank/comment lines"""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        d = json.loads(line)
+        op = {
+            'op': d.get('op') or d.get('action'),
+            'fqdn': d['fqdn'],
+            'type': d.get('type') or d.get('rr_type'),
+            'value': d.get('value'),
+            'ttl': str(d.get('ttl', '86400')),
+        }
+    else:
+        words = shlex.split(line)
+        if len(words) < 3:
+            raise ValueError('expected: verb fqdn RR_type [value] [ttl]')
+        op = {
+            'op': words[0],
+            'fqdn': words[1],
+            'type': words[2],
+            'value': words[3] if len(words) > 3 else None,
+            'ttl': words[4] if len(words) > 4 else '86400',
+        }
+    if op['op'] not in Verbs:
+        raise ValueError('unknown operation: {}'.format(op['op']))
+    op['op'] = Verbs[op['op']]
+    if op['type'] not in config.RRTypeMap:
+        raise ValueError('unknown RR type: {}'.format(op['type']))
+    if op['value'] is None and not (op['op'] == 'delete' and op['type'] == 'CNAME'):
+        raise ValueError('no value given')
+    return op
+
+
+def parse_ops(stream):
+    """Yield (line number, operation or None, error or None) for every line"""
+    for lineno, line in enumerate(stream, 1):
+        try:
+            op = parse_line(line)
+        except (ValueError, KeyError) as err:
+            yield lineno, None, err
+            continue
+        if op is not None:
+            yield lineno, op, None
+
+
+#
+# Carry out one operation the way the matching bamcli command does
+# and return True if it succeeded
+#
+
+
+def run_op(op):
+    fqdn, rr_type, value, ttl = op['fqdn'], op['type'], op['value'], op['ttl']
+    if op['op'] == 'add':
+        ids = util.add_rr(fqdn, rr_type, value.split(',') if rr_type == 'A' else value, ttl)
+        return bool(ids) and all(type(i) is int for i in ids)
+    elif op['op'] == 'update':
+        return bool(util.update_rr(fqdn, rr_type, value, ttl))
+    elif rr_type == 'CNAME':
+        return util.delete_rr(fqdn, rr_type)
+    else:
+        return util.delete_rr(fqdn, rr_type, value.split(',') if rr_type == 'A' else value)
+
+
+def run_group(out, ops):
+    """Run the operations of one FQDN in order"""
+    results = []
+    for lineno, op in ops:
+        start = time.perf_counter()
+        ok, err, text = out.capture(run_op, op)
+        results.append((lineno, op, bool(ok) and err is None, err, text, time.perf_counter() - start))
+    return results
+
+
+def apply(stream, jobs=None, report=True):
+    """Run every operation read from stream and return a summary dict"""
+    start = time.perf_counter()
+    groups = OrderedDict()
+    failures = []
+    unparsable = 0
+    for lineno, op, err in parse_ops(stream):
+        if err is not None:
+            unparsable += 1
+            failures.append((lineno, None, 'parse error: {}'.format(err)))
+            continue
+        groups.setdefault(op['fqdn'].rstrip('.').lower(), []).append((lineno, op))
+
+    done = ok = 0
+    real_stdout = sys.stdout
+    out = ThreadOutput(real_stdout)
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs or config.MaxWorkers)) as pool:
+            futures = [pool.submit(config.carry(run_group), out, ops) for ops in groups.values()]
+            for future in as_completed(futures):
+                for lineno, op, good, err, text, secs in future.result():
+                    done += 1
+                    if good:
+                        ok += 1
+                    else:
+                        failures.append((lineno, op, str(err) if err else text.strip().split('\n')[-1]))
+                    if text and not config.Silent:
+                        real_stdout.write(text)
+    finally:
+        sys.stdout = real_stdout
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'operations': done,
+        'succeeded': ok,
+        'failed': done - ok,
+        'unparsable': unparsable,
+        'seconds': elapsed,
+        'per_second': done / elapsed if elapsed else 0.0,
+        'failures': sorted(failures, key=lambda f: f[0]),
+    }
+    if report:
+        print('{operations} operations in {seconds:.1f}s ({per_second:.1f}/s): '
+              '{succeeded} succeeded, {failed} failed, {unparsable} unparsable lines'.format(**summary),
+              file=sys.stderr)
+        for lineno, op, why in summary['failures']:
+            print('  line {}: {}'.format(lineno, why), file=sys.stderr)
+    return summary
@@ -0,0 +1,168 @@
+"""
+
+In-process caches for BAM lookups
+
+TTLCache is a small thread safe LRU dictionary whose entries also expire
+after a fixed number of seconds. It counts hits and misses so callers
+can see how many round trips it saved.
+
+Resolve is the cache shared by the util resolvers (find_rr, view_info_by_name,
+get_info_by_name, object_find) which walk an FQDN one label at a time with
+getEntityByName. It is keyed by (parentId, name, type) and holds the
+returned entity, including the "not found" entity with id 0.
+
+Entities holds whole entities by ID: what getEntityById returned, and the
+RRs find_rr_entities found (they come with their properties). A read,
+modify and write of a record then costs no more than the find. Callers
+get their own copy of the cached entity, so changing it changes nothing
+until it is written back with api.update.
+
+The api calls that change the tree keep it honest:
+
+    * add_zone, add_entity and the add*Record calls drop every cached
+      "not found" answer, and add_entity drops the children of its parent
+    * update and update_with_options store the entity as written
+    * delete and delete_with_options drop the deleted entity and anything
+      cached below it
+
+"""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from bluecat_am import config
+
+
+class TTLCache:
+    """LRU mapping with a per entry time to live"""
+
+    def __init__(self, maxsize=4096, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires, value = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[1]
+
+    def discard_if(self, test):
+        """Drop every entry for which test(key, value) is true"""
+        with self._lock:
+            doomed = [k for k, (exp, v) in self._data.items() if test(k, v)]
+            for key in doomed:
+                del self._data[key]
+            return len(doomed)
+
+    def items(self):
+        with self._lock:
+            now = time.monotonic()
+            return [(k, v) for k, (exp, v) in self._data.items() if exp > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+Resolve = TTLCache(config.ResolveCacheSize, config.ResolveCacheTTL)
+
+
+def resolve():
+    """The resolve cache of the current client, cache.Resolve by default"""
+    return config.ResolveCache or Resolve
+
+
+Entities = TTLCache(config.EntityCacheSize, config.EntityCacheTTL)
+
+
+def entities():
+    """The entity cache of the current client, cache.Entities by default"""
+    return config.EntityCache or Entities
+
+
+def get_entity(obj_id):
+    """A copy of the cached entity obj_id, None if it is not cached"""
+    ent = entities().get(int(obj_id))
+    return dict(ent) if ent is not None else None
+
+
+def remember(ents):
+    """Cache entities that came back whole, i.e. with their properties"""
+    cache = entities()
+    for ent in ents:
+        if ent.get('id') and ent.get('properties'):
+            cache.put(ent['id'], dict(ent))
+
+
+'''
+
+Invalidation hooks, called from bluecat_am.api after a successful write
+
+'''
+
+
+def forget_misses():
+    """New entities exist, cached 'not found' answers may now be wrong"""
+    resolve().discard_if(lambda key, ent: not ent.get('id'))
+
+
+def forget_children(parent_id):
+    resolve().discard_if(lambda key, ent: key[0] == parent_id or not ent.get('id'))
+
+
+def note_updated(ent):
+    """ent was written as is"""
+    if ent.get('id'):
+        entities().put(int(ent['id']), dict(ent))
+
+
+def forget_entity(obj_id):
+    """Drop obj_id and everything cached below it in the tree"""
+    obj_id = int(obj_id)
+    entities().pop(obj_id)
+    cache = resolve()
+    doomed = {obj_id}
+    while True:
+        found = {ent['id'] for key, ent in cache.items() if key[0] in doomed and ent.get('id')}
+        if found <= doomed:
+            break
+        doomed |= found
+    cache.discard_if(lambda key, ent: key[0] in doomed or ent.get('id') in doomed)
@@ -0,0 +1,309 @@
+"""
+
+Recording the BAM conversation of a run, and playing it back offline
+
+While config.Cassette is a Recorder, every request the Session sends and
+the answer it gets are written to a .bamtrace file: gzipped JSON lines,
+a header first
+
+    {"bamtrace": 1, "version": "0.4", "baseurl": "https://bam.bigcorp.ca/Services/REST/v1/",
+     "command": ["view", "zip.bigcorp.ca"], "started": 1554390553.9}
+
+with the zone and network indexes bamcli had on disk when the run
+started, then one line per call, in the order the answers came
+
+    {"t": 0.231, "dt": 0.048, "method": "GET", "call": "getEntityById", "params": [["id", "2217650"]],
+     "body": null, "status": 200, "type": "application/json", "answer": "{\"id\": 2217650, ...}"}
+
+and a last line with the user, Configuration and View of the run.
+Credentials are never written: not the Authorization header, nor the
+password of the login call, and session tokens in answers are replaced
+by REDACTED.
+
+While config.Cassette is a Player, the Session sends nothing: each request
+is answered from the file, matched on method, call, parameters and body.
+Identical requests get the recorded answers in the order recorded (the
+last one again once they run out). The login and the URL probe of
+bam_init are always answered, so a run recorded with a cached session
+token plays back from a clean start. A request that was not recorded
+raises Miss. The answers come back after the recorded latency, or at
+once with latency='zero'. Player.setup() points config at a scratch token
+cache, zone index and network index holding what the recorded run started
+with (the session it reused, the zones and networks it knew and how stale
+they were), so that the same calls are made again.
+
+    config.Cassette = Player('slow-view.bamtrace', latency='zero')
+    config.Cassette.setup()
+    util.bam_init(config.Cassette.baseurl, config.Cassette.user, None)
+    config.Profiler = profiler.Profiler()
+    util.view_rr('zip.bigcorp.ca')
+    print(config.Cassette.stats())
+
+stats() counts the calls answered, missed and recorded but never asked
+for, which compares the calls made by two versions of the package.
+
+bamcli --record FILE and --replay FILE [--replay-latency zero] do this
+around one command.
+
+"""
+
+import collections
+import datetime
+import gzip
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from bluecat_am import __version__, config, tokencache
+
+Version = 1
+TokenPattern = re.compile(r'BAMAuthToken: [^\s"<]+')
+# answered during playback even if the recording has no such call
+LoginAnswer = '"Session Token-> BAMAuthToken: {} <- for User : replay"'.format(config.Redacted)
+
+
+class Miss(requests.exceptions.ConnectionError):
+    """A request that is not in the recording"""
+
+
+def call_of(url):
+    """The API call of a BAM REST url, '' for the URL probe"""
+    parts = urlsplit(url)
+    return parts.path.rsplit('/', 1)[-1], parse_qsl(parts.query, keep_blank_values=True)
+
+
+def body_text(body):
+    if body is None:
+        return None
+    return body.decode() if isinstance(body, bytes) else body
+
+
+def redact(params):
+    return [[k, config.Redacted if k in config.Secrets else v] for k, v in params]
+
+
+class Recorder:
+    """Writes every call made through the Session to path"""
+
+    def __init__(self, path, baseurl='', command=()):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+        self.started = time.perf_counter()
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+        self.write({'bamtrace': Version, 'version': __version__, 'baseurl': baseurl,
+                    'command': list(command), 'started': time.time(),
+                    'zoneindex': index_file(config.ZoneIndex, config.ZoneIndexFile),
+                    'netindex': index_file(config.NetIndex, config.NetIndexFile)})
+
+    def write(self, item):
+        with self.lock:
+            self.file.write(json.dumps(item, separators=(',', ':')) + '\n')
+
+    def wrap(self, adapter):
+        return RecordingAdapter(self, adapter)
+
+    def note(self, request, response, start):
+        call, params = call_of(request.url)
+        answer = TokenPattern.sub('BAMAuthToken: ' + config.Redacted,
+                                  response.content.decode('utf-8', 'replace'))
+        with self.lock:
+            self.count += 1
+        self.write({
+            't': round(start - self.started, 6),
+            'dt': round(time.perf_counter() - start, 6),
+            'method': request.method,
+            'call': call,
+            'params': redact(params),
+            'body': body_text(request.body),
+            'status': response.status_code,
+            'type': response.headers.get('Content-Type'),
+            'answer': answer,
+        })
+
+    def close(self):
+        self.write({'end': True, 'user': config.Username, 'config_id': config.ConfigId,
+                    'view_id': config.ViewId})
+        with self.lock:
+            self.file.close()
+
+    def stats(self):
+        return {'recorded': self.count}
+
+
+def index_file(enabled, path):
+    """What an index file holds now, None if there is none"""
+    if not enabled or not path:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class RecordingAdapter(BaseAdapter):
+
+    def __init__(self, recorder, adapter):
+        super().__init__()
+        self.recorder = recorder
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        self.recorder.note(request, response, start)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+'''
+
+Playback
+
+'''
+
+
+def read(path):
+    """(header, calls, trailer) of a recording, the trailer is {} if the run did not finish"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('bamtrace') != Version:
+            raise ValueError('{} is not a bamtrace file'.format(path))
+        calls = [json.loads(line) for line in f if line.strip()]
+    trailer = calls.pop() if calls and calls[-1].get('end') else {}
+    return header, calls, trailer
+
+
+def match_key(method, call, params, body):
+    if call == 'login':
+        # whoever logs in, with whatever password
+        params = []
+    return method, call, tuple(sorted(tuple(p) for p in redact(params))), body
+
+
+class Player:
+    """Answers the calls made through the Session from a recording"""
+
+    def __init__(self, path, latency='original'):
+        self.path = path
+        self.latency = latency
+        self.header, calls, self.trailer = read(path)
+        self.scratch = None
+        self.lock = threading.Lock()
+        self.answers = collections.defaultdict(collections.deque)
+        self.last = {}
+        for item in calls:
+            key = match_key(item['method'], item['call'], item['params'], item['body'])
+            self.answers[key].append(item)
+            self.last[key] = item
+        self.recorded = len(calls)
+        self.played = 0
+        self.missed = collections.Counter()
+
+    @property
+    def baseurl(self):
+        return self.header.get('baseurl', '')
+
+    @property
+    def user(self):
+        return self.trailer.get('user')
+
+    def setup(self):
+        """Give config the token cache and indexes the recorded run started with"""
+        self.scratch = tempfile.mkdtemp(prefix='bamtrace')
+        config.TokenCacheFile = os.path.join(self.scratch, 'session.json')
+        config.ZoneIndexFile = os.path.join(self.scratch, 'zones.json')
+        config.NetIndexFile = os.path.join(self.scratch, 'networks.json')
+        if self.trailer and not any(item['call'] == 'login' for queue in self.answers.values()
+                                    for item in queue):
+            # the recorded run reused a cached session
+            config.ConfigId = self.trailer['config_id']
+            config.ViewId = self.trailer['view_id']
+            tokencache.save(self.baseurl, self.user, config.Redacted)
+        # as stale now as they were then
+        shift = time.time() - self.header['started']
+        index = self.header.get('zoneindex')
+        if index:
+            index['listed'] += shift
+            for info in index['zones'].values():
+                info['listed'] += shift
+            with open(config.ZoneIndexFile, 'w') as f:
+                json.dump(index, f)
+        index = self.header.get('netindex')
+        if index:
+            index['listed'] += shift
+            with open(config.NetIndexFile, 'w') as f:
+                json.dump(index, f)
+
+    def close(self):
+        if self.scratch:
+            shutil.rmtree(self.scratch, ignore_errors=True)
+            self.scratch = None
+
+    def wrap(self, adapter):
+        return PlayingAdapter(self)
+
+    def answer(self, request):
+        call, params = call_of(request.url)
+        key = match_key(request.method, call, params, body_text(request.body))
+        with self.lock:
+            queue = self.answers.get(key)
+            item = queue.popleft() if queue else self.last.get(key)
+            if item is None and call in ('', 'login'):
+                item = self.stand_in(call)
+            if item is None:
+                self.missed['{} {}'.format(request.method, call)] += 1
+                raise Miss('{} {} {} was not recorded in {}'.format(request.method, call, params, self.path),
+                           request=request)
+            self.played += 1
+        if self.latency == 'original' and item.get('dt'):
+            time.sleep(item['dt'])
+        return item
+
+    def stand_in(self, call):
+        if call == 'login':
+            return {'status': 200, 'type': 'application/json', 'answer': LoginAnswer}
+        return {'status': 401, 'type': 'text/plain', 'answer': 'UNAUTHORIZED USER'}
+
+    def unused(self):
+        return sum(len(queue) for queue in self.answers.values())
+
+    def stats(self):
+        return {'recorded': self.recorded, 'played': self.played,
+                'missed': sum(self.missed.values()), 'unused': self.unused()}
+
+
+class PlayingAdapter(BaseAdapter):
+
+    def __init__(self, player):
+        super().__init__()
+        self.player = player
+
+    def send(self, request, **kwargs):
+        item = self.player.answer(request)
+        response = requests.Response()
+        response.status_code = item['status']
+        response.headers = CaseInsensitiveDict({'Content-Type': item.get('type') or 'application/json'})
+        response._content = item['answer'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=item.get('dt') or 0)
+        return response
+
+    def close(self):
+        pass
@@ -1,9 +1,14 @@
+import logging
 import re
+import sys
 import click
 
 from click import group, pass_context, option, argument
 from click import Context
-from bluecat_am import util, config
+# only modules that load quickly: the rest are imported by the commands
+# that need them, so --help is fast and commands handed to a daemon never
+# load requests
+from bluecat_am import cache, config, profiler, zonefile
 
 
 def validate_fqdn(ctx, param, value):
@@ -20,6 +25,55 @@ def validate_value(ctx, param, val):
     return val
 
 
+def report_cache_stats():
+    from bluecat_am import api
+    stats = cache.resolve().stats()
+    click.echo('resolve cache: {size} entries, {hits} hits, {misses} misses, '
+               'hit rate {hit_rate:.0%}'.format(**stats), err=True)
+    click.echo('entity cache: {size} entries, {hits} hits, {misses} misses, '
+               'hit rate {hit_rate:.0%}'.format(**cache.entities().stats()), err=True)
+    click.echo('coalesced GETs: {saved} calls saved'.format(**api.Flights.stats()), err=True)
+
+
+def report_cassette():
+    from bluecat_am import cassette
+    tape = config.Cassette
+    if isinstance(tape, cassette.Recorder):
+        tape.close()
+        click.echo('{} calls recorded to {}'.format(tape.count, tape.path), err=True)
+    else:
+        tape.close()
+        click.echo('replayed {played} of {recorded} recorded calls, {missed} not recorded, '
+                   '{unused} recorded but not made'.format(**tape.stats()), err=True)
+
+
+def command_line():
+    """The arguments bamcli was called with, without the password"""
+    args = []
+    hide = False
+    for arg in sys.argv[1:]:
+        if hide:
+            arg, hide = config.Redacted, False
+        elif arg in ('-p', '--pw', '--pass'):
+            hide = True
+        elif arg.startswith(('--pw=', '--pass=')):
+            arg = arg.split('=', 1)[0] + '=' + config.Redacted
+        elif arg.startswith('-p') and len(arg) > 2:
+            arg = '-p' + config.Redacted
+        args.append(arg)
+    return args
+
+
+def report_profile(trace):
+    prof = config.Profiler
+    prof.stop()
+    for line in prof.summary():
+        click.echo(line, err=True)
+    if trace:
+        prof.write_trace(trace)
+        click.echo('Chrome trace written to {}'.format(trace), err=True)
+
+
 @group()
 @option(
     '-s', '--silent',
@@ -47,24 +101,156 @@ def validate_value(ctx, param, val):
         envvar='BAM_PW',
         help='API password',
 )
+@option(
+        '--pool-size',
+        envvar='BAM_POOL_SIZE',
+        type=click.INT,
+        default=config.PoolMaxsize,
+        help='Maximum number of keep-alive connections per BAM host',
+)
+@option(
+        '--pool-block',
+        envvar='BAM_POOL_BLOCK',
+        is_flag=True,
+        help='Never open more than --pool-size connections to a BAM host',
+)
+@option(
+        '--token-cache',
+        envvar='BAM_TOKEN_CACHE',
+        default=config.TokenCacheFile,
+        help='File caching the BAM session token between invocations',
+)
+@option(
+        '--no-token-cache',
+        is_flag=True,
+        help='Always log in, do not read or write the session token cache',
+)
+@option(
+        '--no-zone-index',
+        is_flag=True,
+        help='Find zones by asking the BAM label by label instead of using the local zone index',
+)
+@option(
+        '--no-network-index',
+        is_flag=True,
+        help='Ask the BAM which network each address is in instead of using the local network index',
+)
+@option(
+        '--no-daemon',
+        envvar='BAM_NO_DAEMON',
+        is_flag=True,
+        help='Do not hand commands to a running bamcli serve daemon',
+)
+@option(
+        '--profile',
+        is_flag=True,
+        help='Time every API call and print a summary when the command is done',
+)
+@option(
+        '--profile-trace',
+        type=click.Path(dir_okay=False, writable=True),
+        help='With --profile, also write the API calls as a Chrome trace (JSON) to this file',
+)
+@option(
+        '--record',
+        type=click.Path(dir_okay=False, writable=True),
+        help='Record the BAM calls of the command, credentials removed, to this .bamtrace file',
+)
+@option(
+        '--replay',
+        type=click.Path(exists=True, dir_okay=False),
+        help='Answer the BAM calls from this .bamtrace file instead of a BAM',
+)
+@option(
+        '--replay-latency',
+        type=click.Choice(['original', 'zero']),
+        default='original',
+        help='With --replay, answer after the recorded latency or at once',
+)
 @pass_context
-def run(ctx: Context, silent, verbose, url, user, password):
+def run(ctx: Context, silent, verbose, url, user, password, pool_size, pool_block,
+        token_cache, no_token_cache, no_zone_index, no_network_index, no_daemon, profile,
+        profile_trace, record, replay, replay_latency):
     """ Command line interface to BAM DNS System\n
     E.g.  $bamcli add bozo.uoft.ca A 3600 10.10.10.1 [TTL]\n
           $bamcli view bozo.uoft.ca\n
           $bamcli view rights
     """
+    logging.basicConfig(level=logging.INFO)
+    if record and replay:
+        raise click.UsageError('--record and --replay do not go together')
+    if record or replay:
+        from bluecat_am import cassette
+    if replay:
+        config.Cassette = cassette.Player(replay, replay_latency)
+        url = config.Cassette.baseurl or url
+        user = config.Cassette.user or user
+
     ctx.obj = dict()
     ctx.obj['SILENT'] = silent
     ctx.obj['DEBUG'] = verbose
     ctx.obj['USER'] = user
+    ctx.obj['LOGIN'] = (url, user, password)
     config.Silent = silent
     config.Debug = verbose
+    config.PoolMaxsize = pool_size
+    config.PoolBlock = pool_block
+    config.TokenCacheFile = '' if no_token_cache else token_cache
+    config.ZoneIndex = not no_zone_index
+    config.NetIndex = not no_network_index
 
     if verbose:
         click.echo('action: {}'.format(ctx.invoked_subcommand))
-
-    util.bam_init(url, user, password)
+        ctx.call_on_close(report_cache_stats)
+    if profile or profile_trace:
+        # the calls of a daemon would not be seen, so profiled commands run here
+        no_daemon = True
+        config.Profiler = profiler.Profiler()
+        ctx.call_on_close(lambda: report_profile(profile_trace))
+
+    if record or replay:
+        # the calls of a daemon would not go through this Session
+        no_daemon = True
+        ctx.call_on_close(report_cassette)
+    if record:
+        config.Cassette = cassette.Recorder(record, url or '', command_line())
+    elif replay:
+        config.Cassette.setup()
+
+    if not no_daemon and ctx.invoked_subcommand in Remote:
+        from bluecat_am import daemonclient
+        # a daemon logged in elsewhere, or as someone else, would not do
+        if daemonclient.available(url=url or '', user=user or ''):
+            config.Daemon = config.DaemonSocket
+    # the commands log in once their arguments are known to be good
+
+
+# commands a running daemon can carry out (see daemon.py)
+Remote = ('add', 'update', 'replace', 'delete', 'remove', 'view', 'list', 'find')
+
+
+def log_in(ctx):
+    """Log in to the BAM unless this invocation already has"""
+    obj = ctx.find_root().obj
+    if obj.get('LOGIN'):
+        from bluecat_am import util
+        util.bam_init(*obj['LOGIN'])
+        obj['LOGIN'] = None
+
+
+def call(op, *args):
+    """Carry out a daemon.Operations operation, in the daemon if one is in use"""
+    if config.Daemon:
+        from bluecat_am import daemonclient
+        try:
+            return daemonclient.call(op, *args)
+        except OSError as err:
+            print('bamcli daemon on {} failed ({}), working locally'.format(config.Daemon, err),
+                  file=sys.stderr)
+            config.Daemon = None
+    log_in(click.get_current_context())
+    from bluecat_am import daemon
+    return daemon.Operations[op](*args)
 
 # Define common options to share between subcommands
 
@@ -101,20 +287,18 @@ ttl = argument(
 @rr_type
 @value
 @ttl
-def add(ctx, fq, rr_type, value, ttl):
+def add(ctx, fqdn, rr_type, value, ttl):
     """Add a new Resource Record to the BlueCat DNS system"""
     if ctx.obj['DEBUG']:
-        click.echo('    fqdn: {} rr_type: {} value: {}\n'.format(fq, rr_type, value))
+        click.echo('    fqdn: {} rr_type: {} value: {}\n'.format(fqdn, rr_type, value))
 
     if rr_type == 'defRR' or value == 'defVAL':
         print('Not enough RR information given')
         print('Format: bamcli {} fqdn RR_type value [ttl]'.format(ctx.command.name))
     elif rr_type == 'A':
-        ips = value.split(',')
-        for ip in ips:
-            util.add_rr(fqdn, rr_type, ip, ttl)
+        call('add', fqdn, rr_type, value.split(','), ttl)
     else:
-        util.add_rr(fqdn, rr_type, value, ttl)
+        call('add', fqdn, rr_type, value, ttl)
 
 
 @run.command()
@@ -132,7 +316,7 @@ def update(ctx, fqdn, rr_type, value, ttl):
         print('Not enough RR information given')
         print('Format: bamcli {} fqdn RR_type value'.format(ctx.command.name))
     else:
-        util.update_rr(fqdn, rr_type, value, ttl)
+        call('update', fqdn, rr_type, value, ttl)
 
 
 @run.command()
@@ -158,13 +342,12 @@ def delete(ctx, fqdn, rr_type, value):
     if rr_type == 'defRR':
         print('No RR type information given')
     elif rr_type == 'CNAME':
-        util.delete_rr(fqdn, rr_type)
+        call('delete', fqdn, rr_type)
     elif value != 'defVAL':
         if rr_type == 'A':
-            for val in value.split(','):
-                util.delete_rr(fqdn, rr_type, val)
+            call('delete', fqdn, rr_type, value.split(','))
         else:
-            util.delete_rr(fqdn, rr_type, value)
+            call('delete', fqdn, rr_type, value)
     else:
         print('Not enough RR information given')
         print('Format: bamcli {} fqdn RR_type value'.format(ctx.command.name))
@@ -191,13 +374,15 @@ def view(ctx, fqdn, rr_type, value):
         click.echo('    fqdn: {} rr_type: {} value: {}\n'.format(fqdn, rr_type, value))
 
     if fqdn == 'rights':
+        log_in(ctx)
+        from bluecat_am import util
         util.show_rights(ctx.obj['USER'])
     elif rr_type == 'defRR':
-        util.view_rr(fqdn)
+        call('view', fqdn)
     elif value == 'defVAL':
-        util.view_rr(fqdn, rr_type)
+        call('view', fqdn, rr_type)
     else:
-        util.view_rr(fqdn, rr_type, value)
+        call('view', fqdn, rr_type, value)
 
 
 # Set custom command name so that function name doesn't override python builtin `list` function
@@ -216,20 +401,318 @@ def list_rr(ctx, *args, **kwargs):
 @fqdn
 @rr_type
 @value
-def find(ctx, fqdn, rr_typ, val):
+def find(ctx, fqdn, rr_type, value):
     """Find a Resource Record in the BlueCat DNS System"""
     if ctx.obj['DEBUG']:
-        click.echo('    fqdn: {} rr_type: {} value: {}\n'.format(fqdn, rr_typ, val))
+        click.echo('    fqdn: {} rr_type: {} value: {}\n'.format(fqdn, rr_type, value))
 
     if rr_type == 'defRR':
-        ids = util.find_rr(fqdn)
+        ids = call('find', fqdn)
     elif value == 'defVAL':
-        ids = util.find_rr(fqdn, rr_type)
+        ids = call('find', fqdn, rr_type)
     else:
-        ids = util.find_rr(fqdn, rr_type, value)
+        ids = call('find', fqdn, rr_type, value)
     print(ids)
 
 
+@run.command()
+@pass_context
+@option(
+    '--rebuild',
+    is_flag=True,
+    help='Throw away the local zone index and list every zone again',
+)
+def zones(ctx, rebuild):
+    """List the zones in the local zone index"""
+    log_in(ctx)
+    from bluecat_am import zoneindex
+    if rebuild:
+        index = zoneindex.build()
+        zoneindex.save(index)
+        config.ZoneTree = index
+    index = zoneindex.get_index()
+    if index is None:
+        print('The zone index is disabled')
+        return
+    for name in sorted(index.zones, key=lambda n: n.split('.')[::-1]):
+        print(name)
+    if not config.Silent:
+        print('{} zones'.format(len(index)))
+
+
+@run.command('apply')
+@pass_context
+@argument('ops', type=click.File('r'), default='-')
+@option(
+    '-j', '--jobs',
+    type=click.INT,
+    default=config.MaxWorkers,
+    help='Number of FQDNs worked on in parallel',
+)
+def apply_ops(ctx, ops, jobs):
+    """Run many add/update/delete operations read from OPS (default stdin)
+
+    One operation per line, either as bamcli arguments
+    (add red.zip.bigcorp.ca A 10.10.0.100 3600) or as a JSON object
+    ({"op": "add", "fqdn": ..., "type": ..., "value": ..., "ttl": ...})
+    """
+    log_in(ctx)
+    from bluecat_am import batch
+    summary = batch.apply(ops, jobs)
+    if summary['failed'] or summary['unparsable']:
+        ctx.exit(1)
+
+
+@run.command('import')
+@pass_context
+@argument('path', metavar='ZONEFILE', type=click.Path(exists=True, dir_okay=False))
+@option(
+    '-z', '--zone',
+    required=True,
+    callback=validate_fqdn,
+    help='Zone the file describes, also the $ORIGIN of the file',
+)
+@option(
+    '-n', '--dry-run',
+    is_flag=True,
+    help='Only show the changes that would be made',
+)
+@option(
+    '--keep-extra',
+    is_flag=True,
+    help='Do not delete A, CNAME, MX and TXT records missing from the file',
+)
+@option(
+    '-j', '--jobs',
+    type=click.INT,
+    default=config.MaxWorkers,
+    help='Number of changes sent to the BAM in parallel',
+)
+def import_zone(ctx, path, zone, dry_run, keep_extra, jobs):
+    """Make ZONE hold the A, CNAME, MX and TXT records of a BIND ZONEFILE
+
+    Only the records that differ are added, updated or deleted
+    """
+    log_in(ctx)
+    from bluecat_am import plan
+    config.MaxWorkers = max(1, jobs)
+    records, skipped = zonefile.read(path, zone)
+    ops = plan.plan_zone(zone, records, prune=not keep_extra)
+    if ops is None:
+        ctx.exit(1)
+    if not config.Silent or dry_run:
+        plan.show(ops)
+    totals = plan.count(ops)
+    if dry_run:
+        print('{} records read, {} skipped: {add} to add, {update} to update, {delete} to delete'.format(
+            len(records), skipped, **totals))
+        return
+    failed = plan.execute(ops)
+    if not config.Silent:
+        print('{} records read, {} skipped: {add} adds, {update} updates, {delete} deletes, '
+              '{} failed'.format(len(records), skipped, len(failed), **totals))
+    for op in failed:
+        print('failed: {} {} {} {}'.format(op['op'], op['fqdn'], op['type'], op['value']), file=sys.stderr)
+    if failed:
+        ctx.exit(1)
+
+
+def show_plans(plans):
+    """Print the operations planned for each zone, return them all in one list"""
+    from bluecat_am import plan
+    ops = []
+    for zone, zone_ops in sorted(plans.items()):
+        if zone_ops is None:
+            continue
+        if zone_ops or not config.Silent:
+            print('{}: {add} to add, {update} to update, {delete} to delete'.format(
+                zone, **plan.count(zone_ops)))
+        plan.show(zone_ops)
+        ops += zone_ops
+    return ops
+
+
+def load_plans(ctx, path):
+    from bluecat_am import plan
+    try:
+        state = plan.load_state(path)
+    except (OSError, ValueError) as err:
+        print('Cannot read {}: {}'.format(path, err), file=sys.stderr)
+        ctx.exit(1)
+    plans, reads = plan.plan_state(state)
+    missing = sorted(zone for zone, zone_ops in plans.items() if zone_ops is None)
+    for zone in missing:
+        print('{} is not a zone, skipped'.format(zone), file=sys.stderr)
+    return plans, reads, missing
+
+
+state_file = argument('path', metavar='STATE', type=click.Path(exists=True, dir_okay=False))
+jobs = option(
+    '-j', '--jobs',
+    type=click.INT,
+    default=config.MaxWorkers,
+    help='Number of zones read, and of changes sent, in parallel',
+)
+
+
+@run.command('plan')
+@pass_context
+@state_file
+@jobs
+def plan_state(ctx, path, jobs):
+    """Show how the zones in BAM differ from the YAML/JSON STATE file
+
+    Also shows the number of API calls 'bamcli sync' would make to read the
+    zones and apply the changes
+    """
+    log_in(ctx)
+    from bluecat_am import plan
+    config.MaxWorkers = max(1, jobs)
+    plans, reads, missing = load_plans(ctx, path)
+    ops = show_plans(plans)
+    print('Plan: {add} to add, {update} to update, {delete} to delete in {zones} zones'.format(
+        zones=len(plans) - len(missing), **plan.count(ops)))
+    print('API calls: {} to read the zones, {} to apply the changes, {} in all'.format(
+        reads, len(ops), reads + len(ops)))
+    if missing:
+        ctx.exit(1)
+
+
+@run.command('sync')
+@pass_context
+@state_file
+@jobs
+def sync_state(ctx, path, jobs):
+    """Make the zones in BAM hold the records of the YAML/JSON STATE file"""
+    log_in(ctx)
+    from bluecat_am import plan
+    config.MaxWorkers = max(1, jobs)
+    plans, reads, missing = load_plans(ctx, path)
+    if config.Silent:
+        ops = [op for zone_ops in plans.values() if zone_ops for op in zone_ops]
+    else:
+        ops = show_plans(plans)
+    failed = plan.execute(ops)
+    for op in failed:
+        print('failed: {} {} {} {}'.format(op['op'], op['fqdn'], op['type'], op['value']), file=sys.stderr)
+    if not config.Silent:
+        print('Applied {} of {} changes in {} zones'.format(
+            len(ops) - len(failed), len(ops), len(plans) - len(missing)))
+    if failed or missing:
+        ctx.exit(1)
+
+
+@run.command('export')
+@pass_context
+@argument('zone', callback=validate_fqdn)
+@option(
+    '-f', '--format', 'fmt',
+    type=click.Choice(config.ExportFormats),
+    default='bind',
+    help='Output format (default bind)',
+)
+@option(
+    '-r', '--recursive',
+    is_flag=True,
+    help='Also export every zone below ZONE, several zones at once',
+)
+@option(
+    '-o', '--output',
+    type=click.File('w'),
+    default='-',
+    help='File to write to (default stdout)',
+)
+def export_records(ctx, zone, fmt, recursive, output):
+    """Write out the A, CNAME, MX and TXT records of ZONE as they are read"""
+    log_in(ctx)
+    from bluecat_am import export
+    if not export.export_zone(zone, fmt, output, recursive):
+        ctx.exit(1)
+
+
+@run.command('shell')
+@pass_context
+def interactive(ctx):
+    """Read and run bamcli commands, logged in once, keeping the caches warm
+
+    Shell commands: :stats :flush :help :quit
+    """
+    log_in(ctx)
+    group = ctx.parent
+    names = [name for name in run.list_commands(group) if name != 'shell']
+
+    def dispatch(words):
+        name, args = words[0], words[1:]
+        cmd = run.get_command(group, name) if name in names else None
+        if cmd is None:
+            print('No such command: {}, try :help'.format(name))
+            return
+        try:
+            with cmd.make_context(name, args, parent=group) as sub:
+                cmd.invoke(sub)
+        except click.exceptions.Exit:
+            pass
+        except click.ClickException as err:
+            err.show()
+        except click.Abort:
+            print('Aborted')
+        except SystemExit:
+            pass
+
+    from bluecat_am import shell
+    shell.repl(names, dispatch)
+
+
+@run.command()
+@pass_context
+@option(
+    '--socket', 'path',
+    envvar='BAM_DAEMON_SOCKET',
+    default=config.DaemonSocket,
+    help='Unix socket to listen on',
+)
+def serve(ctx, path):
+    """Keep one logged in BAM client warm for other bamcli commands and local programs
+
+    bamcli add/update/delete/view/find hand their work to it while it runs
+    """
+    log_in(ctx)
+    from bluecat_am import daemon
+    config.DaemonSocket = path
+    try:
+        daemon.serve(path)
+    except (RuntimeError, OSError) as err:
+        print('Cannot serve: {}'.format(err), file=sys.stderr)
+        ctx.exit(1)
+
+
+@run.group()
+def ttl():
+    """Maintain the TTLs of the Resource Records in a zone"""
+
+
+@ttl.command()
+@pass_context
+@argument('zone', callback=validate_fqdn)
+@option(
+    '--ttl', 'value',
+    default='86400',
+    help='TTL to give the RRs that have none (default 86400)',
+)
+@option(
+    '-n', '--dry-run',
+    is_flag=True,
+    help='Only show which RRs would be updated',
+)
+def normalize(ctx, zone, value, dry_run):
+    """Give every RR in ZONE without a TTL an explicit one"""
+    log_in(ctx)
+    from bluecat_am import util
+    count = util.normalize_ttl(zone, value, dry_run)
+    if not config.Silent:
+        print('{} RRs {}given a TTL of {}'.format(count, 'would be ' if dry_run else '', value))
+
+
 """ run(['add', 'alex.utoronto.ca', 'A', '10.128.30.40']) """
 if __name__ == '__run__':
     run()
@@ -0,0 +1,131 @@
+"""
+
+BamClient: one BAM connection as an object
+
+The api and util functions read the BAM URL, session token, Configuration
+and View, Debug and Silent flags and so on from bluecat_am.config. A
+BamClient holds its own copy of all of those (config.ClientSettings) along
+with its own Session, resolve and entity caches, zone and network indexes
+and API call counters, and makes itself config's current client while one
+of its methods runs. So several clients, for different BAM servers,
+users or Views, can work at the same time in different threads:
+
+    with BamClient(url, 'ralph', pw, view_name='Internal') as bam:
+        bam.view_rr('zip.bigcorp.ca')
+        bam.add_rr('www.zip.bigcorp.ca', 'A', ['10.10.0.100'], '3600')
+        ent = bam.call(api.get_entity_by_id, 2217650)
+        print(bam.stats())
+
+Threads started by the api and util functions (util.fan_out,
+api.iter_pages ...) work for the client that started them. Clients of
+different Views should be given their own ZoneIndexFile, of different
+Configurations their own NetIndexFile.
+
+The plain module functions are unchanged: with no current client they use
+the module globals of config, which is the default client bamcli itself
+uses.
+
+"""
+
+import contextlib
+import functools
+
+from collections import Counter
+
+from bluecat_am import api, cache, config, tokencache, util
+
+
+class BamClient:
+    """A BAM connection with its own settings, Session, caches and counters"""
+
+    def __init__(self, url=None, user=None, password=None, config_name=None, view_name=None, **settings):
+        unknown = set(settings) - set(config.ClientSettings)
+        if unknown:
+            raise TypeError('unknown settings: {}'.format(', '.join(sorted(unknown))))
+        self.url = url
+        self.user = user
+        self.password = password
+        self.settings = dict(config.Defaults)
+        self.settings.update({
+            'AuthHeader': {},
+            'Session': None,
+            'Credentials': {},
+            'Username': '',
+            'ConfigId': 0,
+            'ViewId': 0,
+            'ZoneTree': None,
+            'NetTree': None,
+            'ResolveCache': cache.TTLCache(config.ResolveCacheSize, config.ResolveCacheTTL),
+            'EntityCache': cache.TTLCache(config.EntityCacheSize, config.EntityCacheTTL),
+            'RequestCounts': Counter(),
+        })
+        if config_name:
+            self.settings['ConfigName'] = config_name
+        if view_name:
+            self.settings['ViewName'] = view_name
+        self.settings.update(settings)
+
+    def __repr__(self):
+        return '<BamClient {} {} view {}>'.format(self.url, self.user, self.settings['ViewId'])
+
+    def __enter__(self):
+        if not self.settings['AuthHeader']:
+            self.login()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextlib.contextmanager
+    def current(self):
+        """Make this the current client of config for the body of the with"""
+        token = config.Current.set(self)
+        try:
+            yield self
+        finally:
+            config.Current.reset(token)
+
+    def call(self, func, *args, **kwargs):
+        """Run any api or util function as this client"""
+        with self.current():
+            return func(*args, **kwargs)
+
+    def login(self):
+        self.call(util.bam_init, self.url, self.user, self.password)
+
+    def logout(self):
+        """End the BAM session and forget its cached token"""
+        with self.current():
+            api.bam_request('GET', config.Baseurl + 'logout', headers=config.AuthHeader)
+            tokencache.forget(config.Baseurl, config.Username)
+            self.settings['AuthHeader'] = {}
+            api.close_session()
+
+    def close(self):
+        """Close the pooled connections, the next call opens a new Session"""
+        self.call(api.close_session)
+
+    def stats(self):
+        return {
+            'resolve_cache': self.settings['ResolveCache'].stats(),
+            'entity_cache': self.settings['EntityCache'].stats(),
+            'api_calls': dict(self.settings['RequestCounts']),
+        }
+
+
+def delegate(func):
+    @functools.wraps(func)
+    def method(self, *args, **kwargs):
+        with self.current():
+            return func(*args, **kwargs)
+    return method
+
+
+# the util operations, as methods running as the client
+for _func in (
+    util.find_rr, util.find_rr_entities, util.view_rr, util.add_rr, util.update_rr, util.delete_rr,
+    util.get_zone_id, util.is_zone, util.zone_of, util.get_info_by_name, util.list_by_type,
+    util.fetch_entities, util.bind_print, util.normalize_ttl, util.show_rights,
+):
+    setattr(BamClient, _func.__name__, delegate(_func))
+del _func
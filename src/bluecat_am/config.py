@@ -8,6 +8,13 @@ Global Variables convention:
 
 """
 
+import contextvars
+import os
+import sys
+import types
+
+from collections import Counter
+
 Debug = False
 Silent = False
 
@@ -25,6 +32,81 @@ LegalTLDs = ('ca', 'com', 'edu', 'org')
 
 AuthHeader = {}
 
+# Shared keep-alive HTTP Session and its connection pool limits
+Session = None
+PoolConnections = 4
+PoolMaxsize = 10
+PoolBlock = False
+
+# Upper bound on concurrent BAM calls made by one bamcli operation
+MaxWorkers = 8
+
+# Page sizes used by api.iter_pages: the first page, and the cap as pages double
+FirstPageSize = 50
+MaxPageSize = 1000
+
+# Per user cache directory
+CacheDir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'bamcli')
+
+# Session token cache, see tokencache.py. An empty TokenCacheFile disables it
+TokenCacheFile = os.path.join(CacheDir, 'session.json')
+TokenLifetime = 900
+Username = ''
+Credentials = {}
+
+# What stands in for a secret in recordings, profiles and traces, and the
+# request parameters that are secrets (see cassette.py and profiler.py)
+Redacted = 'REDACTED'
+Secrets = ('password',)
+
+# In-process cache of getEntityByName answers, see cache.py.
+# ResolveCache is None for the shared cache.Resolve
+ResolveCacheSize = 4096
+ResolveCacheTTL = 300
+ResolveCache = None
+
+# In-process cache of entities by ID (getEntityById and the RRs found by
+# find_rr), see cache.py. EntityCache is None for the shared cache.Entities
+EntityCacheSize = 4096
+EntityCacheTTL = 300
+EntityCache = None
+
+# Requests sent to the BAM, by HTTP method
+RequestCounts = Counter()
+
+# Records every request sent while it is a profiler.Profiler
+Profiler = None
+
+# Records the calls of the Session to a file, or plays them back, while it
+# is a cassette.Recorder or cassette.Player
+Cassette = None
+
+# Send identical concurrent GETs once, see api.bam_request
+Coalesce = True
+
+# Local index of the zones in the View, see zoneindex.py
+ZoneIndex = True
+ZoneIndexFile = os.path.join(CacheDir, 'zones.json')
+ZoneIndexTTL = 3600
+ZoneTree = None
+
+# Local index of the IPv4 blocks and networks in the Configuration, see netindex.py
+NetIndex = True
+NetIndexFile = os.path.join(CacheDir, 'networks.json')
+NetIndexTTL = 86400
+NetTree = None
+
+# Socket of bamcli serve, see daemon.py. Daemon is set when the CLI is using one
+DaemonSocket = os.environ.get('BAM_DAEMON_SOCKET') or os.path.join(CacheDir, 'daemon.sock')
+Daemon = None
+
+# Command history of bamcli shell, see shell.py
+HistoryFile = os.path.join(CacheDir, 'history')
+HistoryLength = 1000
+
+# Output formats of bamcli export, see export.py
+ExportFormats = ('bind', 'ndjson', 'csv')
+
 ObjectTypes = (
         'Entity',
         'Configuration',
@@ -95,3 +177,72 @@ Categories = {
     'DHCPZones': 'DHCP_ZONES',
     'ServerGroup': 'SERVERGROUP',
 }
+
+
+'''
+
+Per client settings
+
+A BamClient (see client.py) has its own copy of the settings named in
+ClientSettings. While a client is the Current one, reading or setting
+config.ViewId (say) reads or sets that client's ViewId; with no current
+client they are these module globals, as always. Current is a ContextVar,
+so each thread (and asyncio task) has its own current client. Work handed
+to a thread pool takes the client along with carry().
+
+'''
+
+ClientSettings = (
+    'Debug', 'Silent', 'Baseurl', 'ConfigName', 'ConfigId', 'ViewName', 'ViewId', 'RootId',
+    'AuthHeader', 'Session', 'PoolConnections', 'PoolMaxsize', 'PoolBlock', 'MaxWorkers',
+    'TokenCacheFile', 'Username', 'Credentials', 'ResolveCache', 'EntityCache',
+    'RequestCounts',
+    'ZoneIndex', 'ZoneIndexFile', 'ZoneTree',
+    'NetIndex', 'NetIndexFile', 'NetTree',
+)
+
+Current = contextvars.ContextVar('Current', default=None)
+
+
+def carry(func):
+    """Return func wrapped to run with the caller's current client, in any thread"""
+    if Profiler is not None:
+        func = Profiler.carry(func)
+    client = Current.get()
+    if client is None:
+        return func
+
+    def run(*args, **kwargs):
+        token = Current.set(client)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            Current.reset(token)
+    return run
+
+
+class ConfigModule(types.ModuleType):
+    """This module, with the ClientSettings looked up in the current client first"""
+
+    def __getattr__(self, name):
+        client = Current.get()
+        if client is not None and name in client.settings:
+            return client.settings[name]
+        try:
+            return Defaults[name]
+        except KeyError:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(self.__name__, name))
+
+    def __setattr__(self, name, value):
+        if name not in ClientSettings:
+            super().__setattr__(name, value)
+            return
+        client = Current.get()
+        if client is not None:
+            client.settings[name] = value
+        else:
+            Defaults[name] = value
+
+
+Defaults = {name: globals().pop(name) for name in ClientSettings}
+sys.modules[__name__].__class__ = ConfigModule
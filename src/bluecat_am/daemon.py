@@ -0,0 +1,183 @@
+"""
+
+bamcli serve: one warm BAM client shared by many local programs
+
+The daemon logs in once and keeps the pooled Session, the resolve cache
+and the zone index for as long as it runs. It speaks a tiny JSON over
+HTTP protocol on a Unix socket (config.DaemonSocket, mode 0600 so only
+its owner can connect):
+
+    POST /<operation>   {"args": [...], "silent": false, "debug": false}
+        -> {"ok": true, "result": ..., "output": "what the operation printed"}
+    GET  /stats         cache, API call and coalescing counters
+    GET  /ping          -> {"ok": true, "url": BAM URL, "user": BAM user}
+
+silent and debug stand for the -s and -v flags of the caller, for that
+request only; left out, the daemon's own are used.
+
+The operations are the util functions behind the bamcli commands:
+
+    find    util.find_rr(fqdn, [rr_type, [value]])
+    view    util.view_rr(fqdn, [rr_type, [value]])
+    add     util.add_rr(fqdn, rr_type, value, ttl)
+    update  util.update_rr(fqdn, rr_type, value, ttl)
+    delete  util.delete_rr(fqdn, rr_type, [value])
+
+Identical find and view requests that arrive while one is being worked
+on share its answer (singleflight.Group), so a burst of clients asking
+about the same name costs one set of upstream calls.
+
+bamcli itself uses a running daemon for those commands (see cli.run) when
+it is logged in to the same BAM URL as the same user, calling
+daemonclient.call() instead of the util function; what is printed is what
+the daemon printed, following the -s and -v flags of the bamcli command.
+
+"""
+
+import collections
+import http.server
+import json
+import os
+import socketserver
+import sys
+import types
+
+from bluecat_am import api, batch, cache, config, daemonclient, singleflight, util
+
+Operations = {
+    'find': util.find_rr,
+    'view': util.view_rr,
+    'add': util.add_rr,
+    'update': util.update_rr,
+    'delete': util.delete_rr,
+}
+ReadOnly = ('find', 'view')
+
+Flights = singleflight.Group()
+
+
+def stats():
+    return {
+        'resolve_cache': cache.resolve().stats(),
+        'entity_cache': cache.entities().stats(),
+        'zones': len(config.ZoneTree) if config.ZoneTree is not None else None,
+        'networks': len(config.NetTree) if config.NetTree is not None else None,
+        'api_calls': dict(config.RequestCounts),
+        'coalesced': Flights.stats(),
+        'coalesced_gets': api.Flights.stats(),
+    }
+
+
+'''
+
+Server side
+
+'''
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if config.Debug:
+            config.Logger.debug('serve: ' + format % args)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/ping':
+            self.reply(200, {'ok': True, 'url': config.Baseurl, 'user': config.Username})
+        elif self.path == '/stats':
+            self.reply(200, stats())
+        else:
+            self.reply(404, {'ok': False, 'error': 'no such path'})
+
+    def do_POST(self):
+        op = self.path.strip('/')
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            args = list(body.get('args', []))
+            flags = {'Silent': bool(body.get('silent', config.Silent)),
+                     'Debug': bool(body.get('debug', config.Debug))}
+        except ValueError as err:
+            self.reply(400, {'ok': False, 'error': 'bad request: {}'.format(err)})
+            return
+        if op not in Operations:
+            self.reply(404, {'ok': False, 'error': 'no such operation: {}'.format(op)})
+            return
+        self.reply(200, self.server.run(op, args, flags))
+
+
+class Flags(collections.ChainMap):
+    """Settings of one request: its own Silent and Debug over the daemon's settings
+
+    Anything else set while serving it, a Session or a zone index, is the daemon's
+    """
+
+    def __setitem__(self, key, value):
+        if key in self.maps[0]:
+            self.maps[0][key] = value
+        else:
+            self.maps[-1][key] = value
+
+
+class ServerMixin(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def run(self, op, args, flags=None):
+        flags = flags or {'Silent': config.Silent, 'Debug': config.Debug}
+        token = config.Current.set(types.SimpleNamespace(settings=Flags(flags, config.Defaults)))
+        try:
+            if op in ReadOnly:
+                key = (op, json.dumps(args), flags['Silent'], flags['Debug'])
+                result, err, text = Flights.do(key, self.out.capture, Operations[op], *args)
+            else:
+                result, err, text = self.out.capture(Operations[op], *args)
+        finally:
+            config.Current.reset(token)
+        if err is not None:
+            return {'ok': False, 'error': str(err), 'output': text}
+        return {'ok': True, 'result': result, 'output': text}
+
+
+class UnixServer(ServerMixin, socketserver.UnixStreamServer):
+    pass
+
+
+def serve(path=None):
+    """Serve on the Unix socket path until interrupted"""
+    path = path or config.DaemonSocket
+    if os.path.exists(path):
+        if daemonclient.available(path):
+            raise RuntimeError('a bamcli daemon is already listening on {}'.format(path))
+        os.unlink(path)
+    os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+
+    out = batch.ThreadOutput(sys.stdout)
+    old_umask = os.umask(0o177)
+    try:
+        server = UnixServer(path, Handler)
+    finally:
+        os.umask(old_umask)
+    server.out = out
+
+    real_stdout = sys.stdout
+    sys.stdout = out
+    try:
+        print('bamcli daemon listening on {}'.format(path), file=sys.stderr)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = real_stdout
+        server.server_close()
+        os.unlink(path)
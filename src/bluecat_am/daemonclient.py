@@ -0,0 +1,75 @@
+"""
+
+Talking to a running bamcli serve daemon (see daemon.py)
+
+Kept apart from the server so that a bamcli command handed to the daemon
+starts without loading requests and the API modules it does not use.
+
+"""
+
+import http.client
+import json
+import os
+import socket
+import sys
+
+from bluecat_am import config
+
+
+class UnixConnection(http.client.HTTPConnection):
+    """HTTPConnection to a Unix socket"""
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def request(method, endpoint, body=None, path=None, timeout=None):
+    conn = UnixConnection(path or config.DaemonSocket, timeout)
+    try:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        conn.request(method, endpoint, body=data, headers=headers)
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def available(path=None, url=None, user=None):
+    """True if a daemon answers on the socket, logged in to url as user when those are given"""
+    path = path or config.DaemonSocket
+    if not path or not os.path.exists(path):
+        return False
+    try:
+        answer = request('GET', '/ping', path=path, timeout=0.5)
+    except (OSError, ValueError, http.client.HTTPException):
+        return False
+    if url is not None and (answer.get('url') or '').rstrip('/') != url.rstrip('/'):
+        return False
+    if user is not None and answer.get('user') != user:
+        return False
+    return answer.get('ok', False)
+
+
+def call(op, *args):
+    """Run an operation in the daemon, print what it printed and return its result
+
+    The daemon runs it with this process's config.Silent and config.Debug.
+    Raises OSError if the daemon cannot be reached
+    """
+    body = {'args': list(args), 'silent': config.Silent, 'debug': config.Debug}
+    try:
+        answer = request('POST', '/' + op, body)
+    except http.client.HTTPException as err:
+        raise OSError(str(err))
+    sys.stdout.write(answer.get('output', ''))
+    if not answer.get('ok'):
+        print('bamcli daemon: {}'.format(answer.get('error')), file=sys.stderr)
+        return None
+    return answer.get('result')
@@ -0,0 +1,188 @@
+"""
+
+Stream the Resource Records of a zone out as BIND, NDJSON or CSV
+
+getEntities already returns each record with its properties, so records
+are written straight from the pages of api.iter_entities: output starts
+with the first page and only a page or two is ever held in memory, however
+big the zone is.
+
+With recursive=True the subzones are walked too, up to config.MaxWorkers
+zones at once. The walkers hand over chunks of records through a bounded
+queue and only the calling thread writes, so a chunk is never split and
+memory stays bounded. Records of different zones may then come out
+interleaved; every line carries the absolute name so that is harmless.
+
+"""
+
+import csv
+import json
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from bluecat_am import api, config, util, zoneindex
+
+Formats = config.ExportFormats
+ObjTypes = tuple(config.BAM2Bind)
+ChunkSize = 100
+
+DONE = object()
+
+
+def records(ent):
+    """Yield (fqdn, ttl, rr_type, priority, value) for each value of a record entity"""
+    d = util.props2dict(ent.get('properties') or '')
+    rr_type = config.BAM2Bind[ent['type']]
+    value = d.get(config.RRTypeMap[rr_type]['prop_key'], '')
+    values = value.split(',') if rr_type == 'A' else [value]
+    for val in values:
+        yield d.get('absoluteName', ent['name']), d.get('ttl', '86400'), rr_type, d.get('priority'), val
+
+
+class BindWriter:
+    fmt_str = '{:<40} {:>6} IN {:<6} {}'
+
+    def __init__(self, out):
+        self.out = out
+
+    def begin(self, zone_fqdn):
+        self.out.write('$ORIGIN {}.\n'.format(zone_fqdn))
+
+    def write(self, ents):
+        lines = []
+        for ent in ents:
+            for fqdn, ttl, rr_type, pri, value in records(ent):
+                if rr_type == 'TXT':
+                    value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+                elif rr_type == 'MX':
+                    value = '{} {}.'.format(pri, value)
+                elif rr_type == 'CNAME':
+                    value += '.'
+                lines.append(self.fmt_str.format(fqdn + '.', ttl, rr_type, value))
+        if lines:
+            self.out.write('\n'.join(lines) + '\n')
+
+
+class NdjsonWriter:
+
+    def __init__(self, out):
+        self.out = out
+
+    def begin(self, zone_fqdn):
+        pass
+
+    def write(self, ents):
+        for ent in ents:
+            for fqdn, ttl, rr_type, pri, value in records(ent):
+                d = {'id': ent['id'], 'fqdn': fqdn, 'ttl': ttl, 'type': rr_type, 'value': value}
+                if pri is not None:
+                    d['priority'] = pri
+                self.out.write(json.dumps(d) + '\n')
+
+
+class CsvWriter:
+
+    def __init__(self, out):
+        self.out = out
+        self.csv = csv.writer(out, lineterminator='\n')
+
+    def begin(self, zone_fqdn):
+        self.csv.writerow(('id', 'fqdn', 'ttl', 'type', 'priority', 'value'))
+
+    def write(self, ents):
+        for ent in ents:
+            for fqdn, ttl, rr_type, pri, value in records(ent):
+                self.csv.writerow((ent['id'], fqdn, ttl, rr_type, pri or '', value))
+
+
+Writers = {'bind': BindWriter, 'ndjson': NdjsonWriter, 'csv': CsvWriter}
+
+
+def chunks(zone_id):
+    """Yield the records directly in a zone in lists of up to ChunkSize"""
+    for obj_type in ObjTypes:
+        chunk = []
+        for ent in api.iter_entities(zone_id, obj_type):
+            chunk.append(ent)
+            if len(chunk) >= ChunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def export_tree(zone_id, zone_fqdn, writer):
+    """Write zone_id and all the zones below it, walking up to config.MaxWorkers zones at once
+
+    Returns the errors met on the way
+    """
+    results = queue.Queue(maxsize=2 * max(1, config.MaxWorkers))
+    lock = threading.Lock()
+    pending = [0]
+    errors = []
+    stop = threading.Event()
+    broken = None
+
+    with ThreadPoolExecutor(max_workers=max(1, config.MaxWorkers)) as pool:
+
+        def submit(zid, name):
+            with lock:
+                pending[0] += 1
+            pool.submit(config.carry(walk), zid, name)
+
+        def walk(zid, name):
+            try:
+                if stop.is_set():
+                    return
+                for child, child_id in zoneindex.list_child_zones(zid, name).items():
+                    submit(child_id, child)
+                for chunk in chunks(zid):
+                    if stop.is_set():
+                        break
+                    results.put(chunk)
+            except Exception as err:
+                results.put(err)
+            finally:
+                results.put(DONE)
+
+        submit(zone_id, zone_fqdn)
+        while True:
+            with lock:
+                if pending[0] == 0:
+                    break
+            item = results.get()
+            if item is DONE:
+                with lock:
+                    pending[0] -= 1
+            elif isinstance(item, Exception):
+                errors.append(item)
+            elif not stop.is_set():
+                try:
+                    writer.write(item)
+                except Exception as err:
+                    # keep draining the queue so the walkers can finish
+                    stop.set()
+                    broken = err
+    if broken is not None:
+        raise broken
+    return errors
+
+
+def export_zone(zone_fqdn, fmt, out, recursive=False):
+    """Write the records of zone_fqdn to out in fmt, returns False if there is no such zone"""
+    zone_fqdn = zone_fqdn.rstrip('.').lower()
+    zone_id = util.get_zone_id(zone_fqdn)
+    if not zone_id:
+        return False
+    writer = Writers[fmt](out)
+    writer.begin(zone_fqdn)
+    if not recursive:
+        for chunk in chunks(zone_id):
+            writer.write(chunk)
+        return True
+    errors = export_tree(zone_id, zone_fqdn, writer)
+    for err in errors:
+        config.Logger.error('export: {}'.format(err))
+    return not errors
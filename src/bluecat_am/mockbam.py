@@ -0,0 +1,592 @@
+"""
+
+A stand-in for the BAM REST API, for tests and benchmarks
+
+MockBam serves the REST calls bluecat_am.api makes (login, getEntityByName,
+getEntities, getEntitiesByName, getEntityById, getParent, update, delete,
+the add*Record calls, searchByObjectTypes, getIPRangedByIP, the access
+right calls ...) from an in-memory tree, on a port of 127.0.0.1:
+
+    with MockBam(latency=0.02) as bam:
+        generate(bam.store, records=100000, zones=20)
+        util.bam_init(bam.url, 'ralph', 'secret')
+        util.view_rr('zone1.bigcorp.ca')
+        print(bam.calls)
+
+The tree is the usual one: Configuration config.ConfigName, View
+config.ViewName, the ca, bigcorp.ca and zoneN.bigcorp.ca zones and their
+records, an IP4Block with an IP4Network per 256 addresses handed out, and
+users with access rights. Any user logs in with any password but 'wrong'.
+
+Every request waits latency seconds (latencies overrides it per endpoint)
+plus per_item seconds for each object a list call returns, so a test or a
+benchmark can see what round trips cost without a real BAM. calls counts
+the requests by endpoint.
+
+It can also be run on its own, e.g. with a million records:
+
+    $ python -m bluecat_am.mockbam --records 1000000 --zones 100 --port 8080
+    $ bamcli -U http://127.0.0.1:8080/Services/REST/v1/ -p secret view zone1.bigcorp.ca
+
+"""
+
+import argparse
+import collections
+import fnmatch
+import ipaddress
+import json
+import threading
+import time
+import uuid
+
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from bluecat_am import config
+
+Prefix = '/Services/REST/v1/'
+NotFound = {'id': 0, 'name': None, 'type': None, 'properties': None}
+
+
+class BamError(Exception):
+    """An API call the BAM would refuse, answered with a 500"""
+
+
+def props(d):
+    return ''.join('{}={}|'.format(k, v) for k, v in d.items() if v is not None)
+
+
+def ip_int(ip):
+    return int(ipaddress.IPv4Address(ip))
+
+
+class Store:
+    """The entity tree and the API calls working on it"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.next_id = 2200000
+        # id -> [name, type, parent id, properties]
+        self.ents = {}
+        # (parent id, type) -> ids, in the order added
+        self.children = collections.defaultdict(list)
+        # parent id -> name -> ids
+        self.names = collections.defaultdict(dict)
+        # user id -> access rights
+        self.rights = collections.defaultdict(list)
+        self.networks = None
+        self.tokens = {}
+        self.config_id = self.add(config.RootId, config.ConfigName, 'Configuration', '')
+        self.view_id = self.add(self.config_id, config.ViewName, 'View', '')
+
+    '''
+
+    The tree
+
+    '''
+
+    def add(self, parent, name, typ, properties):
+        with self.lock:
+            obj_id = self.next_id
+            self.next_id += 1
+            self.ents[obj_id] = [name, typ, parent, properties]
+            self.children[(parent, typ)].append(obj_id)
+            self.names[parent].setdefault(name, []).append(obj_id)
+            if typ == 'IP4Network':
+                self.networks = None
+            return obj_id
+
+    def remove(self, obj_id):
+        """Remove obj_id and everything below it"""
+        with self.lock:
+            name, typ, parent, properties = self.ents.pop(obj_id)
+            self.children[(parent, typ)].remove(obj_id)
+            same = self.names[parent][name]
+            same.remove(obj_id)
+            if not same:
+                del self.names[parent][name]
+            for ids in list(self.names.get(obj_id, {}).values()):
+                for child in list(ids):
+                    self.remove(child)
+            self.names.pop(obj_id, None)
+            for key in [key for key in self.children if key[0] == obj_id]:
+                del self.children[key]
+            if typ == 'IP4Network':
+                self.networks = None
+
+    def entity(self, obj_id):
+        ent = self.ents.get(obj_id)
+        if ent is None:
+            return dict(NotFound)
+        name, typ, parent, properties = ent
+        return {'id': obj_id, 'name': name, 'type': typ, 'properties': properties}
+
+    def find(self, parent, name, typ):
+        """Ids of the children of parent called name, of type typ ('Entity' for any)"""
+        ids = self.names.get(parent, {}).get(name, [])
+        return [i for i in ids if typ == 'Entity' or self.ents[i][1] == typ]
+
+    def zone_of(self, fqdn):
+        """(zone id, zone fqdn, name in the zone) of the deepest zone owning fqdn"""
+        labels = fqdn.strip('.').split('.')
+        zone, zone_fqdn, depth = None, None, 0
+        parent = self.view_id
+        for i, label in enumerate(reversed(labels)):
+            found = self.find(parent, label, 'Zone')
+            if not found:
+                break
+            parent = zone = found[0]
+            depth = i + 1
+        if zone is None:
+            raise BamError('Parent zone not found for {}'.format(fqdn))
+        zone_fqdn = '.'.join(labels[len(labels) - depth:])
+        return zone, zone_fqdn, '.'.join(labels[:len(labels) - depth])
+
+    def add_record(self, fqdn, typ, fields, ttl):
+        with self.lock:
+            zone, zone_fqdn, name = self.zone_of(fqdn)
+            absolute = name + '.' + zone_fqdn if name else zone_fqdn
+            ttl = None if ttl in (None, '', '-1', -1) else ttl
+            fields = dict({'absoluteName': absolute}, **fields, ttl=ttl)
+            return self.add(zone, name, typ, props(fields))
+
+    def network_of(self, ip):
+        with self.lock:
+            if self.networks is None:
+                nets = []
+                for obj_id in self.children_of_type('IP4Network'):
+                    cidr = dict(p.split('=', 1) for p in self.ents[obj_id][3].split('|') if p)['CIDR']
+                    net = ipaddress.IPv4Network(cidr)
+                    nets.append((int(net.network_address), int(net.broadcast_address), obj_id))
+                nets.sort()
+                self.networks = ([n[0] for n in nets], nets)
+            starts, nets = self.networks
+        i = bisect_right(starts, ip_int(ip)) - 1
+        if i >= 0 and nets[i][1] >= ip_int(ip):
+            return nets[i][2]
+        return 0
+
+    def children_of_type(self, typ):
+        return [i for key, ids in list(self.children.items()) if key[1] == typ for i in ids]
+
+    '''
+
+    The API calls, called with the query parameters and the JSON body
+
+    '''
+
+    def serves(self, endpoint):
+        return hasattr(self, 'api_' + endpoint)
+
+    def call(self, endpoint, params, body):
+        with self.lock:
+            return getattr(self, 'api_' + endpoint)(body=body, **params)
+
+    def api_login(self, username, password, body=None):
+        if password == 'wrong':
+            raise PermissionError('Invalid username or password')
+        token = uuid.uuid4().hex[:32]
+        self.tokens[token] = username
+        return 'Session Token-> BAMAuthToken: {} <- for User : {}'.format(token, username)
+
+    def api_logout(self, body=None):
+        return 'User logged out'
+
+    def api_getSystemInfo(self, body=None):
+        return 'hostName=mockbam|version=9.2.0|address=127.0.0.1|'
+
+    def api_getEntityByName(self, parentId, name, type, body=None):
+        found = self.find(int(parentId), name, type)
+        return self.entity(found[0]) if found else dict(NotFound)
+
+    def api_getEntityById(self, id, body=None):
+        return self.entity(int(id))
+
+    def api_getEntities(self, parentId, type, start=0, count=10, body=None):
+        if type == 'Entity':
+            ids = [i for key, ids in self.children.items() if key[0] == int(parentId) for i in ids]
+        else:
+            ids = self.children.get((int(parentId), type), [])
+        return [self.entity(i) for i in ids[int(start):int(start) + int(count)]]
+
+    def api_getEntitiesByName(self, parentId, name, type, start=0, count=10, body=None):
+        ids = self.find(int(parentId), name, type)
+        return [self.entity(i) for i in ids[int(start):int(start) + int(count)]]
+
+    def api_getEntitiesByNameUsingOptions(self, parentId, name, type, options='', start=0, count=10, body=None):
+        return self.api_getEntitiesByName(parentId, name, type, start, count)
+
+    def api_getParent(self, entityId, body=None):
+        ent = self.ents.get(int(entityId))
+        return self.entity(ent[2]) if ent else dict(NotFound)
+
+    def api_searchByObjectTypes(self, keyword, types, start=0, count=10, body=None):
+        pattern = keyword if '*' in keyword else '*' + keyword + '*'
+        ids = [i for typ in types.split(',') for i in self.children_of_type(typ)
+               if fnmatch.fnmatchcase(self.ents[i][0] or '', pattern)]
+        return [self.entity(i) for i in ids[int(start):int(start) + int(count)]]
+
+    def api_customSearch(self, filters, type, options='', start=0, count=10, body=None):
+        return []
+
+    def api_searchByCategory(self, keyword, category, start=0, count=10, body=None):
+        return []
+
+    def api_getZonesByHint(self, containerId, start=0, count=1, options='', body=None):
+        # every zone below the container, at most 10 a call
+        hint = dict(p.split('=', 1) for p in options.split('|') if '=' in p).get('hint', '')
+        ids = []
+        todo = [int(containerId)]
+        while todo:
+            for i in self.children.get((todo.pop(0), 'Zone'), []):
+                if self.ents[i][0].startswith(hint):
+                    ids.append(i)
+                todo.append(i)
+        count = min(int(count), 10)
+        return [self.entity(i) for i in ids[int(start):int(start) + count]]
+
+    def api_getHostRecordsByHint(self, options='', start=0, count=10, body=None):
+        hint = dict(p.split('=', 1) for p in options.split('|') if '=' in p).get('hint', '')
+        ids = [i for i in self.children_of_type('HostRecord') if self.ents[i][0].startswith(hint)]
+        return [self.entity(i) for i in ids[int(start):int(start) + int(count)]]
+
+    def api_getLinkedEntities(self, entityId, type, start=0, count=10, body=None):
+        return []
+
+    def api_linkEntities(self, entity1Id, entity2Id, properties='', body=None):
+        return None
+
+    def api_unlinkEntities(self, entity1Id, entity2Id, properties='', body=None):
+        return None
+
+    def api_getMACAddress(self, configurationId, macAddress, body=None):
+        return dict(NotFound)
+
+    def api_getConfigurationSetting(self, configurationId, settingName, body=None):
+        return {}
+
+    def api_update(self, body=None):
+        return self.api_updateWithOptions(body)
+
+    def api_updateWithOptions(self, body=None, options=''):
+        obj_id = int(body.get('id') or 0)
+        if obj_id not in self.ents:
+            raise BamError('Object was not found')
+        ent = self.ents[obj_id]
+        if body.get('name') is not None and body['name'] != ent[0]:
+            same = self.names[ent[2]][ent[0]]
+            same.remove(obj_id)
+            if not same:
+                del self.names[ent[2]][ent[0]]
+            ent[0] = body['name']
+            self.names[ent[2]].setdefault(ent[0], []).append(obj_id)
+        ent[3] = body.get('properties') or ''
+        if ent[1] == 'IP4Network':
+            self.networks = None
+        return None
+
+    def api_delete(self, objectId, body=None):
+        if int(objectId) not in self.ents:
+            raise BamError('Object was not found')
+        self.remove(int(objectId))
+        return None
+
+    def api_deleteWithOptions(self, objectId, options='', body=None):
+        return self.api_delete(objectId)
+
+    def api_addZone(self, parentId, absoluteName, properties='', body=None):
+        name = absoluteName.split('.')[0]
+        if self.find(int(parentId), name, 'Zone'):
+            raise BamError('Duplicate of another item')
+        return self.add(int(parentId), name, 'Zone',
+                        '{}absoluteName={}|'.format(properties.rstrip('|') + '|' if properties else '',
+                                                    absoluteName))
+
+    def api_addEntity(self, parentId, body=None):
+        return self.add(int(parentId), body.get('name'), body.get('type'), body.get('properties') or '')
+
+    def api_addHostRecord(self, viewId, absoluteName, addresses, ttl=-1, properties='', body=None):
+        for ip in addresses.split(','):
+            ip_int(ip)
+        return self.add_record(absoluteName, 'HostRecord', {'addresses': addresses}, ttl)
+
+    def api_addAliasRecord(self, viewId, absoluteName, linkedRecordName, ttl=-1, properties='', body=None):
+        return self.add_record(absoluteName, 'AliasRecord', {'linkedRecordName': linkedRecordName}, ttl)
+
+    def api_addMXRecord(self, viewId, absoluteName, priority, linkedRecordName, ttl=-1, properties='', body=None):
+        return self.add_record(absoluteName, 'MXRecord',
+                               {'linkedRecordName': linkedRecordName, 'priority': priority}, ttl)
+
+    def api_addTXTRecord(self, viewId, absoluteName, txt, ttl=-1, properties='', body=None):
+        return self.add_record(absoluteName, 'TXTRecord', {'txt': txt}, ttl)
+
+    def api_addGenericRecord(self, viewId, absoluteName, type, rdata, ttl=-1, properties='', body=None):
+        return self.add_record(absoluteName, 'GenericRecord', {'type': type, 'rdata': rdata}, ttl)
+
+    def api_addResourceRecord(self, viewId, absoluteName, type, rdata, ttl=-1, properties='', body=None):
+        return self.api_addGenericRecord(viewId, absoluteName, type, rdata, ttl)
+
+    def api_addExternalHostRecord(self, viewId, name, properties='', body=None):
+        return self.add(int(viewId), name, 'ExternalHostRecord', properties)
+
+    def api_addIP4BlockByCIDR(self, parentId, CIDR, properties='', body=None):
+        return self.add(int(parentId), '', 'IP4Block', 'CIDR={}|{}'.format(CIDR, properties))
+
+    def api_addIP4Network(self, blockId, CIDR, properties='', body=None):
+        return self.add(int(blockId), '', 'IP4Network', 'CIDR={}|{}'.format(CIDR, properties))
+
+    def api_getIPRangedByIP(self, containerId, type, address, body=None):
+        return self.entity(self.network_of(address))
+
+    def api_getIP4Address(self, containerId, address, body=None):
+        return dict(NotFound)
+
+    def api_assignIP4Address(self, configurationId, ip4Address, action, macAddress='', hostInfo='',
+                             properties='', body=None, macAdress=''):
+        net = self.network_of(ip4Address)
+        if not net:
+            raise BamError('IP address {} is not in a network'.format(ip4Address))
+        return self.add(net, '', 'IP4Address', 'address={}|state={}|'.format(ip4Address, action))
+
+    def api_getAccessRight(self, entityId, userId, body=None):
+        for right in self.rights.get(int(userId), []):
+            if right['entityId'] == int(entityId):
+                return right
+        raise BamError('Access right not found')
+
+    def api_getAccessRightsForEntity(self, entityId, start=0, count=10, body=None):
+        found = [r for rights in self.rights.values() for r in rights if r['entityId'] == int(entityId)]
+        return found[int(start):int(start) + int(count)]
+
+    def api_getAccessRightsForUser(self, userId, start=0, count=10, body=None):
+        return self.rights.get(int(userId), [])[int(start):int(start) + int(count)]
+
+    def add_user(self, name):
+        return self.add(config.RootId, name, 'User', 'userType=API|userAccessType=API|')
+
+    def grant(self, user_id, entity_id, value='CHANGE'):
+        self.rights[user_id].append({'entityId': entity_id, 'userId': user_id, 'value': value,
+                                     'overrides': None, 'properties': None})
+
+
+'''
+
+The HTTP server
+
+'''
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, status, body, raw=False):
+        data = (body if raw else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain' if raw else 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle_call(self):
+        mock = self.server.mock
+        parts = urlsplit(self.path)
+        endpoint = parts.path[len(Prefix):] if parts.path.startswith(Prefix) else ''
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        mock.count(endpoint)
+
+        if endpoint == '':
+            mock.wait(endpoint, 0)
+            self.answer(401, 'UNAUTHORIZED USER', raw=True)
+            return
+        if endpoint != 'login':
+            auth = self.headers.get('Authorization', '')
+            if auth.partition('BAMAuthToken: ')[2] not in mock.store.tokens:
+                mock.wait(endpoint, 0)
+                self.answer(401, 'UNAUTHORIZED USER', raw=True)
+                return
+        if not mock.store.serves(endpoint):
+            mock.wait(endpoint, 0)
+            self.answer(404, 'no such call: {}'.format(endpoint))
+            return
+        try:
+            result = mock.store.call(endpoint, params, body)
+        except PermissionError as err:
+            mock.wait(endpoint, 0)
+            self.answer(401, str(err))
+            return
+        except (BamError, KeyError, TypeError, ValueError) as err:
+            mock.wait(endpoint, 0)
+            self.answer(500, str(err))
+            return
+        mock.wait(endpoint, len(result) if isinstance(result, list) else 0)
+        if result is None:
+            self.answer(200, '', raw=True)
+        else:
+            self.answer(200, result)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_call
+
+
+class MockBam:
+    """The Store served over HTTP on 127.0.0.1, in a background thread"""
+
+    def __init__(self, store=None, latency=0.0, latencies=None, per_item=0.0, port=0):
+        self.store = store or Store()
+        self.latency = latency
+        self.latencies = dict(latencies or {})
+        self.per_item = per_item
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}{}'.format(self.server.server_address[1], Prefix)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint or '(probe)'] += 1
+
+    def wait(self, endpoint, items):
+        delay = self.latencies.get(endpoint, self.latency) + self.per_item * items
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+'''
+
+Synthetic trees
+
+'''
+
+
+def add_zone(store, fqdn):
+    """Add fqdn and any missing zones above it, return its id"""
+    parent = store.view_id
+    labels = fqdn.split('.')
+    for i in range(len(labels) - 1, -1, -1):
+        found = store.find(parent, labels[i], 'Zone')
+        if found:
+            parent = found[0]
+        else:
+            parent = store.add(parent, labels[i], 'Zone',
+                               'deployable=true|absoluteName={}|'.format('.'.join(labels[i:])))
+    return parent
+
+
+class Addresses:
+    """Hands out addresses, adding an IP4Network for each /24 used"""
+
+    def __init__(self, store, block='10.0.0.0/8'):
+        self.store = store
+        self.block = ipaddress.IPv4Network(block)
+        self.block_id = store.add(store.config_id, '', 'IP4Block', 'CIDR={}|'.format(block))
+        self.next = int(self.block.network_address) + 256
+        self.network_ids = []
+
+    def take(self):
+        if self.next % 256 in (0, 255):
+            self.next += self.next % 256 == 255
+            net = ipaddress.IPv4Network((self.next, 24))
+            self.network_ids.append(self.store.add(
+                self.block_id, 'net{}'.format(len(self.network_ids)), 'IP4Network',
+                'CIDR={}|gateway={}|'.format(net, net.network_address + 1)))
+            self.next += 2
+        ip = str(ipaddress.IPv4Address(self.next))
+        self.next += 1
+        return ip
+
+
+def fill_zone(store, zone_fqdn, records, addresses):
+    """Add records RRs to the zone: 70% A, 15% CNAME, 10% TXT, 5% MX"""
+    zone_id = add_zone(store, zone_fqdn)
+    add = store.add
+    for n in range(records):
+        kind = n % 20
+        if kind < 14:
+            name = 'host{}'.format(n)
+            ips = addresses.take() if n % 7 else addresses.take() + ',' + addresses.take()
+            add(zone_id, name, 'HostRecord', 'absoluteName={}.{}|addresses={}|ttl=3600|'.format(
+                name, zone_fqdn, ips))
+        elif kind < 17:
+            name = 'alias{}'.format(n)
+            add(zone_id, name, 'AliasRecord', 'absoluteName={}.{}|linkedRecordName=host{}.{}|'.format(
+                name, zone_fqdn, n - kind, zone_fqdn))
+        elif kind < 19:
+            name = 'host{}'.format(n - kind)
+            add(zone_id, name, 'TXTRecord', 'absoluteName={}.{}|txt=owner {}|'.format(name, zone_fqdn, n))
+        else:
+            add(zone_id, '', 'MXRecord', 'absoluteName={}|linkedRecordName=mail{}.{}|priority={}|'.format(
+                zone_fqdn, n, zone_fqdn, n % 50))
+    return zone_id
+
+
+def generate(store, records=1000, zones=10, domain='bigcorp.ca', users=('ralph',)):
+    """Fill store with records RRs spread over zones zoneN.domain
+
+    The users get access rights to every zone and network. Returns
+    {'zones': {fqdn: id}, 'networks': [ids], 'users': {name: id}}
+    """
+    addresses = Addresses(store)
+    domain_id = add_zone(store, domain)
+    store.add(domain_id, '', 'HostRecord', 'absoluteName={}|addresses={}|'.format(domain, addresses.take()))
+    made = {}
+    for z in range(zones):
+        share = records // zones + (z < records % zones)
+        fqdn = 'zone{}.{}'.format(z + 1, domain)
+        made[fqdn] = fill_zone(store, fqdn, share, addresses)
+    user_ids = {}
+    for name in users:
+        user_ids[name] = store.add_user(name)
+        for zone_id in made.values():
+            store.grant(user_ids[name], zone_id)
+        for net_id in addresses.network_ids:
+            store.grant(user_ids[name], net_id)
+    return {'zones': made, 'networks': addresses.network_ids, 'users': user_ids, 'addresses': addresses}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic BAM REST API')
+    parser.add_argument('--records', type=int, default=1000)
+    parser.add_argument('--zones', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every call')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    mock = MockBam(latency=args.latency, port=args.port)
+    start = time.perf_counter()
+    generate(mock.store, args.records, args.zones)
+    print('{} entities made in {:.1f}s, serving {}'.format(
+        len(mock.store.ents), time.perf_counter() - start, mock.url))
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
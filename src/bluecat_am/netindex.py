@@ -0,0 +1,259 @@
+"""
+
+Local index of the IPv4 blocks and networks in config.ConfigId
+
+Checking that an address is in a defined network used to take one
+getIPRangedByIP call per address, so renumbering a host with many
+addresses cost a round trip for each. The index holds the CIDR of every
+IP4Block and IP4Network of the Configuration as integer ranges, kept in
+arrays sorted on the first address:
+
+    starts  [167772160, 167772416, 167837696]     10.0.0.0, 10.0.1.0, 10.1.0.0
+    ends    [167772415, 167772671, 167838207]     10.0.0.255, 10.0.1.255, 10.1.1.255
+    ids     [2209219, 2206768, 2206774]
+
+so the network an address is in is found with a bisect, locally in
+O(log n). Blocks nest, so they also keep the running maximum of the ends,
+which bounds the walk back to the innermost block holding the address.
+Many addresses are looked up at once by sorting them first, each search
+then starting where the last one ended.
+
+The index is filled by listing the IP4Block children of the Configuration,
+then the IP4Block and IP4Network children of every block found
+(api.iter_entities), and is saved to config.NetIndexFile. It is listed
+again once older than config.NetIndexTTL. Networks change rarely, and an
+address the index has no network for is still asked about (networks_of),
+so a network added since is found and remembered.
+api.add_ip4_block_by_cidr, api.add_ip4_network and api.delete keep a loaded
+index current.
+
+"""
+
+import bisect
+import ipaddress
+import json
+import os
+import time
+
+from bluecat_am import api, config, util
+
+
+def ip_int(ip):
+    return int(ipaddress.IPv4Address(ip))
+
+
+def cidr_range(cidr):
+    net = ipaddress.IPv4Network(cidr, strict=False)
+    return int(net.network_address), int(net.broadcast_address)
+
+
+def cidr_of(ent):
+    for pair in (ent.get('properties') or '').split('|'):
+        if pair.startswith('CIDR='):
+            return pair.split('=', 1)[1]
+    return None
+
+
+class Ranges:
+    """Address ranges sorted on their first address, the inner one last on a tie"""
+
+    def __init__(self, cidrs=None):
+        self.cidrs = dict(cidrs or {})
+        self.sort()
+
+    def __len__(self):
+        return len(self.cidrs)
+
+    def sort(self):
+        ranges = sorted((cidr_range(cidr) + (obj_id,) for cidr, obj_id in self.cidrs.items()),
+                        key=lambda r: (r[0], -r[1]))
+        self.starts = [r[0] for r in ranges]
+        self.ends = [r[1] for r in ranges]
+        self.ids = [r[2] for r in ranges]
+        self.reach = []
+        most = -1
+        for end in self.ends:
+            most = max(most, end)
+            self.reach.append(most)
+
+    def add(self, cidr, obj_id):
+        self.cidrs[str(ipaddress.IPv4Network(cidr, strict=False))] = obj_id
+        self.sort()
+
+    def remove_id(self, obj_id):
+        """Drop the range with this id, return True if there was one"""
+        for cidr, oid in list(self.cidrs.items()):
+            if oid == obj_id:
+                del self.cidrs[cidr]
+                self.sort()
+                return True
+        return False
+
+    def find(self, n, lo=0):
+        """(id of the innermost range holding address n or 0, where to search for a larger n from)"""
+        pos = bisect.bisect_right(self.starts, n, lo)
+        i = pos - 1
+        while i >= 0 and self.reach[i] >= n:
+            if self.ends[i] >= n:
+                return self.ids[i], pos
+            i -= 1
+        return 0, pos
+
+
+class NetIndex:
+    """The IPv4 blocks and networks of a Configuration"""
+
+    def __init__(self, config_id, blocks=None, networks=None, listed=0):
+        self.config_id = config_id
+        self.listed = listed
+        self.blocks = Ranges(blocks)
+        self.networks = Ranges(networks)
+
+    def __len__(self):
+        return len(self.networks)
+
+    def add(self, typ, cidr, obj_id):
+        (self.blocks if typ == 'IP4Block' else self.networks).add(cidr, obj_id)
+
+    def remove_id(self, obj_id):
+        return self.networks.remove_id(obj_id) or self.blocks.remove_id(obj_id)
+
+    def network(self, ip):
+        """Id of the IP4Network holding ip, 0 if none does"""
+        return self.networks.find(ip_int(ip))[0]
+
+    def block(self, ip):
+        """Id of the innermost IP4Block holding ip, 0 if none does"""
+        return self.blocks.find(ip_int(ip))[0]
+
+    def find_all(self, ips):
+        """{ip: id of the IP4Network holding it or 0} for many addresses, in one pass
+
+        Addresses that are not IPv4 addresses are in no network
+        """
+        found = {}
+        valid = []
+        for ip in ips:
+            try:
+                valid.append((ip_int(ip), ip))
+            except ValueError:
+                found[ip] = 0
+        lo = 0
+        for n, ip in sorted(valid):
+            found[ip], lo = self.networks.find(n, lo)
+        return found
+
+    def to_json(self):
+        return {'config_id': self.config_id, 'listed': self.listed,
+                'blocks': self.blocks.cidrs, 'networks': self.networks.cidrs}
+
+
+'''
+
+Filling the index from the BAM
+
+'''
+
+
+def build():
+    """List every block and network below config.ConfigId"""
+    listed = time.time()
+    found = {'IP4Block': {}, 'IP4Network': {}}
+    todo = [config.ConfigId]
+    while todo:
+        parent_id = todo.pop()
+        for typ in ('IP4Block', 'IP4Network') if parent_id != config.ConfigId else ('IP4Block',):
+            for ent in api.iter_entities(parent_id, typ):
+                cidr = cidr_of(ent)
+                if cidr is None:
+                    continue
+                found[typ][cidr] = ent['id']
+                if typ == 'IP4Block':
+                    todo.append(ent['id'])
+    return NetIndex(config.ConfigId, found['IP4Block'], found['IP4Network'], listed)
+
+
+def load():
+    path = config.NetIndexFile
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if data.get('config_id') != config.ConfigId:
+        return None
+    return NetIndex(data['config_id'], data.get('blocks'), data.get('networks'), data.get('listed', 0))
+
+
+def save(index):
+    path = config.NetIndexFile
+    if not path:
+        return
+    util.write_json_atomic(path, index.to_json(), '.networks.')
+
+
+def get_index():
+    """Return the network index of config.ConfigId, loading or building it as needed
+
+    Returns None when the index is disabled
+    """
+    if not config.NetIndex:
+        return None
+    index = config.NetTree
+    if index is not None and index.config_id == config.ConfigId \
+            and index.listed >= time.time() - config.NetIndexTTL:
+        return index
+    index = load()
+    if index is None or index.listed < time.time() - config.NetIndexTTL:
+        index = build()
+        save(index)
+    config.NetTree = index
+    return index
+
+
+def networks_of(ips):
+    """{ip: id of the IP4Network holding it or 0} for the addresses
+
+    Only the addresses the index has no network for are asked about,
+    one getIPRangedByIP call each; the networks found are added to it
+    """
+    ips = list(ips)
+    index = get_index()
+    found = index.find_all(ips) if index is not None else {ip: 0 for ip in ips}
+    added = False
+    for ip, net_id in found.items():
+        if net_id:
+            continue
+        ent = api.get_ipranged_by_ip(ip)
+        if type(ent) is str or not ent.get('id'):
+            continue
+        found[ip] = ent['id']
+        cidr = cidr_of(ent)
+        if index is not None and cidr is not None:
+            index.add('IP4Network', cidr, ent['id'])
+            added = True
+    if added:
+        save(index)
+    return found
+
+
+'''
+
+Hooks called from bluecat_am.api, they only touch an index already in memory
+
+'''
+
+
+def note_added(typ, cidr, obj_id):
+    index = config.NetTree
+    if index is not None and isinstance(obj_id, int) and obj_id > 0:
+        index.add(typ, cidr, obj_id)
+        save(index)
+
+
+def note_deleted(obj_id):
+    index = config.NetTree
+    if index is not None and index.remove_id(obj_id):
+        save(index)
@@ -0,0 +1,419 @@
+"""
+
+Diff a desired set of records against the BAM and carry out the difference
+
+Desired records come in the shape util.add_rr takes,
+(fqdn, rr_type, value, ttl), e.g. from zonefile.parse(). The current
+records of a zone are read with one paginated listing per RR type
+(util.list_by_type), so working out what to do costs no per-record calls:
+
+    current = plan.read_zones({'zip.bigcorp.ca': 2217650})
+    ops = plan.diff(plan.desired_state(records), current)
+    plan.show(ops)
+    plan.execute(ops)
+
+Each operation is a dict like the ones batch.parse_line makes,
+{'op', 'fqdn', 'type', 'value', 'ttl'}, plus the BAM 'entity' it
+changes (update, delete) and whether the name is a zone 'apex' (add).
+Every operation is exactly one API call:
+
+    * A: all the addresses of a name live in one HostRecord, so a
+      changed address list or ttl is one update of that record
+    * CNAME, MX, TXT: one record per value; values that are already
+      there (same ttl) are left alone, a changed value reuses a record
+      that is no longer wanted (update) before adding or deleting any
+
+Records of the managed types that are in the BAM but not desired are
+deleted unless prune is False. Without pruning nothing is taken away:
+a HostRecord keeps the addresses it has and gains the missing ones, and
+records of values no longer wanted are not reused. Only A, CNAME, MX and
+TXT are looked at.
+
+The desired records may also come from a YAML or JSON file describing
+several zones, see load_state() below.
+
+"""
+
+import json
+import logging
+import sys
+
+from bluecat_am import api, config, util
+
+Logger = logging.getLogger(__name__)
+
+Managed = ('A', 'CNAME', 'MX', 'TXT')
+Order = ('delete', 'update', 'add')
+Signs = {'add': '+', 'update': '~', 'delete': '-'}
+DefaultTTL = '86400'
+
+
+def norm_name(name):
+    return name.rstrip('.').lower()
+
+
+def norm_value(rr_type, value):
+    """Compare CNAME and MX targets case and trailing dot insensitively"""
+    if rr_type == 'CNAME':
+        return norm_name(value)
+    if rr_type == 'MX':
+        host, pri = util.mx_parse(value)
+        return '{}:{}'.format(norm_name(host), pri)
+    return value
+
+
+def desired_state(records):
+    """Group (fqdn, rr_type, value, ttl) records into {(fqdn, rr_type): {value: ttl}}
+
+    The addresses of one name share a HostRecord, and so the ttl of the first one
+    """
+    state = {}
+    for fqdn, rr_type, value, ttl in records:
+        if rr_type not in Managed:
+            continue
+        values = state.setdefault((norm_name(fqdn), rr_type), {})
+        if rr_type == 'A' and values:
+            ttl = next(iter(values.values()))
+        values.setdefault(norm_value(rr_type, value), str(ttl))
+    return state
+
+
+'''
+
+Reading what is in the BAM
+
+'''
+
+
+def entity_values(ent):
+    """Return (fqdn, rr_type, [values], ttl) of a HostRecord, AliasRecord, MXRecord or TXTRecord"""
+    d = util.props2dict(ent['properties'] or '')
+    rr_type = config.BAM2Bind[ent['type']]
+    value = d.get(config.RRTypeMap[rr_type]['prop_key'], '')
+    if rr_type == 'A':
+        values = value.split(',') if value else []
+    elif rr_type == 'MX':
+        values = ['{}:{}'.format(norm_name(value), d.get('priority', '10'))]
+    else:
+        values = [norm_value(rr_type, value)]
+    return norm_name(d.get('absoluteName', ent['name'])), rr_type, values, d.get('ttl', DefaultTTL)
+
+
+def read_zone(zone_id):
+    """The managed records directly in a zone as {(fqdn, rr_type): [(entity, values, ttl)]}"""
+    state = {}
+    obj_types = [config.RRTypeMap[rr_type]['obj_type'] for rr_type in Managed]
+    for ents in util.list_by_type(zone_id, obj_types):
+        for ent in util.fetch_entities(ents):
+            fqdn, rr_type, values, ttl = entity_values(ent)
+            state.setdefault((fqdn, rr_type), []).append((ent, values, ttl))
+    return state
+
+
+def read_zones(zones):
+    """Read every zone of {zone_fqdn: zone_id}, the zones concurrently"""
+    current = {}
+    for state in util.fan_out(read_zone, list(zones.values())):
+        for key, have in state.items():
+            current.setdefault(key, []).extend(have)
+    return current
+
+
+def owning_zones(fqdns, zone_fqdn, zone_id):
+    """Return {zone_fqdn: zone_id} of zone_fqdn and the zones below it owning any of fqdns
+
+    Without a zone index every name is taken to be in zone_fqdn
+    """
+    zones = {zone_fqdn: zone_id}
+    for fqdn in fqdns:
+        located = util.zone_of(fqdn)
+        if located and (located[1] == zone_fqdn or located[1].endswith('.' + zone_fqdn)):
+            zones[located[1]] = located[0]
+    return zones
+
+
+'''
+
+Working out the difference
+
+'''
+
+
+def make_op(op, fqdn, rr_type, value=None, ttl=None, entity=None, apex=False):
+    return {'op': op, 'fqdn': fqdn, 'type': rr_type, 'value': value, 'ttl': ttl,
+            'entity': entity, 'apex': apex}
+
+
+def diff(desired, current, zones=(), prune=True):
+    """Return the operations that turn current into desired, deletes first, then updates, then adds
+
+    zones holds the absolute names of the zones, adding at the top of one needs a leading dot
+    """
+    ops = []
+    for key in sorted(set(desired) | set(current)):
+        fqdn, rr_type = key
+        want = desired.get(key)
+        have = current.get(key, [])
+        apex = fqdn in zones
+        if want is None:
+            if prune:
+                ops += [make_op('delete', fqdn, rr_type, ','.join(values), ttl, ent)
+                        for ent, values, ttl in have]
+            continue
+
+        if rr_type == 'A':
+            ips = list(want)
+            ttl = want[ips[0]]
+            if not have:
+                ops.append(make_op('add', fqdn, rr_type, ','.join(ips), ttl, apex=apex))
+            else:
+                ent, values, cur_ttl = have[0]
+                if not prune:
+                    # keep the addresses that are there, only add the missing ones
+                    ips = values + [ip for ip in ips if ip not in values]
+                if set(values) != set(ips) or cur_ttl != ttl:
+                    ops.append(make_op('update', fqdn, rr_type, ','.join(ips), ttl, ent))
+                if prune:
+                    ops += [make_op('delete', fqdn, rr_type, ','.join(values), ttl, ent)
+                            for ent, values, ttl in have[1:]]
+            continue
+
+        spare = []
+        missing = dict(want)
+        for ent, values, cur_ttl in have:
+            value = values[0]
+            if value in missing:
+                ttl = missing.pop(value)
+                if cur_ttl != ttl:
+                    ops.append(make_op('update', fqdn, rr_type, value, ttl, ent))
+            else:
+                spare.append((ent, value, cur_ttl))
+        for value, ttl in missing.items():
+            # reusing a spare record would drop its value
+            if spare and prune:
+                ent, old, cur_ttl = spare.pop(0)
+                ops.append(make_op('update', fqdn, rr_type, value, ttl, ent))
+            else:
+                ops.append(make_op('add', fqdn, rr_type, value, ttl, apex=apex))
+        if prune:
+            ops += [make_op('delete', fqdn, rr_type, value, ttl, ent) for ent, value, ttl in spare]
+    return sorted(ops, key=lambda op: Order.index(op['op']))
+
+
+def count(ops):
+    """{'add': n, 'update': n, 'delete': n}"""
+    totals = dict.fromkeys(Order, 0)
+    for op in ops:
+        totals[op['op']] += 1
+    return totals
+
+
+def show(ops, out=None):
+    out = out or sys.stdout
+    for op in ops:
+        value = op['value'] or ''
+        if op['type'] == 'TXT':
+            value = '"' + value + '"'
+        print('{} {} {} {} {}'.format(Signs[op['op']], op['fqdn'], op['ttl'], op['type'], value), file=out)
+
+
+'''
+
+Carrying it out
+
+'''
+
+
+def run_one(op):
+    """Make the one API call of an operation, return True if the BAM took it"""
+    rr_type = op['type']
+    if op['op'] == 'delete':
+        return api.delete(op['entity']['id']).status_code == 200
+    if op['op'] == 'update':
+        ent = dict(op['entity'])
+        d = util.props2dict(ent['properties'] or '')
+        d['ttl'] = op['ttl']
+        if rr_type == 'MX':
+            d['linkedRecordName'], d['priority'] = util.mx_parse(op['value'])
+        else:
+            d[config.RRTypeMap[rr_type]['prop_key']] = op['value']
+        ent['properties'] = util.dict2props(d)
+        return api.update(ent).status_code == 200
+    fqdn = '.' + op['fqdn'] if op['apex'] else op['fqdn']
+    if rr_type == 'A':
+        new_id = api.add_host_record(fqdn, op['value'], op['ttl'])
+    elif rr_type == 'CNAME':
+        new_id = api.add_alias_record(fqdn, op['value'], op['ttl'])
+    elif rr_type == 'MX':
+        mx_host, priority = util.mx_parse(op['value'])
+        new_id = api.add_mx_record(fqdn, priority, mx_host, op['ttl'])
+    else:
+        new_id = api.add_txt_record(fqdn, op['value'], op['ttl'])
+    return type(new_id) is int and new_id > 0
+
+
+def execute(ops):
+    """Carry out the operations, each kind (delete, update, add) in turn and
+    the operations of one kind concurrently. Returns the list of failed operations
+    """
+    fn = 'execute'
+    failed = []
+    for kind in Order:
+        todo = [op for op in ops if op['op'] == kind]
+        for op, ok in zip(todo, util.fan_out(safe_run, todo)):
+            if not ok:
+                failed.append(op)
+        if config.Debug and todo:
+            Logger.debug('{}: {} {}s'.format(fn, len(todo), kind))
+    return failed
+
+
+def safe_run(op):
+    try:
+        return run_one(op)
+    except Exception as err:
+        Logger.debug('{} {} {}: {}'.format(op['op'], op['fqdn'], op['type'], err))
+        return False
+
+
+def in_zone(fqdn, zone_fqdn):
+    return fqdn == zone_fqdn or fqdn.endswith('.' + zone_fqdn)
+
+
+def plan_zone(zone_fqdn, records, prune=True, others=()):
+    """Return the operations that make zone_fqdn hold exactly records, or None if it is not a zone
+
+    Records outside the zone are left out, with a warning. others names
+    zones below zone_fqdn that are planned separately, they are not touched.
+    Only zone_fqdn itself is pruned: of a zone below it that owns some of
+    the names, only the (fqdn, rr_type) of the records are looked at
+    """
+    found = find_zones(zone_fqdn, records, others)
+    if found is None:
+        return None
+    return read_and_diff(found, prune)
+
+
+def find_zones(zone_fqdn, records, others=()):
+    """The first half of plan_zone: the zones to read, before reading them
+
+    Returns (zone_id, desired state, {zone_fqdn: zone_id} to read), or None if it is not a zone
+    """
+    zone_fqdn = norm_name(zone_fqdn)
+    zone_id = util.get_zone_id(zone_fqdn)
+    if not zone_id:
+        return None
+    desired = desired_state(records)
+    for fqdn, rr_type in [key for key in desired if not in_zone(key[0], zone_fqdn)]:
+        print('{} {} is not in zone {}, skipped'.format(fqdn, rr_type, zone_fqdn), file=sys.stderr)
+        del desired[(fqdn, rr_type)]
+    zones = owning_zones(set(fqdn for fqdn, rr_type in desired), zone_fqdn, zone_id)
+    for other in others:
+        if other != zone_fqdn and in_zone(other, zone_fqdn):
+            for name in [name for name in zones if in_zone(name, other)]:
+                del zones[name]
+            for key in [key for key in desired if in_zone(key[0], other)]:
+                del desired[key]
+    return zone_id, desired, zones
+
+
+def read_and_diff(found, prune=True):
+    """The second half of plan_zone: read the zones find_zones found and diff them"""
+    zone_id, desired, zones = found
+    ids = list(zones.values())
+    current = {}
+    for read_id, state in zip(ids, util.fan_out(read_zone, ids)):
+        for key, have in state.items():
+            if read_id == zone_id or key in desired:
+                current.setdefault(key, []).extend(have)
+    return diff(desired, current, zones, prune)
+
+
+'''
+
+Declarative desired state
+
+A YAML or JSON file describing the records a set of zones should hold:
+
+    zones:
+      zip.bigcorp.ca:
+        ttl: 3600               # default ttl of the zone's records (86400)
+        prune: true             # delete records not listed (the default)
+        records:
+          - {name: www, type: A, value: [10.10.0.100, 10.10.0.101]}
+          - {name: '@', type: MX, value: smtp.zip.bigcorp.ca, priority: 10}
+          - {name: rouge, type: CNAME, value: red.zip.bigcorp.ca, ttl: 300}
+          - {fqdn: note.zip.bigcorp.ca, type: TXT, value: Superman and Batman}
+
+name is relative to the zone ('@' or '' for its top), fqdn is absolute.
+CNAME and MX targets are absolute names, as on the bamcli command line.
+
+'''
+
+
+def read_state_file(path):
+    with open(path) as fd:
+        text = fd.read()
+    if path.endswith(('.yaml', '.yml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('reading {} needs PyYAML: pip install BlueCat-Address-Manager[yaml]'.format(path))
+        return yaml.safe_load(text)
+    return json.loads(text)
+
+
+def state_records(zone_fqdn, spec):
+    """Turn the spec of one zone into a list of (fqdn, rr_type, value, ttl)"""
+    records = []
+    zone_ttl = str(spec.get('ttl', DefaultTTL))
+    for rec in spec.get('records') or []:
+        if 'fqdn' in rec:
+            fqdn = norm_name(rec['fqdn'])
+        else:
+            name = str(rec.get('name', '@'))
+            fqdn = zone_fqdn if name in ('@', '') else norm_name(name + '.' + zone_fqdn)
+        rr_type = str(rec['type']).upper()
+        if rr_type not in Managed:
+            raise ValueError('{} {}: only {} records can be managed'.format(fqdn, rr_type, ', '.join(Managed)))
+        values = rec['value'] if isinstance(rec['value'], list) else [rec['value']]
+        for value in values:
+            value = str(value)
+            if rr_type == 'MX' and 'priority' in rec:
+                value = '{}:{}'.format(value, rec['priority'])
+            records.append((fqdn, rr_type, value, str(rec.get('ttl', zone_ttl))))
+    return records
+
+
+def load_state(path):
+    """Return {zone_fqdn: {'records': [(fqdn, rr_type, value, ttl)], 'prune': bool}} read from path"""
+    data = read_state_file(path)
+    if not isinstance(data, dict) or not isinstance(data.get('zones'), dict):
+        raise ValueError('{}: expected a "zones" mapping'.format(path))
+    state = {}
+    for zone_fqdn, spec in data['zones'].items():
+        zone_fqdn = norm_name(zone_fqdn)
+        spec = spec or {}
+        state[zone_fqdn] = {'records': state_records(zone_fqdn, spec), 'prune': bool(spec.get('prune', True))}
+    return state
+
+
+def plan_state(state):
+    """Plan every zone of a loaded state, the zones concurrently
+
+    Returns ({zone_fqdn: operations or None}, number of API calls the reads took).
+    The zones are found first and read after, so the calls counted are
+    only the listings a sync makes again, not finding the zones (the zone
+    index answers those once built) or filling the zone index
+    """
+    names = sorted(state)
+    found = util.fan_out(lambda zone_fqdn: find_zones(zone_fqdn, state[zone_fqdn]['records'], others=state),
+                         names)
+    before = sum(config.RequestCounts.values())
+
+    def one(item):
+        zone_fqdn, zone_found = item
+        return read_and_diff(zone_found, state[zone_fqdn]['prune']) if zone_found is not None else None
+
+    plans = dict(zip(names, util.fan_out(one, list(zip(names, found)))))
+    return plans, sum(config.RequestCounts.values()) - before
@@ -0,0 +1,242 @@
+"""
+
+Profiling the calls made to the BAM
+
+While config.Profiler holds a Profiler, api.send records every request
+it sends: the endpoint, parameters, HTTP status, bytes sent and received,
+when it started and how long it took, the thread, and the bluecat_am
+functions that led to it (cli.view > util.view_rr > util.bind_print >
+util.fetch_entities > api.get_entity_by_id, say). Work handed to a thread
+pool with config.carry() keeps the functions of the thread that handed
+it over.
+
+    config.Profiler = Profiler()
+    util.view_rr('zip.bigcorp.ca')
+    config.Profiler.stop()
+    for line in config.Profiler.summary():
+        print(line)
+    config.Profiler.write_trace('view.json')
+
+summary() gives the calls, time and bytes per endpoint and per calling
+function, the p50/p95/max latencies, and how the wall time splits between
+waiting on the BAM (at least one request outstanding) and running Python.
+
+write_trace() writes a Chrome trace (chrome://tracing, or
+https://ui.perfetto.dev) with one lane per thread. Each request is a
+slice under slices for the functions that made it; a function's slice
+runs from the start of its first request to the end of its last one.
+
+bamcli --profile and --profile-trace FILE do this around one command.
+
+"""
+
+import collections
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+from bluecat_am import config
+
+# frames that are plumbing rather than callers
+Plumbing = {
+    'bluecat_am.api': ('bam_request', 'fetch', 'send'),
+    'bluecat_am.config': None,
+    'bluecat_am.profiler': None,
+    'bluecat_am.singleflight': None,
+}
+
+ApiCall = collections.namedtuple(
+    'ApiCall', 'start seconds method endpoint params status sent received thread frames')
+
+
+def percentile(values, q):
+    """The q quantile (0 <= q <= 1) of the sorted values, by nearest rank"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def covered(intervals):
+    """Total length of the union of (start, end) intervals"""
+    total = 0.0
+    end = None
+    for start, stop in sorted(intervals):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+
+def redact(params):
+    """params without the secrets (the password of login), to be kept and written out"""
+    if isinstance(params, dict):
+        return {k: config.Redacted if k in config.Secrets else v for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [(k, config.Redacted if k in config.Secrets else v) for k, v in params]
+    return params
+
+
+def size(n):
+    for unit in ('B', 'kB', 'MB'):
+        if n < 1000:
+            return '{:.0f} {}'.format(n, unit) if unit == 'B' else '{:.1f} {}'.format(n, unit)
+        n /= 1000
+    return '{:.1f} GB'.format(n)
+
+
+class Profiler:
+    """Collects an ApiCall for each request sent while it is config.Profiler"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.origin = threading.local()
+        self.started = time.perf_counter()
+        self.ended = None
+
+    def frames(self):
+        """(frame id, 'module.function') of the bluecat_am callers, outermost first"""
+        frames = []
+        frame = sys._getframe(1)
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module.startswith('bluecat_am.'):
+                code = frame.f_code
+                hidden = Plumbing.get(module, ())
+                if hidden is not None and code.co_name not in hidden:
+                    name = getattr(code, 'co_qualname', code.co_name).replace('.<locals>', '')
+                    frames.append((id(frame), module[len('bluecat_am.'):] + '.' + name))
+            frame = frame.f_back
+        frames.reverse()
+        return getattr(self.origin, 'frames', ()) + tuple(frames)
+
+    def carry(self, func):
+        """Return func wrapped to count the caller's functions as its own"""
+        frames = self.frames()
+
+        def run(*args, **kwargs):
+            saved = getattr(self.origin, 'frames', ())
+            self.origin.frames = frames
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.origin.frames = saved
+        return run
+
+    def record(self, method, url, kwargs, req, start):
+        """Note a request made by api.send, req is None if it raised"""
+        seconds = time.perf_counter() - start
+        status = sent = received = None
+        if req is not None:
+            status = req.status_code
+            sent = len(req.request.body or b'')
+            received = len(req.content)
+        call = ApiCall(start, seconds, method, url.rsplit('/', 1)[-1], redact(kwargs.get('params')),
+                       status, sent or 0, received or 0, threading.current_thread().name, self.frames())
+        with self.lock:
+            self.calls.append(call)
+
+    def stop(self):
+        self.ended = time.perf_counter()
+
+    '''
+
+    Reports
+
+    '''
+
+    def summary(self):
+        """Lines describing the calls made"""
+        with self.lock:
+            calls = list(self.calls)
+        wall = (self.ended or time.perf_counter()) - self.started
+        if not calls:
+            return ['API calls: none in {:.2f}s'.format(wall)]
+
+        fmt = '{:<32} {:>6} {:>9} {:>8} {:>8} {:>8} {:>10}'
+        lines = [fmt.format('endpoint', 'calls', 'total', 'p50', 'p95', 'max', 'received')]
+
+        def row(name, group):
+            times = sorted(c.seconds for c in group)
+            return fmt.format(
+                name, len(group), '{:.3f}s'.format(sum(times)),
+                '{:.0f}ms'.format(percentile(times, 0.5) * 1000),
+                '{:.0f}ms'.format(percentile(times, 0.95) * 1000),
+                '{:.0f}ms'.format(times[-1] * 1000),
+                size(sum(c.received for c in group)))
+
+        by_endpoint = collections.defaultdict(list)
+        for call in calls:
+            by_endpoint['{} {}'.format(call.method, call.endpoint)].append(call)
+        for name, group in sorted(by_endpoint.items(), key=lambda item: -sum(c.seconds for c in item[1])):
+            lines.append(row(name, group))
+        lines.append(row('total', calls))
+
+        by_caller = collections.defaultdict(list)
+        for call in calls:
+            callers = [name for fid, name in call.frames if not name.startswith('api.')]
+            by_caller[callers[-1] if callers else '?'].append(call)
+        lines.append('')
+        lines.append(fmt.format('called from', 'calls', 'total', 'p50', 'p95', 'max', 'received'))
+        for name, group in sorted(by_caller.items(), key=lambda item: -sum(c.seconds for c in item[1]))[:10]:
+            lines.append(row(name, group))
+
+        network = covered((c.start, c.start + c.seconds) for c in calls)
+        lines.append('')
+        lines.append('wall time {:.2f}s: waiting on the BAM {:.2f}s ({:.0%}), in Python {:.2f}s ({:.0%})'.format(
+            wall, network, network / wall if wall else 0, wall - network, (wall - network) / wall if wall else 0))
+        lines.append('bytes: {} sent, {} received'.format(
+            size(sum(c.sent for c in calls)), size(sum(c.received for c in calls))))
+        return lines
+
+    def chrome_trace(self):
+        """The calls in the Chrome trace event format"""
+        with self.lock:
+            calls = sorted(self.calls, key=lambda c: c.start)
+        pid = os.getpid()
+
+        def usec(t):
+            return round((t - self.started) * 1e6, 1)
+
+        events = []
+        lanes = collections.defaultdict(list)
+        for call in calls:
+            lanes[call.thread].append(call)
+        for tid, (thread, lane) in enumerate(sorted(lanes.items()), 1):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': thread}})
+            # a slice per run of calls made under the same function call
+            open_spans = []
+            for call in lane:
+                end = call.start + call.seconds
+                depth = 0
+                while (depth < len(open_spans) and depth < len(call.frames)
+                       and open_spans[depth][0] == call.frames[depth]):
+                    open_spans[depth][2] = max(open_spans[depth][2], end)
+                    depth += 1
+                for frame, start, stop in open_spans[depth:]:
+                    events.append({'name': frame[1], 'cat': 'function', 'ph': 'X', 'pid': pid, 'tid': tid,
+                                   'ts': usec(start), 'dur': usec(stop) - usec(start)})
+                del open_spans[depth:]
+                for frame in call.frames[depth:]:
+                    open_spans.append([frame, call.start, end])
+                events.append({
+                    'name': '{} {}'.format(call.method, call.endpoint), 'cat': 'api', 'ph': 'X',
+                    'pid': pid, 'tid': tid, 'ts': usec(call.start), 'dur': round(call.seconds * 1e6, 1),
+                    'args': {'params': call.params, 'status': call.status,
+                             'sent': call.sent, 'received': call.received},
+                })
+            for frame, start, stop in open_spans:
+                events.append({'name': frame[1], 'cat': 'function', 'ph': 'X', 'pid': pid, 'tid': tid,
+                               'ts': usec(start), 'dur': usec(stop) - usec(start)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f, default=str)
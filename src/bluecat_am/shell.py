@@ -0,0 +1,187 @@
+"""
+
+Interactive bamcli shell
+
+Each bamcli invocation starts Python, logs in and resolves every label
+from scratch. The shell logs in once and then reads bamcli commands,
+without the 'bamcli', until EOF or :quit:
+
+    bamcli> view zip.bigcorp.ca
+    bamcli> add www.zip.bigcorp.ca A 10.10.0.100,10.10.0.101
+    bamcli> :stats
+
+The pooled Session, the resolve cache (entries expire after
+config.ResolveCacheTTL seconds) and the zone index stay in memory
+between commands; zones older than config.ZoneIndexTTL are listed again
+before the next command. Commands are completed with TAB (command names,
+RR types and zone names) and the history is kept in config.HistoryFile
+when the readline module is available.
+
+Lines starting with ':' are shell commands:
+
+    :stats   cache hit rates and the API calls made so far
+    :flush   empty the resolve and entity caches
+    :help    list the commands
+    :quit    leave the shell (so does EOF)
+
+"""
+
+import os
+import shlex
+import sys
+
+from bluecat_am import api, cache, config, zoneindex
+
+try:
+    import readline
+except ImportError:
+    readline = None
+
+Prompt = 'bamcli> '
+RRTypes = ('A', 'CNAME', 'MX', 'TXT')
+ShellCommands = (':stats', ':flush', ':help', ':quit')
+
+
+def stats():
+    """Lines describing the caches and the API calls made in this process"""
+    lines = ['resolve cache: {size} entries, {hits} hits, {misses} misses, '
+             'hit rate {hit_rate:.0%}'.format(**cache.resolve().stats()),
+             'entity cache: {size} entries, {hits} hits, {misses} misses, '
+             'hit rate {hit_rate:.0%}'.format(**cache.entities().stats())]
+    if config.ZoneTree is not None:
+        lines.append('zone index: {} zones'.format(len(config.ZoneTree)))
+    if config.NetTree is not None:
+        lines.append('network index: {} networks'.format(len(config.NetTree)))
+    counts = dict(config.RequestCounts)
+    by_method = ', '.join('{} {}'.format(m, n) for m, n in sorted(counts.items())) or 'none'
+    lines.append('API calls: {} ({})'.format(sum(counts.values()), by_method))
+    lines.append('coalesced GETs: {saved} calls saved'.format(**api.Flights.stats()))
+    return lines
+
+
+class Completer:
+    """readline completer for command names, RR types and zone names"""
+
+    def __init__(self, commands):
+        self.commands = sorted(commands) + list(ShellCommands)
+        self.matches = []
+
+    def candidates(self, words):
+        if len(words) <= 1:
+            return self.commands
+        if len(words) == 3:
+            return RRTypes
+        if config.ZoneTree is not None:
+            return sorted(config.ZoneTree.zones)
+        return []
+
+    def complete(self, text, state):
+        if state == 0:
+            line = readline.get_line_buffer()[:readline.get_endidx()]
+            words = line.split()
+            if not line or line[-1].isspace():
+                words.append('')
+            self.matches = [c for c in self.candidates(words) if c.startswith(text)]
+            # zone names complete after the label being typed, e.g. www.<TAB>
+            if not self.matches and len(words) == 2 and '.' in text and config.ZoneTree is not None:
+                head, _, tail = text.partition('.')
+                self.matches = [head + '.' + z for z in sorted(config.ZoneTree.zones) if z.startswith(tail)]
+        return self.matches[state] if state < len(self.matches) else None
+
+
+def setup_readline(commands):
+    if readline is None:
+        return
+    readline.set_completer(Completer(commands).complete)
+    readline.set_completer_delims(' \t')
+    readline.parse_and_bind('tab: complete')
+    readline.set_history_length(config.HistoryLength)
+    try:
+        readline.read_history_file(config.HistoryFile)
+    except OSError:
+        pass
+
+
+def save_history():
+    if readline is None or not config.HistoryFile:
+        return
+    try:
+        os.makedirs(os.path.dirname(config.HistoryFile) or '.', mode=0o700, exist_ok=True)
+        readline.write_history_file(config.HistoryFile)
+    except OSError:
+        pass
+
+
+def refresh_zones():
+    """List again the zones of a loaded zone index that have gone stale"""
+    index = config.ZoneTree
+    if index is not None and zoneindex.refresh(index):
+        zoneindex.save(index)
+
+
+def shell_command(line, commands):
+    """Run a ':' command, return False to leave the shell"""
+    word = line.split()[0]
+    if word in (':quit', ':q', ':exit'):
+        return False
+    if word == ':stats':
+        for text in stats():
+            print(text)
+    elif word == ':flush':
+        cache.resolve().clear()
+        cache.entities().clear()
+        print('resolve and entity caches emptied')
+    elif word == ':help':
+        print('commands: ' + ' '.join(sorted(commands)))
+        print('shell:    ' + ' '.join(ShellCommands))
+    else:
+        print('unknown shell command {}, try :help'.format(word))
+    return True
+
+
+def repl(commands, dispatch, stdin=None):
+    """Read commands until EOF or :quit, running each with dispatch(words)
+
+    commands holds the names of the bamcli commands, for :help and completion
+    """
+    stdin = stdin or sys.stdin
+    interactive = stdin is sys.stdin and stdin.isatty()
+    if interactive:
+        setup_readline(commands)
+    try:
+        while True:
+            try:
+                if interactive:
+                    line = input(Prompt)
+                else:
+                    line = stdin.readline()
+                    if not line:
+                        break
+            except EOFError:
+                print()
+                break
+            except KeyboardInterrupt:
+                print()
+                continue
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith(':'):
+                if not shell_command(line, commands):
+                    break
+                continue
+            if line in ('quit', 'exit'):
+                break
+            try:
+                words = shlex.split(line)
+            except ValueError as err:
+                print('cannot parse: {}'.format(err))
+                continue
+            refresh_zones()
+            try:
+                dispatch(words)
+            except KeyboardInterrupt:
+                print('interrupted')
+    finally:
+        if interactive:
+            save_history()
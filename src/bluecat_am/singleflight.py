@@ -0,0 +1,66 @@
+"""
+
+Coalescing of identical concurrent calls
+
+When several threads ask for the same thing at the same time only the
+first one (the leader) does the work, the others wait for it and get the
+same result, or the same exception:
+
+    flights = Group()
+    ent = flights.do(('getEntityById', 2217650), fetch, 2217650)
+
+Nothing is kept once a call is over, so this is not a cache: a later
+call with the same key does the work again.
+
+"""
+
+import threading
+
+
+class Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """Coalesce calls of func by key while one is in flight"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.led = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Return func(*args, **kwargs), sharing the answer of an identical call in flight"""
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = Call()
+                self.led += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if leader:
+            try:
+                call.result = func(*args, **kwargs)
+            except BaseException as err:
+                call.error = err
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """Calls made, and calls saved by sharing the answer of one in flight"""
+        with self.lock:
+            return {'calls': self.led, 'saved': self.shared, 'in_flight': len(self.calls)}
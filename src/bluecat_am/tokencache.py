@@ -0,0 +1,93 @@
+"""
+
+On disk cache of BAM session state
+
+bam_init() needs four round trips before any real work can be done:
+probe the URL, login, and look up the Configuration and View IDs.
+The BAMAuthToken and the resolved ConfigId/ViewId are saved here so that
+the next bamcli invocation can reuse them until they expire.
+
+The file holds one entry per (url, user, configuration, view) e.g.
+
+{
+    "fred@https://bam.bigcorp.ca/Services/REST/v1/#Test/Public": {
+        "token": "7NfY4MTU1NDM5MDU1MzkzMzppc2VhLWFwaQ==",
+        "config_id": 2203564,
+        "view_id": 2203565,
+        "expires": 1554390553.9
+    }
+}
+
+Passwords are never written. The directory is created mode 0700 and
+the file mode 0600, an existing file with looser permissions is ignored.
+
+"""
+
+import json
+import os
+import stat
+import time
+
+from bluecat_am import config, util
+
+
+def cache_key(url, user):
+    return '{}@{}#{}/{}'.format(user, url, config.ConfigName, config.ViewName)
+
+
+def read_cache():
+    path = config.TokenCacheFile
+    if not path:
+        return {}
+    try:
+        st = os.stat(path)
+    except OSError:
+        return {}
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        if config.Debug:
+            config.Logger.debug('read_cache: ignoring {}, permissions are too open'.format(path))
+        return {}
+    try:
+        with open(path) as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_cache(cache):
+    path = config.TokenCacheFile
+    if not path:
+        return
+    util.write_json_atomic(path, cache, '.session.')
+
+
+#
+# returns the cached session entry for url and user,
+# or None if there is none or it has expired
+#
+
+
+def load(url, user):
+    ent = read_cache().get(cache_key(url, user))
+    if ent is None or ent.get('expires', 0) <= time.time():
+        return None
+    return ent
+
+
+def save(url, user, token):
+    cache = read_cache()
+    now = time.time()
+    cache = {k: v for k, v in cache.items() if v.get('expires', 0) > now}
+    cache[cache_key(url, user)] = {
+        'token': token,
+        'config_id': config.ConfigId,
+        'view_id': config.ViewId,
+        'expires': now + config.TokenLifetime,
+    }
+    write_cache(cache)
+
+
+def forget(url, user):
+    cache = read_cache()
+    if cache.pop(cache_key(url, user), None) is not None:
+        write_cache(cache)
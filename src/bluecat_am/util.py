@@ -1,14 +1,21 @@
 
+import json
+import os
 import sys
 import logging
-import requests
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
 
 from bluecat_am import config
 from bluecat_am import api
+from bluecat_am import cache
+from bluecat_am import zoneindex
+from bluecat_am import netindex
+from bluecat_am import tokencache
 
 Logger = logging.getLogger(__name__)
 Logger.setLevel(logging.DEBUG)
-logging.basicConfig(level=logging.INFO)
 config.Logger = Logger
 
 
@@ -101,29 +108,32 @@ def show_rights(uname):
     zones = []
     gebn_ent = api.get_entity_by_name(config.RootId, uname, 'User')
     user_id = gebn_ent['id']
-    user_rights = api.get_access_rights_for_user(user_id, 0, 15)
+    user_rights = api.iter_access_rights_for_user(user_id)
     if config.Debug:
         Logger.debug('Get Ent By Name for {}: {}'.format(uname, gebn_ent))
         Logger.debug('User name: {} User Id: {}'.format(uname, user_id))
+    ent_ids = {}
     for right in user_rights:
         if config.Debug:
             Logger.debug('Right: {}'.format(right))
-        ent_id = right['entityId']
-        par_ent = api.get_parent(ent_id)
-        par_id = par_ent['id']
+        ent_ids[right['entityId']] = True
+    # many rights share a parent, so each parent's children are listed once
+    listings = {}
+    for par_ent in fan_out(api.get_parent, ent_ids):
         for typ in ['IP4Network', 'Zone']:
-            ents = api.get_entities(par_id, typ, 0, 10)
-            for e in ents:
-                pairs = e['properties'].split('|')
-                pairs.remove('')
-                for pair in pairs:
-                    (name, val) = pair.split('=')
-                    if name == 'CIDR':
-                        if val not in networks:
-                            networks.append(val)
-                    elif name == 'absoluteName':
-                        if val not in zones:
-                            zones.append(val)
+            listings[(par_ent['id'], typ)] = True
+    for ents in fan_out(lambda listing: list(api.iter_entities(*listing)), listings):
+        for e in ents:
+            pairs = e['properties'].split('|')
+            pairs.remove('')
+            for pair in pairs:
+                (name, val) = pair.split('=')
+                if name == 'CIDR':
+                    if val not in networks:
+                        networks.append(val)
+                elif name == 'absoluteName':
+                    if val not in zones:
+                        zones.append(val)
     print('CIDR blocks:')
     for net in networks:
         print('    {}'.format(net))
@@ -138,26 +148,43 @@ def show_rights(uname):
 '''
 
 
+def set_auth_header(session_token):
+    config.AuthHeader = {
+        'Authorization': 'BAMAuthToken: ' + session_token,
+        'Content-Type': 'application/json'
+    }
+
+
 def bam_init(url, user, pw):
     fn = 'bam_init'
 #   config.ConfigName = 'Production'
 
+    config.Username = user
+    config.Credentials = {'username': user, 'password': pw}
+
+    cached = tokencache.load(url, user)
+    if cached:
+        config.Baseurl = url
+        set_auth_header(cached['token'])
+        config.ConfigId = cached['config_id']
+        config.ViewId = cached['view_id']
+        if config.Debug:
+            Logger.debug('{}: Reusing cached session, Config Id: {} View Id: {}'.format(
+                fn, config.ConfigId, config.ViewId))
+        return
+
     if api.url_ok(url):
         config.Baseurl = url
     else:
         bam_error('Bad URL: {}'.format(url))
 
-    creds = {'username': user, 'password': pw}
-    session_token = api.login(creds)
+    session_token = api.login(config.Credentials)
     if not session_token:
         bam_error('Bad Credentials')
     if config.Debug:
         Logger.debug('{}: Session Token Value: {}'.format(fn, session_token))
-        
-    config.AuthHeader = {
-        'Authorization': 'BAMAuthToken: ' + session_token,
-        'Content-Type': 'application/json'
-    }
+
+    set_auth_header(session_token)
 
     if config.Debug:
         Logger.debug('{}: Authorization Header: {}'.format(fn, config.AuthHeader))
@@ -174,19 +201,92 @@ def bam_init(url, user, pw):
     else:
         bam_error('Error: The parent (Configuration) Id must be set before setting the View Id')
 
+    tokencache.save(url, user, session_token)
+
     if config.Debug:
         print()
         val = api.get_system_info()
         Logger.debug('{}: System Info: {}'.format(fn, val))
         print()
 
+#
+# Called by api.bam_request when the BAM answers 401 to a call made
+# with a (cached) session token: log in again and refresh the cache
+#
+
+
+def bam_relogin():
+    fn = 'bam_relogin'
+    session_token = api.login(config.Credentials)
+    if not session_token:
+        tokencache.forget(config.Baseurl, config.Username)
+        return False
+    if config.Debug:
+        Logger.debug('{}: Session token expired, logged in again'.format(fn))
+    set_auth_header(session_token)
+    tokencache.save(config.Baseurl, config.Username, session_token)
+    return True
+
 
 def bam_logout():
     url = config.Baseurl + 'logout'
-    requests.get(url, headers=config.AuthHeader)
+    api.bam_request('GET', url, headers=config.AuthHeader)
+    tokencache.forget(config.Baseurl, config.Username)
+    api.close_session()
     sys.exit()
 
 
+#
+# getEntityByName through the shared resolution cache. The resolvers below
+# walk every FQDN from the TLD down, and the upper labels are almost always
+# the same ones, so most of these are answered without a round trip.
+# The caller gets its own copy of the entity to decorate (e.g. with 'pid')
+#
+
+
+def lookup_name(pid, name, typ):
+    key = (pid, name, typ)
+    ent = cache.resolve().get(key)
+    if ent is None:
+        ent = api.get_entity_by_name(pid, name, typ)
+        if isinstance(ent, dict) and 'id' in ent:
+            cache.resolve().put(key, dict(ent))
+        return ent
+    return dict(ent)
+
+
+#
+# Split a fqdn into the zone owning it and the name relative to
+# that zone using the local zone index, no round trips needed.
+# Returns (zone_id, zone_fqdn, relative_name) or None when the
+# index is disabled or no zone in the View owns the fqdn.
+# With recheck the labels of the relative name are looked up as
+# zones too, one call each until one is not, in case a zone was made
+# there since the index was listed; the zones found are added to it
+#
+
+
+def zone_of(fqdn, recheck=False):
+    index = zoneindex.get_index()
+    if index is None:
+        return None
+    located = index.find(fqdn)
+    if not recheck or not located or located[2] == '':
+        return located
+    (zone_id, zone_fqdn, name) = located
+    labels = name.split('.')
+    while labels:
+        ent = lookup_name(zone_id, labels[-1], 'Zone')
+        if not ent.get('id'):
+            break
+        zone_id = ent['id']
+        zone_fqdn = labels.pop() + '.' + zone_fqdn
+        index.add(zone_fqdn, zone_id)
+    if zone_id != located[0]:
+        zoneindex.save(index)
+    return zone_id, zone_fqdn, '.'.join(labels)
+
+
 # Deletes all data and RRs in the Zone tree including other Zones
 
 def delete_zone(fqdn):
@@ -209,7 +309,7 @@ def get_info_by_name(fqdn):
     names = fqdn.split('.')
     lg = len(names)
     for name in names[::-1]:
-        ent = api.get_entity_by_name(obj_id, name, 'Entity')
+        ent = lookup_name(obj_id, name, 'Entity')
         if config.Debug:
             Logger.debug('{} name: {} entity: {}'.format(fn, name, ent))
         pid = obj_id
@@ -221,18 +321,17 @@ def get_info_by_name(fqdn):
     else:
         pid = ent['pid']
         name = fqdn.split('.')[0]
-    for obj_type in config.RRObjectTypes:
-        if config.Debug:
+    if config.Debug:
+        # only shown, so only the first page of each type is listed
+        pages = fan_out(lambda obj_type: api.get_entities(pid, obj_type, 0, 50), config.RRObjectTypes)
+        for obj_type, ents in zip(config.RRObjectTypes, pages):
             Logger.debug('{} RR type: {}'.format(fn, obj_type))
-        ents = api.get_entities(pid, obj_type, 0, 50)
-        if config.Debug:
             if type(ents) is str:
                 Logger.debug('{} Type: {} Ent: {}'.format(fn, obj_type, ents))
             else:
                 for e in ents:
                     if e['name'] == name:
                         Logger.debug('{} Type: {} Ent: {}'.format(fn, obj_type, e))
-    if config.Debug:
         print()
     return ent
 
@@ -261,7 +360,7 @@ def view_info_by_name(fqdn, *argv):
     obj_id = config.ViewId
     names = fqdn.split('.')
     for name in names[::-1]:
-        ent = api.get_entity_by_name(obj_id, name, 'Entity')
+        ent = lookup_name(obj_id, name, 'Entity')
         if config.Debug:
             Logger.debug('{} name: {} entity: {}'.format(fn, name, ent))
         pid = obj_id
@@ -276,17 +375,16 @@ def view_info_by_name(fqdn, *argv):
     if config.Debug:
         Logger.debug()
     if ll == 0:
-        ids = []
-        for obj_type in config.RRObjectTypes:
-            ents = api.get_entities(pid, obj_type, 0, 50)
+        by_type = list_by_type(pid, config.RRObjectTypes)
+        rr_ents = []
+        for ents in by_type:
             for e in ents:
                 if e['name'] == name:
-                    ids.append(e['id'])
-        bind_print(ids)
+                    rr_ents.append(e)
+        bind_print(rr_ents)
         if is_zone:
             rrs = {}
-            for obj_type in config.RRObjectTypes:
-                ents = api.get_entities(pid, obj_type, 0, 50)
+            for ents in by_type:
                 if len(ents):
                     for e in ents:
                         name = e['name']
@@ -298,14 +396,13 @@ def view_info_by_name(fqdn, *argv):
                             else:
                                 rrs[name] = [e]
 
-            ids = []
+            rr_ents = []
             for fqdn in sorted(rrs):
-                for e in rrs[fqdn]:
-                    ids.append(e['id'])
-            bind_print(ids)
+                rr_ents += rrs[fqdn]
+            bind_print(rr_ents)
 
     elif ll > 0:
-        ents = api.get_entities(pid, obj_rr_type, 0, 50)
+        ents = api.iter_entities(pid, obj_rr_type)
         ids = []
         for e in ents:
             if e['name'] == name:
@@ -333,9 +430,16 @@ def find_rr(fqdn, *argv):
     """Given a fqdn and an RR type and optionally a value
        return a list of entity IDs which match the given input
     """
+    return [ent['id'] for ent in find_rr_entities(fqdn, *argv)]
+
+
+def find_rr_entities(fqdn, *argv):
+    """Like find_rr but return the matching entities themselves,
+       as they came back from getEntities, properties included
+    """
     name = None
     ent = dict()
-    fn = 'find_rr'
+    fn = 'find_rr_entities'
     rr_type = value = obj_rr_key = None
     trailing_dot = False
     obj_types = config.RRObjectTypes
@@ -354,6 +458,7 @@ def find_rr(fqdn, *argv):
     if fqdn[-1] == '.':
         trailing_dot = True
         fqdn = fqdn[:-1]
+    asked = fqdn + '.' if trailing_dot else fqdn
 
     if config.Debug:
         Logger.debug('{}: rr_type: {}, rr_value: {}, obj_rr_key: {}'.format(fn, rr_type, value, obj_rr_key))
@@ -362,25 +467,35 @@ def find_rr(fqdn, *argv):
     tld = names.pop()
     if tld not in config.LegalTLDs:
         Logger.debug('{}: Top level domain name must be one of: {}'.format(fn, config.LegalTLDs))
-    tld_ent = api.get_entity_by_name(config.ViewId, tld, 'Entity')
-    par_id = tld_ent['id']
-    if config.Debug:
-        Logger.debug('{}: TLD entity: {}'.format(fn, tld_ent))
 
-    for name in names[::-1]:
-        ent = api.get_entity_by_name(par_id, name, 'Entity')
-        ent['pid'] = par_id
-        par_id = ent['id']
+    located = zone_of(fqdn)
+    if located:
+        (zone_id, zone_fqdn, name) = located
+        if name == '':
+            ent = {'id': zone_id, 'type': 'Zone', 'pid': None}
+        else:
+            ent = {'id': 0, 'type': None, 'pid': zone_id}
+        if config.Debug:
+            Logger.debug('{}: zone index: {} in zone {} ({})'.format(fn, name, zone_fqdn, zone_id))
+    else:
+        tld_ent = lookup_name(config.ViewId, tld, 'Entity')
+        par_id = tld_ent['id']
         if config.Debug:
-            Logger.debug('{}: entity: {}'.format(fn, ent))
+            Logger.debug('{}: TLD entity: {}'.format(fn, tld_ent))
+
+        for name in names[::-1]:
+            ent = lookup_name(par_id, name, 'Entity')
+            ent['pid'] = par_id
+            par_id = ent['id']
+            if config.Debug:
+                Logger.debug('{}: entity: {}'.format(fn, ent))
     obj_id = ent['id']
     par_id = ent['pid']
     rr_ents = []
     if ent['type'] == 'Zone':
         par_id = obj_id
         name = ''
-        for obj_type in obj_types:
-            ents = api.get_entities(par_id, obj_type, 0, 100)
+        for obj_type, ents in zip(obj_types, list_by_type(par_id, obj_types)):
             if config.Debug:
                 if len(ents):
                     Logger.debug('{}: RR type: {} Entities:'.format(fn, obj_type))
@@ -394,10 +509,11 @@ def find_rr(fqdn, *argv):
                         if ent['name'] == name:
                             rr_ents.append(ent)
     else:
-        for obj_type in obj_types:
-            ents = api.get_entities_by_name(par_id, name, obj_type, 0, 10)
-            if len(ents):
-                rr_ents += ents
+        for ents in list_by_type(par_id, obj_types, name):
+            rr_ents += ents
+        # nothing under a dotted name, it may be in a zone the index does not know yet
+        if not rr_ents and located and '.' in name and zone_of(fqdn, recheck=True) != located:
+            return find_rr_entities(asked, *argv)
 
     if arglen == 2 and rr_type != 'CNAME':
         found = False
@@ -424,55 +540,108 @@ def find_rr(fqdn, *argv):
         if not found:
             rr_ents = []
 
-    ids = []
-    for rr_ent in rr_ents:
-        if rr_ent['name'] == '':
-            ids.append(rr_ent['id'])
-    for rr_ent in rr_ents:
-        if rr_ent['name'] != '':
-            ids.append(rr_ent['id'])
+    ents = [rr_ent for rr_ent in rr_ents if rr_ent['name'] == '']
+    ents += [rr_ent for rr_ent in rr_ents if rr_ent['name'] != '']
+    cache.remember(ents)
     if config.Debug:
         print()
-    return ids
+    return ents
 
 
 def view_rr(fqdn, *argv):
     fn = 'view_rr'
-    ids = find_rr(fqdn, *argv)
+    ents = find_rr_entities(fqdn, *argv)
 #    if is_zone(fqdn):
 #        obj = get_soa_info(fqdn)
 #        if not config.Silent:
 #            Logger.debug('SOA info: {}'.format(obj))
-    bind_print(ids)
+    bind_print(ents)
+
+#
+# Run func over every item using up to config.MaxWorkers threads
+# and return the results in the same order as the items
+#
+
+
+#
+# Write data as JSON to path through a temporary file of its own in the
+# same directory, so that concurrent runs never write the same file and
+# readers see the old or the new file whole. The directory is made mode
+# 0700, the file is mode 0600 unless asked otherwise
+#
+
+
+def write_json_atomic(path, data, prefix, mode=0o600):
+    os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=prefix)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        if mode != 0o600:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def fan_out(func, items):
+    items = list(items)
+    if len(items) < 2 or config.MaxWorkers < 2:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(config.MaxWorkers, len(items))) as pool:
+        return list(pool.map(config.carry(func), items))
 
 #
-# Print out a list of BAM RR Entity IDs in Bind format
+# List the children of pid of every type in obj_types (optionally only
+# those called name). The listings are independent so they all run at
+# once, the results come back in the order of obj_types
 #
 
 
-def bind_print(ent_ids):
-    if len(ent_ids) == 0:
+def list_by_type(pid, obj_types, name=None):
+    if name is None:
+        return fan_out(lambda obj_type: list(api.iter_entities(pid, obj_type)), obj_types)
+    return fan_out(lambda obj_type: list(api.iter_entities_by_name(pid, name, obj_type)), obj_types)
+
+#
+# Given a list of entities and/or entity IDs return the full entities,
+# in the same order. Only the IDs, and entities without properties,
+# are fetched, concurrently
+#
+
+
+def fetch_entities(ents):
+    ents = list(ents)
+    missing = [i for i, ent in enumerate(ents) if not isinstance(ent, dict) or not ent.get('properties')]
+    if missing:
+        ids = [ents[i]['id'] if isinstance(ents[i], dict) else ents[i] for i in missing]
+        for i, ent in zip(missing, fan_out(api.get_entity_by_id, ids)):
+            ents[i] = ent
+    return ents
+
+#
+# Print out a list of BAM RR Entities in Bind format. The list may hold
+# the entities themselves (e.g. straight from find_rr_entities or
+# getEntities) or their IDs, which are then fetched in one batch
+#
+
+
+def bind_print(ents):
+    if len(ents) == 0:
         print('No RRs to display')
         return
-    str_lens = []
-    for ent_id in ent_ids:
-        ent = api.get_entity_by_id(ent_id)
+    ents = fetch_entities(ents)
+    rows = []
+    for ent in ents:
         d = props2dict(ent['properties'])
-        fqdn = d['absoluteName']
-        str_lens.append(len(fqdn))
-    maxlen = max(str_lens)
+        rows.append((ent, d))
+    maxlen = max(len(d['absoluteName']) for ent, d in rows)
     fmt_str = '{:<' + str(maxlen+4) + '} IN {:>5} {:<6} {}'
     mx_str = fmt_str + ' {}'
-    for ent_id in ent_ids:
-        ent = api.get_entity_by_id(ent_id)
-        d = props2dict(ent['properties'])
+    for ent, d in rows:
         fqdn = d['absoluteName']
-        if 'ttl' in d.keys():
-            ttl = d['ttl']
-        else:
-            ttl = d['ttl'] = '86400'
-            ent['properties'] = dict2props(d)
-            api.update(ent)
+        ttl = d.get('ttl', '86400')
         if ttl == '86400':
             ttl = '     '
         rr_type = config.BAM2Bind[ent['type']]
@@ -490,6 +659,47 @@ def bind_print(ent_ids):
         else:
             print(fmt_str.format(fqdn, ttl, rr_type, value))
 
+#
+# Give every RR directly in a zone that has no ttl property an explicit
+# ttl. Displaying RRs never writes, this is the one place that does.
+# The updates are sent in batches of config.MaxWorkers concurrent PUTs
+# and progress is reported after each batch.
+# Returns the number of RRs updated (or that would be, for a dry run)
+#
+
+
+def normalize_ttl(zone_fqdn, ttl='86400', dry_run=False):
+    fn = 'normalize_ttl'
+    zone_id = get_zone_id(zone_fqdn)
+    if not zone_id:
+        return 0
+    todo = []
+    for ents in list_by_type(zone_id, config.RRObjectTypes):
+        for ent in fetch_entities(ents):
+            d = props2dict(ent['properties'] or '')
+            if 'ttl' not in d:
+                d['ttl'] = str(ttl)
+                ent['properties'] = dict2props(d)
+                todo.append(ent)
+    if config.Debug:
+        Logger.debug('{}: {} RRs in {} have no ttl'.format(fn, len(todo), zone_fqdn))
+    if dry_run:
+        for ent in todo:
+            print('would set ttl={} on {}'.format(ttl, props2dict(ent['properties'])['absoluteName']))
+        return len(todo)
+    done = failed = 0
+    batch = max(1, config.MaxWorkers)
+    for i in range(0, len(todo), batch):
+        for req in fan_out(api.update, todo[i:i + batch]):
+            if req.status_code == 200:
+                done += 1
+            else:
+                failed += 1
+        if not config.Silent:
+            print('{}: updated {}/{} RRs, {} failed'.format(zone_fqdn, done, len(todo), failed),
+                  file=sys.stderr)
+    return done
+
 #
 # A similar function but checking both the rr_type and value
 # returns 0 if object can not be found
@@ -507,21 +717,21 @@ def object_find(fqdn, rr_type, value):
 
     names = fqdn.split('.')
     tld = names.pop()
-    tld_ent = api.get_entity_by_name(config.ViewId, tld, 'Zone')
+    tld_ent = lookup_name(config.ViewId, tld, 'Zone')
     pid = tld_ent['id']
     while len(names):
         name = names.pop()
-        ent = api.get_entity_by_name(pid, name, 'Entity')
+        ent = lookup_name(pid, name, 'Entity')
         obj_id = ent['id']
-        obj_ent = api.get_entity_by_id(obj_id)
         if config.Debug:
             Logger.debug('{} name: {} id: {} ent: {}'.format(fn, name, obj_id, ent))
         if len(names) == 0 and obj_id:
-            obj_type = obj_ent['type']
+            # getEntityByName already gave the type, no need to fetch the entity
+            obj_type = ent['type']
             if obj_type == 'Zone':
                 pid = obj_id
             else:
-                ents = api.get_entities(pid, obj_type, 0, 100)
+                ents = list(api.iter_entities(pid, obj_type))
                 if len(ents):
                     for ent in ents:
                         if 'properties' in ent and ent['properties'] is not None:
@@ -568,6 +778,12 @@ def get_pid_by_name(fqdn):
 
 
 def get_zone_id(fqdn):
+    located = zone_of(fqdn, recheck=True)
+    if located:
+        if located[2] == '':
+            return located[0]
+        print(fqdn, 'is not a zone')
+        return
     info = get_info_by_name(fqdn)
     if info['type'] == 'Zone':
         return info['id']
@@ -592,6 +808,12 @@ def get_soa_info(fqdn):
 
 
 def is_zone(fqdn):
+    located = zone_of(fqdn)
+    if located and '.' in located[2]:
+        # adding a record asks this, so only dotted names are looked up again
+        located = zone_of(fqdn, recheck=True)
+    if located:
+        return located[0] if located[2] == '' else False
     ent = get_info_by_name(fqdn)
     if ent['type'] == 'Zone':
         return ent['id']
@@ -650,7 +872,7 @@ def add_ptr_rr(fqdn, ipaddr, ttl=86400):
 
 def get_external_hosts():
     exhosts = []
-    ents = api.get_entities(config.ViewId, 'ExternalHostRecord', 0, 250)
+    ents = api.iter_entities(config.ViewId, 'ExternalHostRecord')
     for ent in ents:
         exhosts.append(ent['name'])
     return exhosts
@@ -664,7 +886,8 @@ def add_external_host(exhost):
             print(val)
 
 #
-# delete a given generic RR
+# delete a given generic RR. For A records the value may be a list
+# of addresses, they are all taken out of the HostRecord at once
 #
 
 
@@ -677,6 +900,11 @@ def delete_rr(fqdn, rr_type, *argv):
     if config.Debug:
         Logger.debug('{} Input data: {} {} {}'.format(fn, fqdn, rr_type, value))
 
+    if rr_type == 'A':
+        return delete_addresses(fqdn, value if isinstance(value, (list, tuple)) else [value])
+    if isinstance(value, (list, tuple)):
+        return all([delete_rr(fqdn, rr_type, val) for val in value])
+
 # there can only be one CNAME record for a FQDN so the value does not matter
     if rr_type == 'CNAME':
         obj_id = find_rr(fqdn, rr_type)
@@ -687,91 +915,159 @@ def delete_rr(fqdn, rr_type, *argv):
     if obj_id:
         if not config.Silent:
             print('This RR exists and will be deleted')
-        if rr_type == 'A':
-            obj_prop_key = config.RRTypeMap[rr_type]['prop_key']
-            ent = api.get_entity_by_id(obj_id[0])
-            d = props2dict(ent['properties'])
-            ip_list = d[obj_prop_key].split(',')
-            ip_list.remove(value)
-            if ip_list:
-                d[obj_prop_key] = ','.join(ip_list)
-                ent['properties'] = dict2props(d)
-                if config.Debug:
-                    Logger.debug('before:')
-                    bind_print(obj_id)
-                api.update(ent)
-                if config.Debug:
-                    Logger.debug('after:')
-                    bind_print(obj_id)
-            else:
-                api.delete(obj_id[0])
-        else:
-            api.delete(obj_id[0])
+        api.delete(obj_id[0])
+        return True
     else:
         print('No RR exists matching {} {} {}'.format(fqdn, rr_type, value))
+        return False
+
+#
+# Take a list of addresses out of the HostRecord of fqdn with one
+# read and one write (or one delete when no address is left).
+# Returns True if every address was there
+#
+
+
+def delete_addresses(fqdn, ips):
+    fn = 'delete_addresses'
+    obj_prop_key = config.RRTypeMap['A']['prop_key']
+    ents = find_rr_entities(fqdn, 'A')
+    if ents:
+        ent = fetch_entities(ents[:1])[0]
+        d = props2dict(ent['properties'])
+        ip_list = d[obj_prop_key].split(',')
+    else:
+        ip_list = []
+    gone = [ip for ip in ips if ip in ip_list]
+    for ip in ips:
+        if ip not in gone:
+            print('No RR exists matching {} {} {}'.format(fqdn, 'A', ip))
+    if not gone:
+        return False
+    if not config.Silent:
+        print('This RR exists and will be deleted')
+    ip_list = [ip for ip in ip_list if ip not in gone]
+    if config.Debug:
+        Logger.debug('{} {}: removing {}, keeping {}'.format(fn, fqdn, gone, ip_list))
+    if ip_list:
+        d[obj_prop_key] = ','.join(ip_list)
+        ent['properties'] = dict2props(d)
+        api.update(ent)
+        if config.Debug:
+            Logger.debug('after:')
+            bind_print([ent])
+    else:
+        api.delete(ent['id'])
+    return len(gone) == len(ips)
 
 
 #
 # fqdn is at the zone level or is a new RR below a zone
 # new code using find_rr
+# value may be a list of values: A record addresses are merged into
+# the HostRecord in one write, other types get one record per value.
+# Whatever was added is displayed once at the end
 #
 
 def add_rr(fqdn, rr_type, value, ttl):
     fn = 'add_rr'
     if config.Debug:
         Logger.debug('{}, Input data: {} {} {} {}'.format(fn, fqdn, rr_type, value, ttl))
-    obj_prop_key = config.RRTypeMap[rr_type]['prop_key']
-    obj_ids = find_rr(fqdn, rr_type, value)
-    if obj_ids:
-        print('This {} Record already exists'.format(rr_type))
-        if not config.Silent:
-            bind_print(obj_ids)
-        return obj_ids
-    elif rr_type == 'A':
-        obj_ids = find_rr(fqdn, rr_type)
-        if obj_ids:
-            ent = api.get_entity_by_id(obj_ids[0])
-            d = props2dict(ent['properties'])
-            ip_list = d[obj_prop_key]
-            ip_list += ',' + value
-            d[obj_prop_key] = ip_list
-            d['ttl'] = ttl
-            ent['properties'] = dict2props(d)
-            api.update(ent)
-            if not config.Silent:
-                print('Added Host Record:')
+    values = list(value) if isinstance(value, (list, tuple)) else [value]
+    if rr_type == 'A':
+        return add_addresses(fqdn, values, ttl)
+    obj_ids = []
+    existing = []
+    added = []
+    for val in values:
+        ids = find_rr(fqdn, rr_type, val)
+        if ids:
+            print('This {} Record already exists'.format(rr_type))
+            existing += ids
+            obj_ids += ids
+            continue
+        new_id = add_one(fqdn, rr_type, val, ttl)
+        if new_id is None:
+            continue
+        if type(new_id) is not int:
+            print('Cannot add: {} of type {} Error: {}'.format(fqdn, rr_type, new_id))
         else:
-            # adding to the top level of the zone requires a leading dot
-            if is_zone(fqdn):
-                fqdn = '.' + fqdn
-            new_id = api.add_host_record(fqdn, value, ttl)
-            obj_ids = [new_id]
-    elif rr_type == 'TXT':
+            added.append(new_id)
+        obj_ids.append(new_id)
+    if not config.Silent and (existing or added):
+        if added:
+            print('added new {} record:'.format(rr_type))
+        bind_print(existing + added)
+    return obj_ids
+
+#
+# Add one TXT, CNAME or MX record, return the new ID, the error from
+# the BAM, or None if it cannot be added at all
+#
+
+
+def add_one(fqdn, rr_type, value, ttl):
+    if rr_type == 'TXT':
         if is_zone(fqdn):
             fqdn = '.' + fqdn
-        new_id = api.add_txt_record(fqdn, value, ttl)
-        obj_ids = [new_id]
+        return api.add_txt_record(fqdn, value, ttl)
     elif rr_type == 'CNAME':
         if is_zone(fqdn):
             print('Cannot add a CNAME record at the top of a Zone')
-            return obj_ids
-        else:
-            new_id = api.add_alias_record(fqdn, value, ttl)
-            obj_ids = [new_id]
+            return None
+        return api.add_alias_record(fqdn, value, ttl)
     elif rr_type == 'MX':
         (mx_host, priority) = mx_parse(value)
         if is_zone(fqdn):
             fqdn = '.' + fqdn
-        new_id = api.add_mx_record(fqdn, priority, mx_host, ttl)
-        obj_ids = [new_id]
+        return api.add_mx_record(fqdn, priority, mx_host, ttl)
 
-    if type(obj_ids[0]) is not int:
-        print('Cannot add: {} of type {} Error: {}'.format(fqdn, rr_type, obj_ids))
-    else:
+#
+# Add a list of addresses to the HostRecord of fqdn with one read and
+# one write: the addresses not already there are merged into the
+# existing record, or a new record is made holding all of them
+#
+
+
+def add_addresses(fqdn, ips, ttl):
+    fn = 'add_addresses'
+    obj_prop_key = config.RRTypeMap['A']['prop_key']
+    ents = find_rr_entities(fqdn, 'A')
+    if ents:
+        ent = fetch_entities(ents[:1])[0]
+        d = props2dict(ent['properties'])
+        ip_list = d[obj_prop_key].split(',')
+        new_ips = []
+        for ip in ips:
+            if ip not in ip_list and ip not in new_ips:
+                new_ips.append(ip)
+        if config.Debug:
+            Logger.debug('{} {}: has {}, adding {}'.format(fn, fqdn, ip_list, new_ips))
+        if not new_ips:
+            print('This A Record already exists')
+            if not config.Silent:
+                bind_print([ent])
+            return [ent['id']]
+        d[obj_prop_key] = ','.join(ip_list + new_ips)
+        d['ttl'] = ttl
+        ent['properties'] = dict2props(d)
+        req = api.update(ent)
+        if req.status_code != 200:
+            print('Cannot add: {} of type {} Error: {}'.format(fqdn, 'A', req.text))
+            return [req.text]
         if not config.Silent:
-            print('added new {} record:'.format(rr_type))
-            bind_print(obj_ids)
-    return obj_ids
+            print('Added Host Record:')
+            bind_print([ent])
+        return [ent['id']]
+    # adding to the top level of the zone requires a leading dot
+    name = '.' + fqdn if is_zone(fqdn) else fqdn
+    new_id = api.add_host_record(name, ','.join(dict.fromkeys(ips)), ttl)
+    if type(new_id) is not int:
+        print('Cannot add: {} of type {} Error: {}'.format(name, 'A', new_id))
+    elif not config.Silent:
+        print('added new {} record:'.format('A'))
+        bind_print([new_id])
+    return [new_id]
 
 #
 # update a given RR to the state of the values given
@@ -784,7 +1080,7 @@ def update_rr(fqdn, rr_type, value, ttl):
     id_list = find_rr(fqdn, rr_type)
     if not id_list:
         print('Can not find a RR to update with name {} with type {}'.format(fqdn, rr_type))
-        return
+        return False
 # There should only be one RR found with the fqdb and type given and value
 # If there are more than one, update the first one only
     obj_id = id_list[0]
@@ -804,9 +1100,9 @@ def update_rr(fqdn, rr_type, value, ttl):
         org_value = value
         ip_list = value.split(',')
         ip_tup = tuple(ip_list)
+        networks = netindex.networks_of(ip_tup)
         for ip in ip_tup:
-            ip_test_ent = api.get_ipranged_by_ip(ip)
-            if type(ip_test_ent) is str or ip_test_ent['id'] == 0:
+            if not networks[ip]:
                 print('IP address: {} is not in a defined network'.format(ip))
                 ip_list.remove(ip)
         if ip_list:
@@ -814,13 +1110,14 @@ def update_rr(fqdn, rr_type, value, ttl):
             ent['properties'] = dict2props(d)
         else:
             print('None of the IP addresses in {} could be updated'.format(org_value))
-            return
+            return False
     elif rr_type == 'TXT' or rr_type == 'CNAME':
         d[prop_key] = value
         ent['properties'] = dict2props(d)
     if config.Debug:
         Logger.debug('{} ent aft: {}'.format(fn, ent))
-    api.update(ent)
+    req = api.update(ent)
     if not config.Silent:
         print('Updated RR as follows:')
         bind_print([obj_id])
+    return req.status_code == 200
@@ -0,0 +1,172 @@
+"""
+
+Minimal BIND zone file reader
+
+Reads the records bamcli knows about (A, CNAME, MX and TXT) from a zone
+file in master file format and returns them in the shape util.add_rr
+takes:
+
+    (fqdn, rr_type, value, ttl)
+
+    ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600')
+    ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:10', '86400')
+    ('note.zip.bigcorp.ca', 'TXT', 'Superman and Batman', '86400')
+    ('rouge.zip.bigcorp.ca', 'CNAME', 'red.zip.bigcorp.ca', '86400')
+
+Names are lower case and without the trailing dot; relative names and
+targets are qualified with the current $ORIGIN. $ORIGIN, $TTL, '@',
+blank owners, optional TTL and class fields, ( ) continuations and
+; comments are understood. Other record types (SOA, NS, ...) and
+$INCLUDE are skipped and counted, as are records missing a field, which
+are also reported on stderr. The strings of a TXT record are joined, as
+the BAM holds one: quoted ones as they are, unquoted words with a space.
+
+"""
+
+import re
+import sys
+
+Classes = ('IN', 'CH', 'HS')
+Wanted = ('A', 'CNAME', 'MX', 'TXT')
+
+# how many fields follow each type, TXT may have more
+Fields = {'A': 1, 'CNAME': 1, 'MX': 2, 'TXT': 1}
+
+TTL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_ttl(word):
+    """'3600' -> 3600, '1h30m' -> 5400, anything else -> None"""
+    if word.isdigit():
+        return int(word)
+    parts = re.findall(r'(\d+)([smhdwSMHDW])', word)
+    if parts and ''.join(n + u for n, u in parts) == word:
+        return sum(int(n) * TTL_UNITS[u.lower()] for n, u in parts)
+    return None
+
+
+def tokenize(line):
+    """Split a line into words, keeping quoted strings (marked by a leading ")
+    and dropping ; comments"""
+    words = []
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == ';':
+            break
+        if c.isspace():
+            i += 1
+        elif c in '()':
+            words.append(c)
+            i += 1
+        elif c == '"':
+            j = i + 1
+            buf = []
+            while j < len(line) and line[j] != '"':
+                if line[j] == '\\' and j + 1 < len(line):
+                    j += 1
+                buf.append(line[j])
+                j += 1
+            words.append('"' + ''.join(buf))
+            i = j + 1
+        else:
+            j = i
+            while j < len(line) and not line[j].isspace() and line[j] not in ';()"':
+                j += 1
+            words.append(line[i:j])
+            i = j
+    return words
+
+
+def logical_lines(text):
+    """Join ( ) continuations, yield (starts_with_blank_owner, words)"""
+    pending = None
+    depth = 0
+    for raw in text.splitlines():
+        words = tokenize(raw)
+        if pending is None:
+            if not words:
+                continue
+            pending = (raw[:1].isspace(), [])
+        for w in words:
+            if w == '(':
+                depth += 1
+            elif w == ')':
+                depth -= 1
+            else:
+                pending[1].append(w)
+        if depth <= 0:
+            depth = 0
+            if pending[1]:
+                yield pending
+            pending = None
+    if pending and pending[1]:
+        yield pending
+
+
+def qualify(name, origin):
+    if name == '@':
+        return origin
+    if name.endswith('.'):
+        return name[:-1].lower()
+    return (name + '.' + origin).lower() if origin else name.lower()
+
+
+def parse(text, origin='', default_ttl='86400'):
+    """Return (records, skipped) where records is a list of (fqdn, rr_type, value, ttl)"""
+    origin = origin.rstrip('.').lower()
+    ttl_default = str(default_ttl)
+    records = []
+    skipped = 0
+    owner = origin
+    for blank_owner, words in logical_lines(text):
+        if words[0].startswith('$'):
+            directive = words[0].upper()
+            if directive == '$ORIGIN' and len(words) > 1:
+                origin = qualify(words[1], origin)
+            elif directive == '$TTL' and len(words) > 1:
+                ttl_default = str(parse_ttl(words[1]) or ttl_default)
+            else:
+                skipped += 1
+            continue
+        if not blank_owner:
+            owner = qualify(words.pop(0), origin)
+        ttl = ttl_default
+        while words and (words[0].upper() in Classes or parse_ttl(words[0]) is not None):
+            w = words.pop(0)
+            if w.upper() not in Classes:
+                ttl = str(parse_ttl(w))
+        if not words:
+            continue
+        rr_type = words.pop(0).upper()
+        if rr_type not in Wanted:
+            skipped += 1
+            continue
+        if len(words) < Fields[rr_type] or (rr_type != 'TXT' and len(words) > Fields[rr_type]) \
+                or (rr_type == 'MX' and not words[0].isdigit()):
+            print(' '.join([owner, rr_type] + words) + ': malformed, skipped', file=sys.stderr)
+            skipped += 1
+            continue
+        if rr_type == 'A':
+            value = words[0]
+        elif rr_type == 'CNAME':
+            value = qualify(words[0], origin)
+        elif rr_type == 'MX':
+            value = '{}:{}'.format(qualify(words[1], origin), words[0])
+        else:
+            value = ''
+            plain = False
+            for w in words:
+                if w.startswith('"'):
+                    value += w[1:]
+                    plain = False
+                else:
+                    value += (' ' if plain else '') + w
+                    plain = True
+        records.append((owner, rr_type, value, ttl))
+    return records, skipped
+
+
+def read(path, origin='', default_ttl='86400'):
+    with open(path) as fd:
+        return parse(fd.read(), origin, default_ttl)
@@ -0,0 +1,311 @@
+"""
+
+Local index of the DNS zones in config.ViewId
+
+Finding the zone that owns an FQDN used to take one getEntityByName call
+per label. The index holds every zone of the view in a trie keyed on the
+reversed labels, e.g. for the zones ca, utoronto.ca and its.utoronto.ca
+
+    {'ca': {'#': 2203566,
+            'utoronto': {'#': 2217650,
+                         'its': {'#': 2402101}}}}
+
+so the owning zone of www.its.utoronto.ca is the deepest '#' found walking
+ca -> utoronto -> its -> www, done locally in O(labels).
+
+The index is filled from getZonesByHint on the view, which pages through
+every zone below it, 10 a call (list_zones), and is saved to
+config.ZoneIndexFile. Once it is older than config.ZoneIndexTTL, refresh()
+lists every zone of the view again, which costs as many calls as building
+it (one per 10 zones); only the changes are then made to the trie. The
+BAM has no call answering which zones changed since a given time.
+Should the BAM leave absoluteName out of the zones it lists, the index is
+filled by listing the Zone children of the view and then of every zone
+found (api.iter_entities) instead, and each zone remembers when its
+children were last listed so that only the stale ones are listed again.
+api.add_zone, api.add_entity and api.delete keep a loaded index current.
+A zone made outside bamcli is found before the index is listed again:
+when nothing is found under a dotted name below a zone, the labels are
+looked up as zones one by one (util.zone_of with recheck) and the zones
+found are added.
+
+"""
+
+import json
+import os
+import time
+
+from bluecat_am import api, config, util
+
+MARK = '#'
+# getZonesByHint answers at most this many zones a call
+HintPage = 10
+
+
+class ZoneIndex:
+    """Reversed-label trie of zone absolute names"""
+
+    def __init__(self, view_id, zones=None, listed=0):
+        self.view_id = view_id
+        self.listed = listed
+        self.zones = {}
+        self.trie = {}
+        for fqdn, info in (zones or {}).items():
+            self.add(fqdn, info['id'], info.get('listed', 0))
+
+    def __len__(self):
+        return len(self.zones)
+
+    def add(self, fqdn, zone_id, listed=0):
+        fqdn = fqdn.rstrip('.').lower()
+        node = self.trie
+        for label in reversed(fqdn.split('.')):
+            node = node.setdefault(label, {})
+        node[MARK] = zone_id
+        self.zones[fqdn] = {'id': zone_id, 'listed': listed}
+
+    def remove(self, fqdn):
+        """Drop a zone and every zone below it"""
+        fqdn = fqdn.rstrip('.').lower()
+        labels = list(reversed(fqdn.split('.')))
+        node = self.trie
+        for label in labels[:-1]:
+            node = node.get(label)
+            if node is None:
+                return
+        node.pop(labels[-1], None)
+        for name in list(self.zones):
+            if name == fqdn or name.endswith('.' + fqdn):
+                del self.zones[name]
+
+    def remove_id(self, zone_id):
+        for name, info in list(self.zones.items()):
+            if info['id'] == zone_id:
+                self.remove(name)
+
+    def find(self, fqdn):
+        """Longest suffix match of fqdn against the zones
+
+        Returns (zone_id, zone_fqdn, relative_name) where relative_name
+        is '' at the top of the zone, or None if no zone matches
+        """
+        fqdn = fqdn.rstrip('.').lower()
+        labels = fqdn.split('.')
+        node = self.trie
+        best = None
+        depth = 0
+        for label in reversed(labels):
+            node = node.get(label)
+            if node is None:
+                break
+            depth += 1
+            if MARK in node:
+                best = (node[MARK], depth)
+        if best is None:
+            return None
+        zone_id, depth = best
+        cut = len(labels) - depth
+        return zone_id, '.'.join(labels[cut:]), '.'.join(labels[:cut])
+
+    def children(self, fqdn):
+        """Absolute names of the zones directly below fqdn ('' for the view)"""
+        node = self.trie
+        labels = fqdn.split('.') if fqdn else []
+        for label in reversed(labels):
+            node = node.get(label)
+            if node is None:
+                return []
+        return ['.'.join([label] + labels) for label, child in node.items()
+                if label != MARK and MARK in child]
+
+    def zone_id(self, fqdn):
+        info = self.zones.get(fqdn.rstrip('.').lower())
+        return info['id'] if info else None
+
+    def to_json(self):
+        return {'view_id': self.view_id, 'listed': self.listed, 'zones': self.zones}
+
+
+'''
+
+Filling the index from the BAM
+
+'''
+
+
+def absolute_name(ent):
+    for pair in (ent.get('properties') or '').split('|'):
+        if pair.startswith('absoluteName='):
+            return pair.split('=', 1)[1]
+    return None
+
+
+def list_zones(container_id):
+    """Return {absoluteName: id} of every zone below container_id
+
+    Returns None if a zone came without its absoluteName
+    """
+    found = {}
+    pages = api.iter_pages(lambda start, count: api.get_zones_by_hint(container_id, start, count),
+                           HintPage, HintPage)
+    for ent in pages:
+        name = absolute_name(ent)
+        if name is None:
+            return None
+        found[name.lower()] = ent['id']
+    return found
+
+
+def sync(index, zones, now):
+    """Make index hold zones ({absoluteName: id}), return the number of zones added or dropped"""
+    changed = 0
+    for name in [name for name, info in index.zones.items() if zones.get(name) != info['id']]:
+        if name in index.zones:
+            index.remove(name)
+            changed += 1
+    for name, zid in sorted(zones.items(), key=lambda item: item[0].count('.')):
+        if name not in index.zones:
+            index.add(name, zid, now)
+            changed += 1
+        else:
+            index.zones[name]['listed'] = now
+    index.listed = now
+    return changed
+
+
+def list_child_zones(parent_id, parent_fqdn):
+    """Return {absoluteName: id} of the zones directly below parent_id"""
+    found = {}
+    for ent in api.iter_entities(parent_id, 'Zone'):
+        name = absolute_name(ent)
+        if name is None:
+            name = ent['name'] + '.' + parent_fqdn if parent_fqdn else ent['name']
+        found[name.lower()] = ent['id']
+    return found
+
+
+def crawl(index, parent_id, parent_fqdn, limit):
+    """List the zones below parent_id, then below each new zone or
+    each zone whose children were listed before the time limit
+    """
+    todo = [(parent_id, parent_fqdn)]
+    while todo:
+        pid, pfqdn = todo.pop()
+        now = time.time()
+        children = list_child_zones(pid, pfqdn)
+        for name in index.children(pfqdn):
+            if name not in children:
+                index.remove(name)
+        for name, zid in children.items():
+            info = index.zones.get(name)
+            if info is None or info['id'] != zid:
+                index.add(name, zid)
+                todo.append((zid, name))
+            elif info['listed'] < limit:
+                todo.append((zid, name))
+        if pfqdn == '':
+            index.listed = now
+        elif pfqdn in index.zones:
+            index.zones[pfqdn]['listed'] = now
+
+
+def build():
+    index = ZoneIndex(config.ViewId)
+    now = time.time()
+    zones = list_zones(config.ViewId)
+    if zones is None:
+        crawl(index, config.ViewId, '', now)
+    else:
+        sync(index, zones, now)
+    return index
+
+
+def refresh(index, max_age=None):
+    """List the zones again if the index was listed over max_age seconds ago
+
+    The zones of the view are listed in full, as build() does. Returns 0
+    if nothing was stale, else the number of listings that were (1 for
+    the view when the zones are listed in one go)
+    """
+    if max_age is None:
+        max_age = config.ZoneIndexTTL
+    limit = time.time() - max_age
+    if index.listed < limit:
+        now = time.time()
+        zones = list_zones(index.view_id)
+        if zones is not None:
+            sync(index, zones, now)
+            return 1
+        crawl(index, index.view_id, '', limit)
+        return len(index) + 1
+    stale = sorted((name for name, info in index.zones.items() if info['listed'] < limit),
+                   key=lambda name: name.count('.'))
+    for name in stale:
+        info = index.zones.get(name)
+        if info is not None and info['listed'] < limit:
+            crawl(index, info['id'], name, limit)
+    return len(stale)
+
+
+def load():
+    path = config.ZoneIndexFile
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as fd:
+            data = json.load(fd)
+    except (OSError, ValueError):
+        return None
+    if data.get('view_id') != config.ViewId:
+        return None
+    return ZoneIndex(data['view_id'], data.get('zones'), data.get('listed', 0))
+
+
+def save(index):
+    path = config.ZoneIndexFile
+    if not path:
+        return
+    util.write_json_atomic(path, index.to_json(), '.zones.')
+
+
+def get_index():
+    """Return the zone index of config.ViewId, loading, refreshing or building it as needed
+
+    Returns None when the index is disabled
+    """
+    if not config.ZoneIndex:
+        return None
+    index = config.ZoneTree
+    if index is not None and index.view_id == config.ViewId:
+        return index
+    index = load()
+    if index is None:
+        index = build()
+        save(index)
+    elif refresh(index):
+        save(index)
+    config.ZoneTree = index
+    return index
+
+
+'''
+
+Hooks called from bluecat_am.api, they only touch an index already in memory
+
+'''
+
+
+def note_added(fqdn, zone_id):
+    index = config.ZoneTree
+    if index is not None and isinstance(zone_id, int) and zone_id > 0:
+        index.add(fqdn, zone_id)
+        save(index)
+
+
+def note_deleted(obj_id):
+    index = config.ZoneTree
+    if index is not None:
+        before = len(index)
+        index.remove_id(obj_id)
+        if len(index) != before:
+            save(index)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+import pytest
+
+from bluecat_am import cache, config, mockbam
+
+# the settings a login or a bamcli invocation changes, put back after each test
+Touched = ('Baseurl', 'AuthHeader', 'Credentials', 'Username', 'ConfigId', 'ViewId', 'Session',
+           'Silent', 'Debug', 'PoolMaxsize', 'PoolBlock', 'ZoneIndex', 'ZoneTree', 'NetIndex', 'NetTree',
+           'Daemon')
+
+
+@pytest.fixture
+def bam(tmp_path, monkeypatch):
+    """A MockBam holding zone1.uoft.ca and zone2.uoft.ca, with no caches left on disk"""
+    for name in Touched:
+        monkeypatch.setattr(config, name, getattr(config, name))
+    monkeypatch.setattr(config, 'TokenCacheFile', '')
+    monkeypatch.setattr(config, 'ZoneIndexFile', str(tmp_path / 'zones.json'))
+    monkeypatch.setattr(config, 'NetIndexFile', str(tmp_path / 'networks.json'))
+    monkeypatch.setattr(config, 'DaemonSocket', str(tmp_path / 'daemon.sock'))
+    cache.Resolve.clear()
+    cache.Entities.clear()
+    with mockbam.MockBam() as mock:
+        mock.tree = mockbam.generate(mock.store, records=100, zones=2, domain='uoft.ca')
+        yield mock
+    if config.Session is not None:
+        config.Session.close()
+    cache.Resolve.clear()
+    cache.Entities.clear()
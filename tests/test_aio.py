@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bluecat_am import aio, util
+
+pytest.importorskip('aiohttp')
+
+
+def test_call_uses_the_synchronous_session(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+
+    async def main():
+        async with aio.AsyncBam() as client:
+            status, zone = await client.call('GET', 'getEntityById', {'id': zone_id})
+            missing = await client.get_entity_by_name(zone_id, 'no-such-host', 'HostRecord')
+            return status, zone, missing
+
+    status, zone, missing = asyncio.run(main())
+    assert status == 200 and zone['name'] == 'zone1'
+    assert missing['id'] == 0
+    assert bam.calls['login'] == 1
+
+
+def test_relogin_after_401(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+
+    async def main():
+        async with aio.AsyncBam() as client:
+            bam.store.tokens.clear()
+            zones = await client.gather(client.get_entity_by_id(zone_id) for i in range(3))
+            return zones, client.auth_header
+
+    zones, header = asyncio.run(main())
+    assert [z['id'] for z in zones] == [zone_id] * 3
+    # the three 401s share one login
+    assert bam.calls['login'] == 2
+    assert header['Authorization'].split()[1] in bam.store.tokens
+
+
+def test_calls_in_flight_are_capped(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    ids = bam.store.children[(bam.tree['zones']['zone1.uoft.ca'], 'HostRecord')][:12]
+    busy = {'now': 0, 'most': 0}
+    lock = threading.Lock()
+    wait = bam.wait
+
+    def slow(endpoint, items):
+        with lock:
+            busy['now'] += 1
+            busy['most'] = max(busy['most'], busy['now'])
+        time.sleep(0.02)
+        wait(endpoint, items)
+        with lock:
+            busy['now'] -= 1
+
+    bam.wait = slow
+
+    async def main():
+        async with aio.AsyncBam(limit=3) as client:
+            return await client.gather(client.get_entity_by_id(i) for i in ids)
+
+    ents = asyncio.run(main())
+    assert [e['id'] for e in ents] == ids
+    assert busy['most'] == 3
+
+
+def test_iter_pages_lists_everything(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+
+    async def main():
+        async with aio.AsyncBam() as client:
+            return [e['id'] async for e in client.iter_entities(zone_id, 'HostRecord', first=4)]
+
+    ids = asyncio.run(main())
+    assert ids == bam.store.children[(zone_id, 'HostRecord')]
+    # pages of 4, 8, 16 and a short one of 32
+    assert len(ids) == 38 and bam.calls['getEntities'] == 4
+
+
+def test_gather_cancels_the_rest_when_one_fails(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    bam.latencies['getEntityById'] = 0.5
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+    cancelled = []
+
+    async def get(client, i):
+        try:
+            return await client.get_entity_by_id(zone_id)
+        except asyncio.CancelledError:
+            cancelled.append(i)
+            raise
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise ValueError('bad record')
+
+    async def main():
+        async with aio.AsyncBam() as client:
+            await client.gather([get(client, i) for i in range(4)] + [fail()])
+
+    start = time.perf_counter()
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert time.perf_counter() - start < 0.5
+    assert sorted(cancelled) == [0, 1, 2, 3]
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import threading
+import time
+
+from bluecat_am import api, cache, util
+
+
+def test_iter_pages_grows_and_stops_on_short_page():
+    calls = []
+    data = list(range(237))
+
+    def fetch(start, count):
+        calls.append((start, count))
+        return data[start:start + count]
+
+    assert list(api.iter_pages(fetch, 10, 40)) == data
+    assert calls[:3] == [(0, 10), (10, 20), (30, 40)]
+    assert calls[-1] == (230, 40)
+
+
+def test_iter_pages_stops_on_error_page():
+    assert list(api.iter_pages(lambda start, count: False)) == []
+
+
+class SlowResponse:
+    status_code = 200
+    content = b'{}'
+
+
+def test_identical_gets_in_flight_are_sent_once(monkeypatch):
+    sent = []
+
+    def send(method, url, **kwargs):
+        sent.append((method, url))
+        time.sleep(0.2)
+        return SlowResponse()
+
+    monkeypatch.setattr(api, 'send', send)
+    url = 'https://bam/Services/REST/v1/getEntityById'
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(api.bam_request('GET', url, params={'id': 5})))
+               for i in range(4)]
+    threads.append(threading.Thread(target=lambda: got.append(api.bam_request('GET', url, params={'id': 6}))))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(got) == 5
+    assert len(sent) == 2
+    assert api.Flights.stats()['saved'] >= 3
+
+
+def test_failed_update_forgets_the_entity(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+    host_id = util.lookup_name(zone_id, 'host7', 'HostRecord')['id']
+    ent = api.get_entity_by_id(host_id)
+    assert cache.get_entity(host_id) is not None
+
+    # gone from the BAM behind our back, and the id given as a string
+    bam.store.remove(host_id)
+    assert api.update(dict(ent, id=str(host_id))).status_code != 200
+    assert cache.get_entity(host_id) is None
+    assert cache.resolve().get((zone_id, 'host7', 'HostRecord')) is None
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import io
+import json
+
+import pytest
+
+from bluecat_am import batch, util
+
+Lines = '''
+# two FQDNs, each changed in order
+add red.zone1.uoft.ca A 10.128.0.100,10.128.0.101 3600
+add note.zone1.uoft.ca TXT 'Superman and Batman'
+update red.zone1.uoft.ca A 10.128.0.102 600
+delete note.zone1.uoft.ca TXT 'Superman and Batman'
+add blue.zone1.uoft.ca A 10.128.0.50
+update blue.zone1.uoft.ca A 10.20.30.40
+fly red.zone1.uoft.ca A 10.128.0.1
+'''
+
+
+def ndjson(lines):
+    """Lines in the NDJSON form, comments and blank lines kept"""
+    out = []
+    for line in lines.split('\n'):
+        if line.startswith('fly'):
+            line = '{"op": "fly", "fqdn": "red.zone1.uoft.ca", "type": "A", "value": "10.128.0.1"}'
+        elif line and not line.startswith('#'):
+            line = json.dumps(batch.parse_line(line))
+        out.append(line)
+    return '\n'.join(out)
+
+
+def test_parse_line():
+    assert batch.parse_line('  # a comment') is None
+    assert batch.parse_line('') is None
+    assert batch.parse_line("replace note.zip.bigcorp.ca TXT 'a b' 600") == {
+        'op': 'update', 'fqdn': 'note.zip.bigcorp.ca', 'type': 'TXT', 'value': 'a b', 'ttl': '600'}
+    assert batch.parse_line('{"action": "remove", "fqdn": "rouge.zip.bigcorp.ca", "rr_type": "CNAME"}') == {
+        'op': 'delete', 'fqdn': 'rouge.zip.bigcorp.ca', 'type': 'CNAME', 'value': None, 'ttl': '86400'}
+    for bad in ('add red.zip.bigcorp.ca', 'fly red.zip.bigcorp.ca A 10.0.0.1',
+                'add red.zip.bigcorp.ca AAAAA 10.0.0.1', 'add red.zip.bigcorp.ca A',
+                '{"op": "add", "type": "A", "value": "10.0.0.1"}'):
+        with pytest.raises((ValueError, KeyError)):
+            batch.parse_line(bad)
+
+
+def test_parse_ops_numbers_lines():
+    ops = list(batch.parse_ops(io.StringIO(Lines)))
+    assert [lineno for lineno, op, err in ops] == [3, 4, 5, 6, 7, 8, 9]
+    assert [op['op'] for lineno, op, err in ops[:6]] == ['add', 'add', 'update', 'delete', 'add', 'update']
+    assert ops[6][1] is None and 'unknown operation' in str(ops[6][2])
+
+
+@pytest.mark.parametrize('form', ['line', 'ndjson'])
+def test_apply(bam, capsys, form):
+    block = bam.store.children[(bam.store.config_id, 'IP4Block')][0]
+    bam.store.api_addIP4Network(block, '10.128.0.0/24')
+    util.bam_init(bam.url, 'ralph', 'secret')
+    capsys.readouterr()
+
+    summary = batch.apply(io.StringIO(Lines if form == 'line' else ndjson(Lines)), jobs=4)
+    assert (summary['operations'], summary['succeeded'], summary['failed'], summary['unparsable']) == (6, 5, 1, 1)
+    assert [lineno for lineno, op, why in summary['failures']] == [8, 9]
+    # the last line an operation printed says why it failed
+    assert summary['failures'][0][2] == 'None of the IP addresses in 10.20.30.40 could be updated'
+    assert summary['failures'][1][2].startswith('parse error')
+
+    # the operations on red ran in input order
+    red = bam.store.entity(util.find_rr('red.zone1.uoft.ca', 'A')[0])
+    assert 'addresses=10.128.0.102|' in red['properties'] and 'ttl=600|' in red['properties']
+    assert util.find_rr('note.zone1.uoft.ca', 'TXT') == []
+
+    out, err = capsys.readouterr()
+    # what each FQDN's operations printed comes out together
+    assert 'blue.zone1.uoft.ca     IN       A      10.128.0.50\n' \
+           'IP address: 10.20.30.40 is not in a defined network\n' in out
+    assert out.index('added new A record:\nred') < out.index('Updated RR as follows:\nred')
+    assert ': 5 succeeded, 1 failed, 1 unparsable lines\n' in err and err.startswith('6 operations in ')
+    assert '  line 9: parse error: unknown operation: fly' in err
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+from bluecat_am import cache
+from bluecat_am.cache import TTLCache
+
+
+def test_lru_eviction_and_counters():
+    c = TTLCache(maxsize=2, ttl=60)
+    c.put('a', 1)
+    c.put('b', 2)
+    assert c.get('a') == 1
+    c.put('c', 3)
+    assert c.get('b') is None
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.stats()['hits'] == 3
+    assert c.stats()['misses'] == 1
+
+
+def test_ttl_expiry():
+    c = TTLCache(maxsize=10, ttl=-1)
+    c.put('a', 1)
+    assert c.get('a') is None
+    assert len(c) == 0
+
+
+def test_invalidation_hooks():
+    cache.Resolve.clear()
+    cache.Resolve.put((1, 'ca', 'Entity'), {'id': 10, 'name': 'ca', 'type': 'Zone'})
+    cache.Resolve.put((10, 'uoft', 'Entity'), {'id': 20, 'name': 'uoft', 'type': 'Zone'})
+    cache.Resolve.put((20, 'www', 'Entity'), {'id': 30, 'name': 'www', 'type': 'HostRecord'})
+    cache.Resolve.put((20, 'new', 'Entity'), {'id': 0, 'name': None, 'type': None})
+    cache.forget_misses()
+    assert cache.Resolve.get((20, 'new', 'Entity')) is None
+    cache.forget_entity(20)
+    assert cache.Resolve.get((10, 'uoft', 'Entity')) is None
+    assert cache.Resolve.get((20, 'www', 'Entity')) is None
+    assert cache.Resolve.get((1, 'ca', 'Entity'))['id'] == 10
+
+
+def test_entity_cache_write_through(monkeypatch):
+    from bluecat_am import api
+
+    class Response:
+        def __init__(self, body, status_code=200):
+            self.body = body
+            self.status_code = status_code
+
+        def json(self):
+            return self.body
+
+    gets = []
+    ent = {'id': 30, 'name': 'www', 'type': 'HostRecord', 'properties': 'addresses=10.0.0.1|'}
+    monkeypatch.setattr(api, 'bam_request',
+                        lambda method, url, **kw: (gets.append(url) if method == 'GET' else None)
+                        or Response(dict(ent)))
+    cache.Entities.clear()
+    first = api.get_entity_by_id(30)
+    first['properties'] = 'addresses=10.0.0.2|'
+    assert api.get_entity_by_id(30)['properties'] == 'addresses=10.0.0.1|'
+    api.update(first)
+    assert api.get_entity_by_id(30)['properties'] == 'addresses=10.0.0.2|'
+    assert len(gets) == 1
+    api.delete(30)
+    api.get_entity_by_id(30)
+    assert len(gets) == 2
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import gzip
+
+import pytest
+
+from bluecat_am import api, cache, cassette, config, util
+
+
+def fresh_session():
+    api.close_session()
+    config.ZoneTree = None
+    cache.Resolve.clear()
+    cache.Entities.clear()
+
+
+def test_record_and_replay(bam, tmp_path, capsys, monkeypatch):
+    path = str(tmp_path / 'view.bamtrace')
+    monkeypatch.setattr(config, 'Cassette', cassette.Recorder(path, bam.url))
+    util.bam_init(bam.url, 'ralph', 'secret')
+    util.view_rr('host7.zone1.uoft.ca')
+    config.Cassette.close()
+    recorded = capsys.readouterr().out
+    text = gzip.open(path, 'rt').read()
+    assert 'secret' not in text and config.AuthHeader['Authorization'].split()[-1] not in text
+
+    fresh_session()
+    calls = sum(bam.calls.values())
+    config.Cassette = cassette.Player(path, latency='zero')
+    config.Cassette.setup()
+    util.bam_init(config.Cassette.baseurl, config.Cassette.user, None)
+    util.view_rr('host7.zone1.uoft.ca')
+    assert capsys.readouterr().out == recorded
+    assert sum(bam.calls.values()) == calls
+    assert config.Cassette.stats()['missed'] == config.Cassette.stats()['unused'] == 0
+
+    with pytest.raises(cassette.Miss):
+        util.view_rr('host8.zone1.uoft.ca')
+    config.Cassette.close()
+    fresh_session()
@@ -1,113 +1,131 @@
 #!/usr/bin/env python
 
+import shlex
+import subprocess
+import sys
+
 from click.testing import CliRunner
 from bluecat_am.cli import run
 
 VALID_IPS = ['10.128.0.10', '10.128.0.20', '10.128.0.30']
 INVALID_IP = '10.20.30.40'
-Valid_Domains = ['yes.uoft.ca', 'no.uoft.ca']
-INVALID_DOMAINS = ['something.some.thing', 'bozo.uoft.ca']
+VALID_DOMAIN = 'yes.zone1.uoft.ca'
+Valid_Domains = ['zone1.uoft.ca', 'zone2.uoft.ca']
+INVALID_DOMAIN = 'something.some.thing'
 NONEXIST_DOMAIN = 'blah.alex.utoronto.ca'
 
 
-def test_cli_command_group():
-    """Test to make sure subcommands show up in """
-    print()
-    cli = CliRunner()
-    cmd = '--help'
-    result = cli.invoke(run, cmd)
-    print('Ran -> bamcli {}'.format(cmd))
+def bamcli(bam, cmd):
+    """Run bamcli cmd against the mock BAM, return what it printed"""
+    args = ['-U', bam.url, '-p', 'secret', '--no-token-cache', '--no-daemon'] + shlex.split(cmd)
+    result = CliRunner().invoke(run, args)
+    print("Ran 'bamcli {}'".format(cmd))
     print('Got:')
     print(result.stdout)
+    assert result.exception is None or isinstance(result.exception, SystemExit), result.exception
+    return result.stdout
+
+
+def with_network(bam):
+    block = bam.store.children[(bam.store.config_id, 'IP4Block')][0]
+    bam.store.api_addIP4Network(block, '10.128.0.0/24')
+
+
+def test_cli_command_group():
+    """Test to make sure subcommands show up in """
+    result = CliRunner().invoke(run, '--help')
+    for cmd in ('add', 'update', 'delete', 'view', 'find'):
+        assert cmd in result.stdout
+
+
+def test_help_does_not_load_the_api():
+    code = 'import sys\nfrom bluecat_am.cli import run\ntry:\n    run(["--help"])\nexcept SystemExit:\n    pass\n' \
+           'print(sorted(m for m in ("requests", "pkg_resources", "bluecat_am.api") if m in sys.modules))'
+    out = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True).stdout
+    assert out.splitlines()[-1] == '[]'
 
 
-def test_view_zones():
-    print()
-    cli = CliRunner()
+def test_view_zones(bam):
     for zone in Valid_Domains:
-        cmd = 'view {}'.format(zone)
-        result = cli.invoke(run, cmd)
-        print('Executed: bamcli {}'.format(cmd))
-        print('Output:')
-        print(result.stdout)
-
-def test_multiple_A_records():
-    print()
-    cli = CliRunner()
-    cmd = 'add {} A {}'.format(VALID_DOMAIN, VALID_IPS[0])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'add {} A {}'.format(VALID_DOMAIN, VALID_IPS[1])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'add {} A {}'.format(VALID_DOMAIN, VALID_IPS[2])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'view alex.utoronto.ca A'
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'find {} A'.format(VALID_DOMAIN)
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'delete {} A {}'.format(VALID_DOMAIN, VALID_IPS[2])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'delete {} A {}'.format(VALID_DOMAIN, VALID_IPS[1])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
-    cmd = 'delete {} A {}'.format(VALID_DOMAIN, VALID_IPS[0])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
+        out = bamcli(bam, 'view {}'.format(zone))
+        assert '{}     IN       MX'.format(zone) in out
 
 
-def test_add_ip_outside_valid_network():
-    print()
-    cli = CliRunner()
-    cmd = 'add {} A {}'.format(VALID_DOMAIN, INVALID_IP)
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
+def test_multiple_A_records(bam):
+    with_network(bam)
+    for ip in VALID_IPS:
+        bamcli(bam, 'add {} A {}'.format(VALID_DOMAIN, ip))
+    out = bamcli(bam, 'view {} A'.format(VALID_DOMAIN))
+    assert all(ip in out for ip in VALID_IPS)
+    out = bamcli(bam, 'find {} A'.format(VALID_DOMAIN))
+    assert out.startswith('[') and out.count(',') == 0
+    for ip in reversed(VALID_IPS):
+        bamcli(bam, 'delete {} A {}'.format(VALID_DOMAIN, ip))
+    out = bamcli(bam, 'view {} A'.format(VALID_DOMAIN))
+    assert not any(ip in out for ip in VALID_IPS)
 
 
-def test_add_fqdn_outside_range():
-    print()
-    cli = CliRunner()
-    cmd = 'add {} A {}'.format(INVALID_DOMAIN, VALID_IPS[0])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
+def test_add_ip_outside_valid_network(bam):
+    with_network(bam)
+    bamcli(bam, 'add {} A {}'.format(VALID_DOMAIN, VALID_IPS[0]))
+    out = bamcli(bam, 'update {} A {}'.format(VALID_DOMAIN, INVALID_IP))
+    assert 'is not in a defined network' in out
 
 
-def test_delete_non_existant_FQDN():
-    print()
-    cli = CliRunner()
-    cmd = 'delete {} A {}'.format(NONEXIST_DOMAIN, VALID_IPS[0])
-    result = cli.invoke(run, cmd)
-    print("Ran 'bamcli {}'".format(cmd))
-    print("Got:")
-    print(result.stdout)
+def test_add_fqdn_outside_range(bam):
+    bamcli(bam, 'add {} A {}'.format(INVALID_DOMAIN, VALID_IPS[0]))
+    hosts = [bam.store.entity(i)['properties'] for i in bam.store.children_of_type('HostRecord')]
+    assert not any(INVALID_DOMAIN in p for p in hosts)
+
+
+def test_delete_non_existant_FQDN(bam):
+    bamcli(bam, 'delete {} A {}'.format(NONEXIST_DOMAIN, VALID_IPS[0]))
+    assert bam.calls['delete'] == 0
+
+
+def zone_records(bam, zone):
+    """The RR entities of a zone in the mock BAM"""
+    zone_id = bam.tree['zones'][zone]
+    types = ('HostRecord', 'AliasRecord', 'MXRecord', 'TXTRecord')
+    return [bam.store.entity(i) for typ in types for i in bam.store.children[(zone_id, typ)]]
+
+
+def without_ttl(bam, zone):
+    """{id: properties} of the RRs of zone that have no TTL"""
+    return {ent['id']: ent['properties'] for ent in zone_records(bam, zone) if 'ttl=' not in ent['properties']}
+
+
+def test_ttl_normalize_dry_run(bam):
+    before = zone_records(bam, Valid_Domains[0])
+    todo = without_ttl(bam, Valid_Domains[0])
+    out = bamcli(bam, 'ttl normalize {} --ttl 7200 --dry-run'.format(Valid_Domains[0]))
+    assert bam.calls['update'] == 0
+    assert zone_records(bam, Valid_Domains[0]) == before
+    assert out.count('would set ttl=7200 on ') == len(todo)
+    assert '{} RRs would be given a TTL of 7200'.format(len(todo)) in out
+
+
+def test_ttl_normalize(bam):
+    before = {ent['id']: ent['properties'] for ent in zone_records(bam, Valid_Domains[0])}
+    todo = without_ttl(bam, Valid_Domains[0])
+    other = zone_records(bam, Valid_Domains[1])
+    # more than one batch of config.MaxWorkers updates
+    assert len(todo) > 8
+    out = bamcli(bam, 'ttl normalize {} --ttl 7200'.format(Valid_Domains[0]))
+    assert bam.calls['update'] == len(todo)
+    for ent in zone_records(bam, Valid_Domains[0]):
+        if ent['id'] in todo:
+            assert ent['properties'] == todo[ent['id']] + 'ttl=7200|'
+        else:
+            assert ent['properties'] == before[ent['id']]
+    assert '{} RRs given a TTL of 7200'.format(len(todo)) in out
+    # the other zone is left alone
+    assert zone_records(bam, Valid_Domains[1]) == other
+
 
 def main():
     test_cli_command_group()
-    test_view_zones()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import threading
+
+from bluecat_am import config, util
+from bluecat_am.client import BamClient
+
+
+def test_clients_have_their_own_settings():
+    one = BamClient('https://bam1/', 'ralph', 'pw', ViewId=11)
+    two = BamClient('https://bam2/', 'alice', 'pw', ViewId=22, MaxWorkers=4)
+    seen = {}
+
+    def work(client, name):
+        with client.current():
+            config.Silent = True
+            # the pool threads of fan_out work for the same client
+            seen[name] = util.fan_out(lambda i: (config.ViewId, config.MaxWorkers), range(3))
+
+    threads = [threading.Thread(target=work, args=(one, 'one')), threading.Thread(target=work, args=(two, 'two'))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert seen['one'] == [(11, config.MaxWorkers)] * 3
+    assert seen['two'] == [(22, 4)] * 3
+    assert one.settings['Silent'] and two.settings['Silent']
+    assert config.ViewId == 0 and not config.Silent
+    assert one.settings['ResolveCache'] is not two.settings['ResolveCache']
+
+
+def test_methods_run_as_the_client(monkeypatch):
+    bam = BamClient(ViewId=33)
+    monkeypatch.setattr(util, 'zone_of', lambda fqdn: (config.ViewId, fqdn, ''))
+    assert util.zone_of('zip.bigcorp.ca')[0] == 0
+    assert bam.call(util.zone_of, 'zip.bigcorp.ca')[0] == 33
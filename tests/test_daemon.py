@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+import sys
+import threading
+import time
+
+from bluecat_am import batch, config, daemon, daemonclient, singleflight
+
+
+def test_singleflight_shares_one_call():
+    flights = singleflight.Group()
+    calls = []
+
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.2)
+        return x * 2
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flights.do('k', slow, 21))) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [42] * 4
+    assert calls == [21]
+    assert flights.stats() == {'calls': 1, 'saved': 3, 'in_flight': 0}
+
+
+def start(path, monkeypatch):
+    out = batch.ThreadOutput(sys.stdout)
+    monkeypatch.setattr(sys, 'stdout', out)
+    server = daemon.UnixServer(path, daemon.Handler)
+    server.out = out
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_daemon_runs_operations(tmp_path, monkeypatch):
+    path = str(tmp_path / 'daemon.sock')
+    monkeypatch.setitem(daemon.Operations, 'find', lambda fqdn, *argv: print('looking') or [7])
+    server = start(path, monkeypatch)
+    try:
+        assert daemonclient.available(path)
+        answer = daemonclient.request('POST', '/find', {'args': ['www.zip.bigcorp.ca', 'A']}, path=path)
+        assert answer == {'ok': True, 'result': [7], 'output': 'looking\n'}
+        assert not daemonclient.request('POST', '/format', {'args': []}, path=path)['ok']
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_daemon_serves_only_its_own_bam_and_the_callers_flags(tmp_path, monkeypatch):
+    path = str(tmp_path / 'daemon.sock')
+    monkeypatch.setattr(config, 'Baseurl', 'http://bam.bigcorp.ca/Services/REST/v1/')
+    monkeypatch.setattr(config, 'Username', 'ralph')
+    monkeypatch.setattr(config, 'DaemonSocket', path)
+    monkeypatch.setitem(daemon.Operations, 'view', lambda fqdn: print(config.Silent, config.Debug))
+    server = start(path, monkeypatch)
+    try:
+        assert daemonclient.available(path, 'http://bam.bigcorp.ca/Services/REST/v1', 'ralph')
+        assert not daemonclient.available(path, 'http://other.bigcorp.ca/Services/REST/v1', 'ralph')
+        assert not daemonclient.available(path, 'http://bam.bigcorp.ca/Services/REST/v1', 'alice')
+
+        answer = daemonclient.request('POST', '/view', {'args': ['zip.bigcorp.ca'], 'silent': True},
+                                      path=path)
+        assert answer['output'] == 'True False\n'
+        answer = daemonclient.request('POST', '/view', {'args': ['zip.bigcorp.ca'], 'debug': True},
+                                      path=path)
+        assert answer['output'] == 'False True\n'
+        assert config.Silent is False and config.Debug is False
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import io
+import json
+
+from bluecat_am import export, zonefile
+
+CHILD_ZONES = {
+    1: {'sub.zip.bigcorp.ca': 2},
+    2: {},
+}
+
+RECORDS = {
+    (1, 'HostRecord'): [
+        {'id': 11, 'name': 'www', 'type': 'HostRecord',
+         'properties': 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.100,10.10.0.101|ttl=3600|'},
+    ],
+    (1, 'MXRecord'): [
+        {'id': 12, 'name': '', 'type': 'MXRecord',
+         'properties': 'absoluteName=zip.bigcorp.ca|linkedRecordName=smtp.zip.bigcorp.ca|priority=10|'},
+    ],
+    (2, 'TXTRecord'): [
+        {'id': 21, 'name': 'note', 'type': 'TXTRecord',
+         'properties': 'absoluteName=note.sub.zip.bigcorp.ca|txt=say "hi"|ttl=300|'},
+    ],
+}
+
+
+def fake_bam(monkeypatch):
+    monkeypatch.setattr(export.util, 'get_zone_id', lambda fqdn: 1)
+    monkeypatch.setattr(export.api, 'iter_entities', lambda pid, typ: iter(RECORDS.get((pid, typ), [])))
+    monkeypatch.setattr(export.zoneindex, 'list_child_zones', lambda pid, fqdn: dict(CHILD_ZONES[pid]))
+
+
+def test_export_ndjson(monkeypatch):
+    fake_bam(monkeypatch)
+    out = io.StringIO()
+    assert export.export_zone('zip.bigcorp.ca', 'ndjson', out)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r['fqdn'], r['type'], r['value']) for r in rows] == [
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.101'),
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca'),
+    ]
+    assert rows[2]['priority'] == '10'
+
+
+def test_export_recursive_bind_reads_back(monkeypatch):
+    fake_bam(monkeypatch)
+    out = io.StringIO()
+    assert export.export_zone('zip.bigcorp.ca', 'bind', out, recursive=True)
+    records, skipped = zonefile.parse(out.getvalue())
+    assert sorted(records) == [
+        ('note.sub.zip.bigcorp.ca', 'TXT', 'say "hi"', '300'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.101', '3600'),
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:10', '86400'),
+    ]
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import time
+
+from bluecat_am import config, mockbam, util
+
+
+def test_generated_tree():
+    store = mockbam.Store()
+    tree = mockbam.generate(store, records=1000, zones=4)
+    assert sorted(tree['zones']) == ['zone{}.bigcorp.ca'.format(n) for n in range(1, 5)]
+    zone_id = tree['zones']['zone1.bigcorp.ca']
+    kinds = {typ: len(store.children[(zone_id, typ)])
+             for typ in ('HostRecord', 'AliasRecord', 'TXTRecord', 'MXRecord')}
+    assert kinds == {'HostRecord': 178, 'AliasRecord': 36, 'TXTRecord': 24, 'MXRecord': 12}
+    host = store.entity(store.children[(zone_id, 'HostRecord')][0])
+    ip = util.props2dict(host['properties'])['addresses'].split(',')[0]
+    assert store.network_of(ip) in tree['networks']
+    assert store.network_of('192.168.1.1') == 0
+
+
+def test_round_trip(bam, capsys):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    assert config.ViewId == bam.store.view_id
+    ip = bam.tree['addresses'].take()
+    util.add_rr('www.zone1.uoft.ca', 'A', [ip], '3600')
+    assert len(util.find_rr('www.zone1.uoft.ca', 'A', ip)) == 1
+    util.update_rr('www.zone1.uoft.ca', 'A', ip, '600')
+    util.delete_rr('www.zone1.uoft.ca', 'A', [ip])
+    assert util.find_rr('www.zone1.uoft.ca', 'A') == []
+    out = capsys.readouterr().out
+    assert 'www.zone1.uoft.ca     IN   600 A      {}'.format(ip) in out
+    assert bam.calls['addHostRecord'] == bam.calls['update'] == bam.calls['delete'] == 1
+
+
+def test_latency_is_added(bam):
+    bam.latencies['getSystemInfo'] = 0.05
+    util.bam_init(bam.url, 'ralph', 'secret')
+    start = time.perf_counter()
+    util.api.get_system_info()
+    assert time.perf_counter() - start >= 0.05
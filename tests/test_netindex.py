@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+from bluecat_am import config, netindex, util
+from bluecat_am.netindex import NetIndex
+
+
+def make_index():
+    blocks = {'10.0.0.0/8': 1, '10.128.0.0/16': 2, '128.100.0.0/16': 3}
+    networks = {'10.128.0.0/24': 20, '10.128.2.0/23': 21, '128.100.62.0/25': 30}
+    return NetIndex(5, blocks, networks)
+
+
+def test_network_and_innermost_block():
+    index = make_index()
+    assert index.network('10.128.0.77') == 20
+    assert index.network('10.128.3.255') == 21
+    assert index.network('10.128.1.1') == 0
+    assert index.network('128.100.62.200') == 0
+    assert index.block('10.128.1.1') == 2
+    assert index.block('10.200.0.1') == 1
+    assert index.block('11.0.0.1') == 0
+
+
+def test_find_all_and_changes():
+    index = make_index()
+    ips = ['128.100.62.1', '10.128.2.9', 'bogus', '10.128.1.1', '10.128.0.1']
+    assert index.find_all(ips) == {'128.100.62.1': 30, '10.128.2.9': 21, 'bogus': 0,
+                                   '10.128.1.1': 0, '10.128.0.1': 20}
+    index.add('IP4Network', '10.128.1.0/24', 22)
+    assert index.network('10.128.1.1') == 22
+    assert index.remove_id(20) and index.network('10.128.0.77') == 0
+    again = NetIndex(5, **{k: v for k, v in index.to_json().items() if k in ('blocks', 'networks')})
+    assert again.network('10.128.1.1') == 22
+
+
+def test_update_checks_addresses_locally(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    block = bam.store.children[(bam.store.config_id, 'IP4Block')][0]
+    bam.store.api_addIP4Network(block, '10.128.0.0/24')
+    fqdn = 'yes.zone1.uoft.ca'
+    util.add_rr(fqdn, 'A', ['10.128.0.10'], '3600')
+
+    util.update_rr(fqdn, 'A', '10.128.0.20,10.128.0.30', '3600')
+    assert bam.calls['getIPRangedByIP'] == 0
+    assert len(netindex.load()) == len(config.NetTree)
+
+    # a network the index has not seen is asked about, and remembered
+    bam.store.api_addIP4Network(block, '10.128.1.0/24')
+    util.update_rr(fqdn, 'A', '10.128.0.20,10.128.1.5,10.20.30.40', '3600')
+    assert bam.calls['getIPRangedByIP'] == 2
+    assert config.NetTree.network('10.128.1.5')
+    props = bam.store.entity(util.find_rr(fqdn, 'A')[0])['properties']
+    assert 'addresses=10.128.0.20,10.128.1.5|' in props
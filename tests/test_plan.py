@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+import pytest
+
+from bluecat_am import config, plan, util, zonefile
+
+ZONE = '''
+$TTL 3600
+$ORIGIN zip.bigcorp.ca.
+@       IN  SOA ns1 hostmaster (
+                2024010101 ; serial
+                3600 600 86400 300 )
+        IN  NS  ns1
+        IN  MX  10 smtp
+www         A   10.10.0.100
+            A   10.10.0.101
+rouge 300 IN CNAME red.zip.bigcorp.ca.
+note        TXT "Superman and" " Batman" ; a comment
+'''
+
+
+def test_parse_zonefile():
+    records, skipped = zonefile.parse(ZONE, 'zip.bigcorp.ca')
+    assert records == [
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:10', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.101', '3600'),
+        ('rouge.zip.bigcorp.ca', 'CNAME', 'red.zip.bigcorp.ca', '300'),
+        ('note.zip.bigcorp.ca', 'TXT', 'Superman and Batman', '3600'),
+    ]
+    assert skipped == 2
+
+
+def test_parse_malformed_lines_are_skipped(capsys):
+    records, skipped = zonefile.parse('''
+mail    MX  10
+mx2     MX  smtp
+www     A
+www     A   10.10.0.1 10.10.0.2
+note    TXT Superman and Batman
+ok      MX  20 smtp
+''', 'zip.bigcorp.ca')
+    assert records == [
+        ('note.zip.bigcorp.ca', 'TXT', 'Superman and Batman', '86400'),
+        ('ok.zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20', '86400'),
+    ]
+    assert skipped == 4
+    err = capsys.readouterr().err
+    assert 'mail.zip.bigcorp.ca MX 10: malformed, skipped' in err
+    assert err.count('malformed') == 4
+
+
+def entity(eid, typ, props):
+    return {'id': eid, 'name': '', 'type': typ, 'properties': props}
+
+
+def current_of(ents):
+    current = {}
+    for ent in ents:
+        fqdn, rr_type, values, ttl = plan.entity_values(ent)
+        current.setdefault((fqdn, rr_type), []).append((ent, values, ttl))
+    return current
+
+
+def test_unchanged_zone_needs_no_operations():
+    records, skipped = zonefile.parse(ZONE, 'zip.bigcorp.ca')
+    current = current_of([
+        entity(1, 'MXRecord', 'absoluteName=zip.bigcorp.ca|linkedRecordName=SMTP.zip.bigcorp.ca|'
+                              'priority=10|ttl=3600|'),
+        entity(2, 'HostRecord', 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.101,10.10.0.100|ttl=3600|'),
+        entity(3, 'AliasRecord', 'absoluteName=rouge.zip.bigcorp.ca|linkedRecordName=red.zip.bigcorp.ca|ttl=300|'),
+        entity(4, 'TXTRecord', 'absoluteName=note.zip.bigcorp.ca|txt=Superman and Batman|ttl=3600|'),
+    ])
+    assert plan.diff(plan.desired_state(records), current, {'zip.bigcorp.ca'}) == []
+
+
+def test_minimal_operations():
+    desired = plan.desired_state([
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('new.zip.bigcorp.ca', 'A', '10.10.0.7', '3600'),
+        ('zip.bigcorp.ca', 'TXT', 'v=spf1 -all', '3600'),
+    ])
+    current = current_of([
+        entity(1, 'MXRecord', 'absoluteName=zip.bigcorp.ca|linkedRecordName=smtp.zip.bigcorp.ca|'
+                              'priority=10|ttl=3600|'),
+        entity(2, 'HostRecord', 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.100,10.10.0.101|ttl=3600|'),
+        entity(3, 'AliasRecord', 'absoluteName=rouge.zip.bigcorp.ca|linkedRecordName=red.zip.bigcorp.ca|'),
+    ])
+    ops = plan.diff(desired, current, {'zip.bigcorp.ca'})
+    got = [(op['op'], op['fqdn'], op['type'], op['value'], op['apex']) for op in ops]
+    assert got == [
+        ('delete', 'rouge.zip.bigcorp.ca', 'CNAME', 'red.zip.bigcorp.ca', False),
+        ('update', 'www.zip.bigcorp.ca', 'A', '10.10.0.100', False),
+        ('update', 'zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20', False),
+        ('add', 'new.zip.bigcorp.ca', 'A', '10.10.0.7', False),
+        ('add', 'zip.bigcorp.ca', 'TXT', 'v=spf1 -all', True),
+    ]
+    assert plan.count(ops) == {'delete': 1, 'update': 2, 'add': 2}
+    assert [op['op'] for op in plan.diff(desired, current, prune=False)].count('delete') == 0
+
+
+def test_without_pruning_nothing_is_taken_away():
+    current = current_of([
+        entity(1, 'MXRecord', 'absoluteName=zip.bigcorp.ca|linkedRecordName=smtp.zip.bigcorp.ca|'
+                              'priority=10|ttl=3600|'),
+        entity(2, 'HostRecord', 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.100,10.10.0.101|ttl=3600|'),
+    ])
+    # every address is there already
+    desired = plan.desired_state([('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600')])
+    assert plan.diff(desired, current, prune=False) == []
+
+    desired = plan.desired_state([
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.102', '3600'),
+    ])
+    ops = plan.diff(desired, current, {'zip.bigcorp.ca'}, prune=False)
+    got = [(op['op'], op['fqdn'], op['type'], op['value']) for op in ops]
+    assert got == [
+        ('update', 'www.zip.bigcorp.ca', 'A', '10.10.0.100,10.10.0.101,10.10.0.102'),
+        ('add', 'zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20'),
+    ]
+
+    # only the TTL differs
+    desired = plan.desired_state([('www.zip.bigcorp.ca', 'A', '10.10.0.101', '600')])
+    ops = plan.diff(desired, current, prune=False)
+    assert [(op['op'], op['value'], op['ttl']) for op in ops] == [('update', '10.10.0.100,10.10.0.101', '600')]
+
+
+STATE = '''
+zones:
+  zip.bigcorp.ca:
+    ttl: 3600
+    records:
+      - {name: www, type: A, value: [10.10.0.100, 10.10.0.101]}
+      - {name: '@', type: MX, value: smtp.zip.bigcorp.ca, priority: 20}
+      - {fqdn: rouge.zip.bigcorp.ca, type: CNAME, value: red.zip.bigcorp.ca, ttl: 300}
+  sub.zip.bigcorp.ca:
+    prune: false
+'''
+
+
+def test_load_state(tmp_path):
+    pytest.importorskip('yaml')
+    path = tmp_path / 'state.yaml'
+    path.write_text(STATE)
+    state = plan.load_state(str(path))
+    assert state['zip.bigcorp.ca']['records'] == [
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.101', '3600'),
+        ('zip.bigcorp.ca', 'MX', 'smtp.zip.bigcorp.ca:20', '3600'),
+        ('rouge.zip.bigcorp.ca', 'CNAME', 'red.zip.bigcorp.ca', '300'),
+    ]
+    assert state['zip.bigcorp.ca']['prune'] is True
+    assert state['sub.zip.bigcorp.ca'] == {'records': [], 'prune': False}
+
+
+def test_plan_zone_leaves_other_planned_zones_alone(monkeypatch):
+    zones = {'zip.bigcorp.ca': 1, 'sub.zip.bigcorp.ca': 2}
+    read = []
+    monkeypatch.setattr(plan.util, 'get_zone_id', lambda fqdn: zones[fqdn])
+    monkeypatch.setattr(plan.util, 'zone_of', lambda fqdn: (2, 'sub.zip.bigcorp.ca', 'x')
+                        if fqdn.endswith('sub.zip.bigcorp.ca') else (1, 'zip.bigcorp.ca', 'x'))
+    monkeypatch.setattr(plan, 'read_zone', lambda zone_id: read.append(zone_id) or {})
+    ops = plan.plan_zone('zip.bigcorp.ca', [
+        ('www.zip.bigcorp.ca', 'A', '10.10.0.100', '3600'),
+        ('www.sub.zip.bigcorp.ca', 'A', '10.10.0.200', '3600'),
+    ], others=zones)
+    assert read == [1]
+    assert [(op['op'], op['fqdn']) for op in ops] == [('add', 'www.zip.bigcorp.ca')]
+
+
+def test_plan_zone_prunes_only_the_zone_named(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone1 = bam.tree['zones']['zone1.uoft.ca']
+    before = {typ: list(bam.store.children[(zone1, typ)])
+              for typ in ('HostRecord', 'AliasRecord', 'MXRecord', 'TXTRecord')}
+    ops = plan.plan_zone('uoft.ca', [('www.zone1.uoft.ca', 'A', '10.0.0.1', '3600')])
+    # the A record at the top of uoft.ca goes, zone1.uoft.ca only gains www
+    assert [(op['op'], op['fqdn']) for op in ops] == [('delete', 'uoft.ca'), ('add', 'www.zone1.uoft.ca')]
+    assert plan.execute(ops) == []
+    for typ, ids in before.items():
+        assert set(ids) <= set(bam.store.children[(zone1, typ)])
+    assert len(util.find_rr('www.zone1.uoft.ca', 'A')) == 1
+
+
+def test_plan_state_counts_only_the_reads(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    state = {'zone1.uoft.ca': {'records': [('www.zone1.uoft.ca', 'A', '10.0.0.1', '3600')], 'prune': False}}
+    start = sum(config.RequestCounts.values())
+    plans, reads = plan.plan_state(state)
+    # building the zone index is not counted, sync finds it built
+    assert sum(config.RequestCounts.values()) - start > reads
+    assert [op['op'] for op in plans['zone1.uoft.ca']] == ['add']
+
+    before = sum(config.RequestCounts.values())
+    plan.read_zone(bam.tree['zones']['zone1.uoft.ca'])
+    assert reads == sum(config.RequestCounts.values()) - before
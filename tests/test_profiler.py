@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+from bluecat_am import api, config, profiler, util
+
+
+class Request:
+    body = b'{}'
+
+
+class Response:
+    status_code = 200
+    content = b'{"id": 1}'
+    request = Request()
+
+
+class Session:
+    def request(self, method, url, **kwargs):
+        return Response()
+
+
+def test_percentile_and_covered():
+    values = [0.1, 0.2, 0.3, 0.4]
+    assert profiler.percentile(values, 0.5) == 0.2
+    assert profiler.percentile(values, 0.95) == 0.4
+    assert profiler.covered([(0, 2), (1, 3), (5, 6)]) == 4
+
+
+def test_calls_are_recorded_with_their_callers(monkeypatch):
+    monkeypatch.setattr(config, 'Session', Session())
+    monkeypatch.setattr(config, 'Profiler', profiler.Profiler())
+    monkeypatch.setattr(config, 'MaxWorkers', 4)
+    util.fan_out(lambda i: api.send('GET', 'https://bam/Services/REST/v1/getEntityById'), range(3))
+    api.send('PUT', 'https://bam/Services/REST/v1/update', json={})
+    prof = config.Profiler
+    prof.stop()
+    assert len(prof.calls) == 4
+    assert {c.endpoint for c in prof.calls} == {'getEntityById', 'update'}
+    # calls made in the pool count the function that handed them over
+    get = [c for c in prof.calls if c.method == 'GET'][0]
+    assert [name for fid, name in get.frames] == ['util.fan_out']
+    lines = prof.summary()
+    assert lines[0].split()[0] == 'endpoint'
+    assert any(line.startswith('GET getEntityById') and ' 3 ' in line for line in lines)
+    assert any(line.startswith('bytes: 8 B sent') for line in lines)
+    trace = prof.chrome_trace()['traceEvents']
+    assert len([e for e in trace if e.get('cat') == 'api']) == 4
+    assert any(e['name'] == 'util.fan_out' for e in trace)
+
+
+def test_passwords_are_not_kept(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, 'Session', Session())
+    monkeypatch.setattr(config, 'Profiler', profiler.Profiler())
+    api.send('GET', 'https://bam/Services/REST/v1/login', params={'username': 'ralph', 'password': 'hunter2'})
+    path = tmp_path / 'trace.json'
+    config.Profiler.write_trace(str(path))
+    assert config.Profiler.calls[0].params['username'] == 'ralph'
+    assert 'hunter2' not in path.read_text()
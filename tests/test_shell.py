@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+
+import io
+
+from bluecat_am import shell
+
+
+def test_repl_dispatches_until_quit(capsys):
+    seen = []
+    lines = io.StringIO('view zip.bigcorp.ca A\n\n# comment\nadd note.zip.bigcorp.ca TXT "Superman and Batman"\n'
+                        ':stats\n:quit\nview never.run.ca\n')
+    shell.repl(['view', 'add'], seen.append, lines)
+    assert seen == [['view', 'zip.bigcorp.ca', 'A'], ['add', 'note.zip.bigcorp.ca', 'TXT', 'Superman and Batman']]
+    assert 'API calls:' in capsys.readouterr().out
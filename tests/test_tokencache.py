@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+import os
+import time
+
+from bluecat_am import api, config, tokencache, util
+
+Url = 'https://bam.bigcorp.ca/Services/REST/v1/'
+
+
+def test_sessions_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'TokenCacheFile', str(tmp_path / 'cache' / 'session.json'))
+    tokencache.save(Url, 'fred', 'abc')
+    assert tokencache.load(Url, 'fred')['token'] == 'abc'
+    assert tokencache.load(Url, 'ralph') is None
+    assert os.stat(config.TokenCacheFile).st_mode & 0o777 == 0o600
+    assert os.listdir(str(tmp_path / 'cache')) == ['session.json']
+
+    later = time.time() + config.TokenLifetime + 1
+    monkeypatch.setattr(tokencache.time, 'time', lambda: later)
+    assert tokencache.load(Url, 'fred') is None
+    # and expired entries are dropped on the next save
+    tokencache.save(Url, 'ralph', 'def')
+    assert list(tokencache.read_cache()) == [tokencache.cache_key(Url, 'ralph')]
+
+
+def test_open_files_are_ignored(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'TokenCacheFile', str(tmp_path / 'session.json'))
+    tokencache.save(Url, 'fred', 'abc')
+    os.chmod(config.TokenCacheFile, 0o644)
+    assert tokencache.load(Url, 'fred') is None
+
+
+def test_relogin_after_401_on_a_cached_token(bam, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'TokenCacheFile', str(tmp_path / 'session.json'))
+    util.bam_init(bam.url, 'ralph', 'secret')
+    zone_id = bam.tree['zones']['zone1.uoft.ca']
+
+    # the next run reuses the token, which the BAM has since forgotten
+    bam.store.tokens.clear()
+    config.AuthHeader = {}
+    util.bam_init(bam.url, 'ralph', 'secret')
+    assert bam.calls['login'] == 1
+    assert api.get_entity_by_id(zone_id)['id'] == zone_id
+    assert bam.calls['login'] == 2
+    token = tokencache.load(bam.url, 'ralph')['token']
+    assert token in bam.store.tokens
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+from bluecat_am import config, util
+
+
+class Response:
+    status_code = 200
+    text = ''
+
+
+def fake_host(monkeypatch, addresses):
+    calls = []
+    ents = []
+    if addresses:
+        ents.append({'id': 7, 'name': 'www', 'type': 'HostRecord',
+                     'properties': 'absoluteName=www.zip.bigcorp.ca|addresses={}|ttl=3600|'.format(addresses)})
+    monkeypatch.setattr(config, 'Silent', True)
+    monkeypatch.setattr(util, 'find_rr_entities', lambda fqdn, *argv: calls.append(('find',) + argv) or ents)
+    monkeypatch.setattr(util, 'is_zone', lambda fqdn: False)
+    monkeypatch.setattr(util.api, 'update', lambda ent: calls.append(('update', ent['properties'])) or Response())
+    monkeypatch.setattr(util.api, 'delete', lambda obj_id: calls.append(('delete', obj_id)) or Response())
+    monkeypatch.setattr(util.api, 'add_host_record',
+                        lambda fqdn, ips, ttl: calls.append(('add', fqdn, ips)) or 8)
+    return calls
+
+
+def test_add_many_addresses_is_one_write(monkeypatch):
+    calls = fake_host(monkeypatch, '10.10.0.1')
+    assert util.add_rr('www.zip.bigcorp.ca', 'A', ['10.10.0.1', '10.10.0.2', '10.10.0.3'], '3600') == [7]
+    assert calls == [('find', 'A'),
+                     ('update', 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.1,10.10.0.2,10.10.0.3|ttl=3600|')]
+
+
+def test_add_addresses_to_new_host(monkeypatch):
+    calls = fake_host(monkeypatch, '')
+    assert util.add_rr('www.zip.bigcorp.ca', 'A', ['10.10.0.1', '10.10.0.2'], '3600') == [8]
+    assert calls == [('find', 'A'), ('add', 'www.zip.bigcorp.ca', '10.10.0.1,10.10.0.2')]
+
+
+def test_delete_many_addresses(monkeypatch):
+    calls = fake_host(monkeypatch, '10.10.0.1,10.10.0.2,10.10.0.3')
+    assert util.delete_rr('www.zip.bigcorp.ca', 'A', ['10.10.0.1', '10.10.0.3'])
+    assert calls == [('find', 'A'), ('update', 'absoluteName=www.zip.bigcorp.ca|addresses=10.10.0.2|ttl=3600|')]
+
+    calls = fake_host(monkeypatch, '10.10.0.1,10.10.0.2')
+    assert util.delete_rr('www.zip.bigcorp.ca', 'A', ['10.10.0.1', '10.10.0.2'])
+    assert calls == [('find', 'A'), ('delete', 7)]
+
+
+def test_info_by_name_lists_nothing_unless_debugging(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    assert util.is_host_record('host7.zone1.uoft.ca')
+    assert bam.calls['getEntities'] == 0
+
+
+def test_rights_list_each_parent_once(bam, capsys):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    util.show_rights('ralph')
+    out = capsys.readouterr().out
+    assert out == 'CIDR blocks:\n    10.0.1.0/24\nDomains:\n    zone1.uoft.ca\n    zone2.uoft.ca\n'
+    # both zones are below uoft.ca, the network in a block: two parents, two types each
+    assert bam.calls['getParent'] == 3
+    assert bam.calls['getEntities'] == 4
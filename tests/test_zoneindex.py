@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+from bluecat_am import config, mockbam, util, zoneindex
+from bluecat_am.zoneindex import ZoneIndex
+
+
+def make_index():
+    index = ZoneIndex(1)
+    index.add('ca', 10)
+    index.add('utoronto.ca', 20)
+    index.add('its.utoronto.ca', 30)
+    return index
+
+
+def test_longest_suffix_match():
+    index = make_index()
+    assert index.find('www.its.utoronto.ca') == (30, 'its.utoronto.ca', 'www')
+    assert index.find('utoronto.ca.') == (20, 'utoronto.ca', '')
+    assert index.find('a.b.utoronto.ca') == (20, 'utoronto.ca', 'a.b')
+    assert index.find('example.com') is None
+
+
+def test_children_and_remove():
+    index = make_index()
+    assert index.children('utoronto.ca') == ['its.utoronto.ca']
+    assert index.children('') == ['ca']
+    index.remove('utoronto.ca')
+    assert index.find('www.its.utoronto.ca') == (10, 'ca', 'www.its.utoronto')
+    assert sorted(index.zones) == ['ca']
+
+
+def test_round_trip():
+    index = ZoneIndex(1, make_index().to_json()['zones'])
+    assert index.zone_id('its.utoronto.ca') == 30
+
+
+def test_build_and_refresh_page_through_the_zones(bam):
+    for i in range(3, 300):
+        mockbam.add_zone(bam.store, 'zone{}.uoft.ca'.format(i))
+    util.bam_init(bam.url, 'ralph', 'secret')
+    before = sum(bam.calls.values())
+    index = zoneindex.build()
+    # ca, uoft.ca and zone1 to zone299, 10 a call
+    assert len(index) == 301
+    assert sum(bam.calls.values()) - before == 31
+    assert index.find('www.zone299.uoft.ca')[1] == 'zone299.uoft.ca'
+
+    mockbam.add_zone(bam.store, 'new.zone7.uoft.ca')
+    bam.store.remove(index.zone_id('zone8.uoft.ca'))
+    assert zoneindex.refresh(index) == 0
+    index.listed -= config.ZoneIndexTTL + 1
+    assert zoneindex.refresh(index) == 1
+    assert index.find('a.new.zone7.uoft.ca')[1] == 'new.zone7.uoft.ca'
+    assert index.zone_id('zone8.uoft.ca') is None
+
+
+def test_zones_made_elsewhere_are_found(bam):
+    util.bam_init(bam.url, 'ralph', 'secret')
+    assert util.find_rr('host7.zone1.uoft.ca', 'A')
+    # made outside bamcli, after the index was listed
+    new_id = mockbam.add_zone(bam.store, 'new.zone1.uoft.ca')
+    www = bam.store.api_addHostRecord(bam.store.view_id, 'www.new.zone1.uoft.ca', '10.0.0.1')
+    assert util.find_rr('www.new.zone1.uoft.ca', 'A') == [www]
+    assert config.ZoneTree.zone_id('new.zone1.uoft.ca') == new_id
+    assert zoneindex.load().zone_id('new.zone1.uoft.ca') == new_id
+
+    newer_id = mockbam.add_zone(bam.store, 'newer.zone1.uoft.ca')
+    assert util.get_zone_id('newer.zone1.uoft.ca') == newer_id
+    deep_id = mockbam.add_zone(bam.store, 'a.b.zone1.uoft.ca')
+    assert util.is_zone('a.b.zone1.uoft.ca') == deep_id
+    assert not util.is_zone('host7.zone1.uoft.ca')